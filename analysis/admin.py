@@ -1,5 +1,12 @@
+from django import forms
 from django.contrib import admin
-from .models import CNPJData, AnalysisResult, AnalysisCriteria, AnalysisLog
+from django.core.cache import cache
+from .models import (
+    CNPJData, AnalysisResult, AnalysisCriteria, AnalysisLog, BatchJob, BatchItem, CNPJDataVersion, CNPJDataChange,
+    Activity, Member, WebhookSubscription, WebhookEvent, ApiKey, ApiKeyUsage
+)
+from .apikeys import key_cache_key
+from .webhooks import WebhookURLError, check_webhook_url, generate_secret
 
 
 @admin.register(CNPJData)
@@ -31,3 +38,112 @@ class AnalysisLogAdmin(admin.ModelAdmin):
     list_filter = ['level', 'timestamp']
     search_fields = ['cnpj', 'message']
     readonly_fields = ['timestamp']
+
+
+@admin.register(BatchJob)
+class BatchJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'file_name', 'status', 'total_items', 'processed_items', 'skipped_items', 'failed_items', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['file_name']
+    readonly_fields = ['created_at', 'started_at', 'finished_at']
+    raw_id_fields = ['api_key']
+
+
+@admin.register(BatchItem)
+class BatchItemAdmin(admin.ModelAdmin):
+    list_display = ['job', 'cnpj', 'status', 'attempts', 'lease_expires_at', 'updated_at']
+    list_filter = ['status']
+    search_fields = ['cnpj']
+    raw_id_fields = ['job', 'analysis_result']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(CNPJDataVersion)
+class CNPJDataVersionAdmin(admin.ModelAdmin):
+    list_display = ['cnpj_data', 'version', 'is_snapshot', 'changed_fields', 'created_at']
+    list_filter = ['is_snapshot', 'created_at']
+    search_fields = ['cnpj_data__cnpj']
+    readonly_fields = ['created_at']
+
+
+@admin.register(CNPJDataChange)
+class CNPJDataChangeAdmin(admin.ModelAdmin):
+    list_display = ['cnpj_data', 'field', 'old_value', 'new_value', 'changed_at']
+    list_filter = ['field', 'changed_at']
+    search_fields = ['cnpj_data__cnpj']
+
+
+@admin.register(Activity)
+class ActivityAdmin(admin.ModelAdmin):
+    list_display = ['code', 'text']
+    search_fields = ['code', 'text']
+
+
+@admin.register(Member)
+class MemberAdmin(admin.ModelAdmin):
+    list_display = ['name', 'tax_id', 'role', 'is_administrator', 'cnpj_data']
+    list_filter = ['is_administrator', 'person_type']
+    search_fields = ['name', 'tax_id', 'cnpj_data__cnpj']
+
+
+class WebhookSubscriptionForm(forms.ModelForm):
+
+    class Meta:
+        model = WebhookSubscription
+        exclude = ['secret']
+
+    def clean_url(self):
+        url = self.cleaned_data['url']
+        try:
+            check_webhook_url(url)
+        except WebhookURLError as e:
+            raise forms.ValidationError(str(e))
+        return url
+
+
+@admin.register(WebhookSubscription)
+class WebhookSubscriptionAdmin(admin.ModelAdmin):
+    form = WebhookSubscriptionForm
+    list_display = ['url', 'description', 'api_key', 'is_active', 'created_at']
+    list_filter = ['is_active']
+    search_fields = ['url', 'description']
+    exclude = ['secret']
+    readonly_fields = ['created_at']
+    raw_id_fields = ['api_key']
+
+    def save_model(self, request, obj, form, change):
+        if not obj.secret:
+            obj.secret = generate_secret()
+        super().save_model(request, obj, form, change)
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'subscription', 'event_type', 'status', 'attempts', 'next_attempt_at', 'delivered_at']
+    list_filter = ['status', 'event_type']
+    raw_id_fields = ['subscription']
+    readonly_fields = ['created_at', 'delivered_at']
+
+
+@admin.register(ApiKey)
+class ApiKeyAdmin(admin.ModelAdmin):
+    list_display = ['name', 'prefix', 'is_active', 'rate_limit_per_minute', 'monthly_quota', 'created_at']
+    list_filter = ['is_active']
+    search_fields = ['name', 'prefix']
+    readonly_fields = ['prefix', 'key_hash', 'created_at']
+
+    def has_add_permission(self, request):
+        # A chave em texto só pode ser mostrada uma vez: use o comando create_api_key
+        return False
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        cache.delete(key_cache_key(obj.key_hash))
+
+
+@admin.register(ApiKeyUsage)
+class ApiKeyUsageAdmin(admin.ModelAdmin):
+    list_display = ['api_key', 'month', 'cached_requests', 'upstream_requests', 'updated_at']
+    list_filter = ['month']
+    search_fields = ['api_key__name', 'api_key__prefix']
+    readonly_fields = ['updated_at']
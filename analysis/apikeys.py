@@ -0,0 +1,330 @@
+"""
+Chaves de API: autenticação, limite por minuto, cota mensal e consumo
+
+Nada aqui grava no banco por requisição. A chave é resolvida pelo hash
+SHA-256 (em cache por API_KEY_CACHE_SECONDS) e os contadores ficam no cache,
+incrementados atomicamente (INCR no Redis):
+
+    apikey:rate:<id>:<minuto>            requisições na janela do minuto
+    apikey:usage:<id>:<AAAAMM>:cached     análises servidas do banco
+    apikey:usage:<id>:<AAAAMM>:upstream   análises com consulta à API CNPJA
+
+Os contadores de consumo são totais do mês: quando faltam no cache são
+semeados com o valor já gravado em ApiKeyUsage, e a gravação (flush) copia
+o total do cache para o banco sem nunca diminuí-lo, então pode ser repetida
+por vários processos. Cada processo grava as chaves que usou a cada
+API_USAGE_FLUSH_SECONDS; o comando flush_api_usage grava todas (cron).
+
+Com vários processos o cache precisa ser compartilhado (CACHE_URL): com o
+LocMemCache cada processo conta sozinho.
+"""
+
+import hashlib
+import secrets
+import threading
+import time
+from datetime import date
+from functools import partial, wraps
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import ApiKey, ApiKeyUsage
+
+KEY_HEADER = 'X-API-Key'
+
+USAGE_KINDS = ('cached', 'upstream')
+
+# Contadores de consumo sobrevivem ao mês (o flush do mês anterior ainda os lê)
+USAGE_CACHE_TIMEOUT = 40 * 86400
+
+
+def hash_key(raw_key: str) -> str:
+    return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+
+def create_api_key(name: str, rate_limit_per_minute: Optional[int] = None,
+                   monthly_quota: Optional[int] = None) -> Tuple[ApiKey, str]:
+    """Cria uma chave; o valor em texto só existe no retorno desta função"""
+    raw_key = secrets.token_urlsafe(32)
+    api_key = ApiKey.objects.create(
+        name=name,
+        prefix=raw_key[:8],
+        key_hash=hash_key(raw_key),
+        rate_limit_per_minute=rate_limit_per_minute,
+        monthly_quota=monthly_quota
+    )
+    return api_key, raw_key
+
+
+def month_start(day: Optional[date] = None) -> date:
+    return (day or timezone.localdate()).replace(day=1)
+
+
+def key_cache_key(key_hash: str) -> str:
+    return f'apikey:key:{key_hash}'
+
+
+def usage_cache_key(key_id: int, month: date, kind: str) -> str:
+    return f'apikey:usage:{key_id}:{month:%Y%m}:{kind}'
+
+
+def rate_cache_key(key_id: int, window: int) -> str:
+    return f'apikey:rate:{key_id}:{window}'
+
+
+def lookup_key(raw_key: str) -> Optional[Dict]:
+    """Dados da chave ativa (id, limite, cota) ou None; chaves inválidas também ficam em cache"""
+    key_hash = hash_key(raw_key)
+    cached = cache.get(key_cache_key(key_hash))
+    if cached is None:
+        api_key = ApiKey.objects.filter(key_hash=key_hash, is_active=True).first()
+        cached = {
+            'id': api_key.id,
+            'name': api_key.name,
+            'rate_limit_per_minute': api_key.rate_limit_per_minute,
+            'monthly_quota': api_key.monthly_quota
+        } if api_key else {}
+        cache.set(key_cache_key(key_hash), cached, settings.API_KEY_CACHE_SECONDS)
+    return cached or None
+
+
+def _incr(key: str, seed: Callable[[], int], timeout: int, delta: int = 1) -> int:
+    """INCR atômico; a chave ausente é criada com o valor de seed (add não sobrescreve)"""
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, seed(), timeout)
+        return cache.incr(key, delta)
+
+
+def _stored_usage(key_id: int, month: date) -> Dict[str, int]:
+    row = ApiKeyUsage.objects.filter(api_key_id=key_id, month=month).values(
+        'cached_requests', 'upstream_requests'
+    ).first() or {}
+    return {kind: row.get(f'{kind}_requests', 0) for kind in USAGE_KINDS}
+
+
+def month_usage(key_id: int, month: Optional[date] = None) -> Dict[str, int]:
+    """Consumo do mês (cache; semeado do banco se necessário)"""
+    month = month or month_start()
+    keys = {kind: usage_cache_key(key_id, month, kind) for kind in USAGE_KINDS}
+    values = cache.get_many(list(keys.values()))
+    if len(values) < len(keys):
+        stored = _stored_usage(key_id, month)
+        for kind, key in keys.items():
+            if key not in values:
+                cache.add(key, stored[kind], USAGE_CACHE_TIMEOUT)
+        values = cache.get_many(list(keys.values()))
+    return {kind: values.get(key, 0) for kind, key in keys.items()}
+
+
+def remaining_quota(api_key: Optional[Dict]) -> Optional[int]:
+    """Análises que ainda cabem na cota mensal da chave (None: sem chave ou sem cota)"""
+    if not api_key or not api_key['monthly_quota']:
+        return None
+    return max(api_key['monthly_quota'] - sum(month_usage(api_key['id']).values()), 0)
+
+
+def flush_usage(pairs: Iterable[Tuple[int, date]]) -> int:
+    """Grava no banco os totais em cache de cada (chave, mês); retorna as linhas gravadas"""
+    written = 0
+    for key_id, month in pairs:
+        values = cache.get_many([usage_cache_key(key_id, month, kind) for kind in USAGE_KINDS])
+        if not values:
+            continue
+        counts = {
+            f'{kind}_requests': values.get(usage_cache_key(key_id, month, kind), 0) for kind in USAGE_KINDS
+        }
+        usage, created = ApiKeyUsage.objects.get_or_create(api_key_id=key_id, month=month, defaults=counts)
+        if not created:
+            # Greatest: um processo com o cache atrasado não desfaz a gravação de outro
+            ApiKeyUsage.objects.filter(pk=usage.pk).update(
+                updated_at=timezone.now(),
+                **{field: Greatest(F(field), Value(value)) for field, value in counts.items()}
+            )
+        written += 1
+    return written
+
+
+class UsageMeter:
+    """Contabiliza análises por chave e grava no banco periodicamente (por processo)"""
+
+    def __init__(self, flush_seconds: Optional[float] = None):
+        self.flush_seconds = settings.API_USAGE_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self._dirty: Set[Tuple[int, date]] = set()
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, key_id: int, kind: str, count: int = 1):
+        if count <= 0:
+            return
+        month = month_start()
+        _incr(usage_cache_key(key_id, month, kind),
+              lambda: _stored_usage(key_id, month)[kind], USAGE_CACHE_TIMEOUT, delta=count)
+        with self._lock:
+            self._dirty.add((key_id, month))
+            due = time.monotonic() - self._last_flush >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            pairs, self._dirty = self._dirty, set()
+            self._last_flush = time.monotonic()
+        return flush_usage(pairs)
+
+
+_meter: Optional[UsageMeter] = None
+_meter_lock = threading.Lock()
+
+
+def get_usage_meter() -> UsageMeter:
+    global _meter
+    if _meter is None:
+        with _meter_lock:
+            if _meter is None:
+                _meter = UsageMeter()
+    return _meter
+
+
+def reset_usage_meter():
+    global _meter
+    with _meter_lock:
+        _meter = None
+
+
+def request_key(request, allow_query: bool = False) -> str:
+    """
+    Chave enviada em X-API-Key ou Authorization: Api-Key <chave>
+
+    ?api_key= só é aceito com allow_query (fluxos SSE: o EventSource não envia
+    cabeçalhos); nas demais rotas a chave não deve aparecer em URLs, que vão
+    para logs de acesso e para o Referer.
+    """
+    raw_key = request.headers.get(KEY_HEADER, '')
+    if not raw_key:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() in ('api-key', 'bearer'):
+            raw_key = credentials
+    if not raw_key and allow_query:
+        raw_key = request.GET.get('api_key', '')
+    return raw_key.strip()
+
+
+def is_staff(request) -> bool:
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_active and user.is_staff)
+
+
+def _denied(error: str, status: int, retry_after: Optional[int] = None) -> JsonResponse:
+    response = JsonResponse({'success': False, 'error': error}, status=status)
+    if retry_after is not None:
+        response['Retry-After'] = str(retry_after)
+    return response
+
+
+def authorize_request(request, required: Optional[bool] = None,
+                      allow_query: bool = False) -> Optional[JsonResponse]:
+    """
+    Autentica a chave e aplica limite por minuto e cota mensal
+
+    Define request.api_key (dados da chave ou None) e retorna a resposta de
+    recusa, se houver. Sem chave, a requisição só passa se a chave não for
+    obrigatória (required; padrão API_KEY_REQUIRED) ou o usuário for da
+    equipe (is_staff, sessão no admin). allow_query: ver request_key.
+    """
+    required = settings.API_KEY_REQUIRED if required is None else required
+    request.api_key = None
+    raw_key = request_key(request, allow_query)
+    if not raw_key:
+        if required and not is_staff(request):
+            return _denied(f'Chave de API obrigatória (cabeçalho {KEY_HEADER})', 401)
+        return None
+
+    api_key = lookup_key(raw_key)
+    if api_key is None:
+        return _denied('Chave de API inválida', 401)
+
+    limit = api_key['rate_limit_per_minute'] or settings.API_KEY_RATE_LIMIT_PER_MINUTE
+    if limit:
+        now = time.time()
+        count = _incr(rate_cache_key(api_key['id'], int(now // 60)), lambda: 0, 120)
+        if count > limit:
+            return _denied(f'Limite de {limit} requisições por minuto excedido', 429,
+                           retry_after=60 - int(now % 60))
+
+    quota = api_key['monthly_quota']
+    if quota and sum(month_usage(api_key['id']).values()) >= quota:
+        return _denied(f'Cota mensal de {quota} análises esgotada', 429)
+
+    request.api_key = api_key
+    return None
+
+
+def _guarded(view, required: Optional[bool], allow_query: bool = False):
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            denied = await sync_to_async(authorize_request)(request, required, allow_query)
+            if denied is not None:
+                return denied
+            return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        denied = authorize_request(request, required, allow_query)
+        if denied is not None:
+            return denied
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def api_key_required(view=None, *, allow_query: bool = False):
+    """
+    Decorator de views (síncronas ou assíncronas) protegidas por chave de API
+
+    Use @api_key_required(allow_query=True) só em fluxos SSE (ver request_key).
+    """
+    if view is None:
+        return partial(api_key_required, allow_query=allow_query)
+    return _guarded(view, None, allow_query)
+
+
+def staff_or_api_key_required(view):
+    """Como api_key_required, mas exige chave ou usuário da equipe mesmo sem API_KEY_REQUIRED"""
+    return _guarded(view, True)
+
+
+def record_batch_usage(key_id: Optional[int], results: Iterable[Dict]):
+    """Contabiliza os itens concluídos de um lote para a chave que o enviou (se houver)"""
+    if key_id is None:
+        return
+    counts = dict.fromkeys(USAGE_KINDS, 0)
+    for result in results:
+        if result.get('success'):
+            counts['cached' if result.get('reused') else 'upstream'] += 1
+    meter = get_usage_meter()
+    for kind, count in counts.items():
+        meter.record(key_id, kind, count)
+
+
+def request_key_id(request) -> Optional[int]:
+    """Id da chave autenticada na requisição (None sem chave)"""
+    api_key = getattr(request, 'api_key', None)
+    return api_key['id'] if api_key else None
+
+
+def record_analysis(request, result: Dict):
+    """Contabiliza uma análise concluída para a chave da requisição (se houver)"""
+    api_key = getattr(request, 'api_key', None)
+    if api_key is None or not result.get('success'):
+        return
+    get_usage_meter().record(api_key['id'], 'cached' if result.get('reused') else 'upstream')
@@ -0,0 +1,350 @@
+import csv
+import io
+import itertools
+import logging
+import threading
+import uuid
+from datetime import timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .apikeys import get_usage_meter, record_batch_usage
+from .freshness import FreshnessPolicy
+from .models import AnalysisResult, BatchJob, BatchItem
+from .pipeline import AnalysisPipeline
+from .services import CNPJAService
+from .validators import validate_cnpj_batch
+
+logger = logging.getLogger('analysis')
+
+INGEST_CHUNK_SIZE = 1000
+
+# Itens que ainda precisam de um worker
+OPEN_STATUSES = ('PENDING', 'RUNNING')
+
+
+class BatchFileError(Exception):
+    """Arquivo de lote em formato não suportado ou ilegível"""
+
+
+def _iter_csv_cells(uploaded_file) -> Iterator:
+    """Lê a coluna de CNPJ de um CSV linha a linha, sem carregar o arquivo"""
+    stream = io.TextIOWrapper(uploaded_file.file, encoding='utf-8-sig', errors='replace', newline='')
+    first_line = stream.readline()
+    if not first_line:
+        return
+
+    delimiter = ';' if first_line.count(';') > first_line.count(',') else ','
+    reader = csv.reader(itertools.chain([first_line], stream), delimiter=delimiter)
+    yield from _iter_column(reader)
+
+
+def _iter_xlsx_cells(uploaded_file) -> Iterator:
+    """Lê a coluna de CNPJ da primeira planilha de um XLSX em modo streaming"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise BatchFileError('Suporte a XLSX requer o pacote openpyxl')
+
+    try:
+        workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+    except Exception as e:
+        raise BatchFileError(f'Arquivo XLSX inválido: {str(e)}')
+
+    try:
+        yield from _iter_column(workbook.active.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def _iter_column(rows) -> Iterator:
+    """Seleciona a coluna 'cnpj' (se houver cabeçalho) ou a primeira coluna"""
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
+        return
+
+    column = 0
+    for index, cell in enumerate(first_row):
+        if isinstance(cell, str) and 'cnpj' in cell.strip().lower():
+            column = index
+            break
+    else:
+        rows = itertools.chain([first_row], rows)
+
+    for row in rows:
+        if row and len(row) > column and row[column] not in (None, ''):
+            yield row[column]
+
+
+def iter_cnpj_cells(uploaded_file) -> Iterator:
+    """Itera os valores brutos de CNPJ de um arquivo CSV ou XLSX"""
+    name = (uploaded_file.name or '').lower()
+    if name.endswith('.xlsx'):
+        return _iter_xlsx_cells(uploaded_file)
+    if name.endswith('.csv') or name.endswith('.txt'):
+        return _iter_csv_cells(uploaded_file)
+    raise BatchFileError('Formato não suportado (use CSV ou XLSX)')
+
+
+def _cell_to_cnpj(service: CNPJAService, cell) -> str:
+    """Normaliza uma célula; números do Excel perdem zeros à esquerda"""
+    if isinstance(cell, (int, float)):
+        return str(int(cell)).zfill(14)
+    return service._clean_cnpj(str(cell))
+
+
+def create_batch_job(uploaded_file, score_only: bool = False, api_key_id: Optional[int] = None) -> BatchJob:
+    """
+    Cria o lote a partir do arquivo enviado
+
+    O arquivo é lido em streaming e gravado em blocos; CNPJs inválidos são
+    contados e descartados, repetidos são eliminados pela restrição única
+    (job, cnpj) e CNPJs com análise ainda válida pela política de
+    reaproveitamento são marcados como reaproveitados. Com score_only, os
+    critérios são gravados sem descrição e detalhes (ver CNPJAnalysisEngine).
+    Os reaproveitados contam no consumo da chave (api_key_id) como análises
+    servidas do banco.
+    """
+    service = CNPJAService()
+    job = BatchJob.objects.create(file_name=uploaded_file.name or 'upload', score_only=score_only,
+                                  api_key_id=api_key_id)
+
+    valid = invalid = 0
+    cells = iter_cnpj_cells(uploaded_file)
+    while True:
+        chunk = [_cell_to_cnpj(service, cell) for cell in itertools.islice(cells, INGEST_CHUNK_SIZE)]
+        if not chunk:
+            break
+
+        cnpjs = [cnpj for cnpj, ok in zip(chunk, validate_cnpj_batch(chunk, clean=False)) if ok]
+        valid += len(cnpjs)
+        invalid += len(chunk) - len(cnpjs)
+        if cnpjs:
+            _ingest_chunk(job, cnpjs)
+
+    total = job.items.count()
+    skipped = job.items.filter(status='SKIPPED').count()
+    BatchJob.objects.filter(pk=job.pk).update(
+        total_items=total,
+        invalid_items=invalid,
+        duplicate_items=valid - total,
+        skipped_items=skipped
+    )
+    if api_key_id is not None:
+        get_usage_meter().record(api_key_id, 'cached', skipped)
+    job.refresh_from_db()
+    return job
+
+
+def _ingest_chunk(job: BatchJob, cnpjs: List[str]):
+    """Grava um bloco de itens e marca os que já possuem análise recente"""
+    BatchItem.objects.bulk_create(
+        [BatchItem(job=job, cnpj=cnpj) for cnpj in cnpjs],
+        ignore_conflicts=True
+    )
+
+    fresh_results = AnalysisResult.objects.filter(
+        FreshnessPolicy.from_settings().fresh_q(),
+        cnpj_data__cnpj__in=cnpjs
+    )
+
+    BatchItem.objects.filter(
+        job=job, status='PENDING', cnpj__in=fresh_results.values('cnpj_data__cnpj')
+    ).update(
+        status='SKIPPED',
+        updated_at=timezone.now(),
+        analysis_result=Subquery(fresh_results.filter(cnpj_data__cnpj=OuterRef('cnpj')).values('id')[:1])
+    )
+
+
+def claimable_items(job: BatchJob, now=None):
+    """Itens pendentes ou reservados por um worker cuja reserva já expirou"""
+    now = now or timezone.now()
+    return BatchItem.objects.filter(job=job).filter(
+        Q(status='PENDING') | Q(status='RUNNING', lease_expires_at__lt=now)
+    )
+
+
+def claim_items(job: BatchJob, limit: int, lease_seconds: int) -> Tuple[str, List[Tuple[int, str]]]:
+    """
+    Reserva atomicamente um bloco de itens para este worker
+
+    No PostgreSQL as linhas são travadas com SELECT ... FOR UPDATE SKIP LOCKED,
+    então workers concorrentes pegam blocos disjuntos sem esperar uns pelos
+    outros. No SQLite (sem travas de linha) a reserva é um único
+    UPDATE ... WHERE id IN (SELECT ... LIMIT n), atômico porque o SQLite
+    serializa as escritas. Itens de uma reserva expirada (worker que caiu)
+    voltam a ser elegíveis.
+
+    Returns:
+        (token da reserva, [(id do item, cnpj)])
+    """
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    candidates = claimable_items(job, now).order_by('id')
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(candidates.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            target = BatchItem.objects.filter(id__in=ids)
+        else:
+            target = BatchItem.objects.filter(id__in=candidates.values('id')[:limit])
+
+        claimed = target.update(
+            status='RUNNING',
+            lease_token=token,
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            attempts=F('attempts') + 1
+        )
+
+    if not claimed:
+        return token, []
+    items = list(BatchItem.objects.filter(lease_token=token).order_by('id').values_list('id', 'cnpj'))
+    return token, items
+
+
+class BatchProcessor:
+    """
+    Envia os itens de um lote para o pipeline de análise, em blocos reservados
+
+    Cada lote gravado pelo pipeline atualiza, na mesma transação das análises,
+    o estado dos itens e os contadores do job: esse é o checkpoint. Se o
+    processo morrer, o que já foi gravado permanece e os itens reservados e
+    não concluídos voltam a ficar disponíveis quando a reserva expira, então
+    basta rodar o processador de novo (ver o comando resume_batches). Vários
+    processadores podem trabalhar no mesmo lote ao mesmo tempo.
+    """
+
+    def __init__(self, job: BatchJob, engine=None, pipeline: Optional[AnalysisPipeline] = None,
+                 claim_size: Optional[int] = None, lease_seconds: Optional[int] = None):
+        from .engines import CNPJAnalysisEngine
+
+        self.job = job
+        self.engine = engine or CNPJAnalysisEngine()
+        self.pipeline = pipeline or AnalysisPipeline(self.engine)
+        self.claim_size = claim_size or settings.BATCH_CLAIM_SIZE
+        self.lease_seconds = lease_seconds or settings.BATCH_LEASE_SECONDS
+
+    def run(self):
+        """Processa os itens disponíveis, gravando um checkpoint a cada lote do pipeline"""
+        BatchJob.objects.filter(pk=self.job.pk).update(
+            status='RUNNING', error='', finished_at=None,
+            started_at=Coalesce(F('started_at'), Value(timezone.now())),
+            evaluation_date=Coalesce(F('evaluation_date'), Value(timezone.localdate()))
+        )
+        # Mesma data de referência para todo o lote, inclusive quando retomado em outro dia
+        evaluation_date = BatchJob.objects.values_list('evaluation_date', flat=True).get(pk=self.job.pk)
+        self.pipeline.engine.explain = not self.job.score_only
+        self.pipeline.engine.api_key_id = self.job.api_key_id
+
+        try:
+            with self.pipeline:
+                while True:
+                    token, items = claim_items(self.job, self.claim_size, self.lease_seconds)
+                    if not items:
+                        break
+
+                    logger.info(f"Lote {self.job.pk}: {len(items)} itens reservados ({token})")
+                    item_ids = {cnpj: item_id for item_id, cnpj in items}
+                    self.pipeline.run(
+                        [cnpj for _, cnpj in items],
+                        on_batch=lambda results, token=token, item_ids=item_ids: self._record(token, item_ids, results),
+                        evaluation_date=evaluation_date
+                    )
+
+            self._finish()
+
+        except Exception as e:
+            logger.error(f"Erro no processamento do lote {self.job.pk}: {str(e)}")
+            BatchJob.objects.filter(pk=self.job.pk).update(
+                status='FAILED', error=str(e), finished_at=timezone.now()
+            )
+
+        self.job.refresh_from_db()
+        return self.job
+
+    def _finish(self):
+        """Conclui o job se nenhum item ficou aberto (outros workers podem estar no meio de um bloco)"""
+        if BatchItem.objects.filter(job=self.job, status__in=OPEN_STATUSES).exists():
+            return
+        BatchJob.objects.filter(pk=self.job.pk, status='RUNNING').update(
+            status='COMPLETED', finished_at=timezone.now()
+        )
+
+    def _record(self, token: str, item_ids: Dict[str, int], results: List[Tuple[str, Dict]]):
+        """
+        Registra um lote de resultados do pipeline (na transação do lote)
+
+        Só atualiza itens que ainda pertencem a esta reserva: se ela expirou e
+        outro worker reservou o item, o resultado dele prevalece e os contadores
+        não são incrementados duas vezes. A reserva dos demais itens do bloco é
+        renovada.
+        """
+        now = timezone.now()
+        owned = set(BatchItem.objects.filter(
+            id__in=[item_ids[cnpj] for cnpj, _ in results], lease_token=token, status='RUNNING'
+        ).values_list('id', flat=True))
+
+        items = []
+        for cnpj, result in results:
+            if item_ids[cnpj] not in owned:
+                logger.warning(f"Lote {self.job.pk}: reserva do CNPJ {cnpj} expirou, resultado descartado")
+                continue
+            items.append(BatchItem(
+                id=item_ids[cnpj],
+                status='DONE' if result['success'] else 'FAILED',
+                analysis_result=result.get('analysis_result'),
+                error=result.get('error', ''),
+                lease_token='',
+                lease_expires_at=None,
+                updated_at=now
+            ))
+        BatchItem.objects.bulk_update(
+            items, ['status', 'analysis_result', 'error', 'lease_token', 'lease_expires_at', 'updated_at']
+        )
+
+        # Consumo da chave só depois que o checkpoint for confirmado
+        recorded = {item.id for item in items}
+        finished = [result for cnpj, result in results if item_ids[cnpj] in recorded]
+        transaction.on_commit(lambda: record_batch_usage(self.job.api_key_id, finished))
+
+        processed = sum(1 for item in items if item.status == 'DONE')
+        BatchJob.objects.filter(pk=self.job.pk).update(
+            processed_items=F('processed_items') + processed,
+            failed_items=F('failed_items') + len(items) - processed
+        )
+        BatchItem.objects.filter(lease_token=token, status='RUNNING').update(
+            lease_expires_at=now + timedelta(seconds=self.lease_seconds)
+        )
+
+
+def resumable_jobs():
+    """Jobs com itens que nenhum worker está processando (pendentes ou com reserva expirada)"""
+    now = timezone.now()
+    return BatchJob.objects.filter(
+        Q(items__status='PENDING') | Q(items__status='RUNNING', items__lease_expires_at__lt=now)
+    ).distinct().order_by('id')
+
+
+def start_batch_job(job: BatchJob) -> Optional[threading.Thread]:
+    """Dispara o processamento do lote em segundo plano (ou em linha, se desativado)"""
+    if not settings.BATCH_RUN_IN_BACKGROUND:
+        BatchProcessor(job).run()
+        return None
+
+    def target():
+        close_old_connections()
+        try:
+            BatchProcessor(job).run()
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=target, name=f'batch-job-{job.pk}', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,557 @@
+"""
+Benchmarks reproduzíveis usados pelo comando `manage.py benchmark` e pelos testes
+"""
+
+import gc
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from cnpj_analyzer.database import apply_sqlite_pragmas, sqlite_pragmas
+
+from .parsed import ParsedCompany
+from .payloads import build_projection, orjson, project
+from .pipeline import AnalysisPipeline
+from .validators import complete_cnpj
+
+
+def sqlite_writer_throughput(pragmas: Optional[Dict], writers: int = 8, rows_per_writer: int = 200,
+                             timeout: float = 0.05) -> Dict:
+    """
+    Mede escritas concorrentes em um arquivo SQLite temporário
+
+    Cada thread abre sua própria conexão e grava uma linha por transação,
+    como _save_* faz em autocommit. Erros de lock são contados, não relançados.
+
+    Returns:
+        Dict com linhas gravadas, erros de lock, tempo e linhas/segundo
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'bench.sqlite3'
+        setup = sqlite3.connect(path)
+        apply_sqlite_pragmas(setup, pragmas)
+        setup.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, writer INTEGER, payload TEXT)')
+        setup.commit()
+
+        errors = [0] * writers
+        barrier = threading.Barrier(writers)
+
+        def write(index):
+            conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+            apply_sqlite_pragmas(conn, pragmas)
+            barrier.wait()
+            for i in range(rows_per_writer):
+                try:
+                    conn.execute('BEGIN IMMEDIATE')
+                    conn.execute('INSERT INTO item (writer, payload) VALUES (?, ?)', (index, 'x' * 200))
+                    conn.execute('COMMIT')
+                except sqlite3.OperationalError:
+                    errors[index] += 1
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+            conn.close()
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        rows = setup.execute('SELECT COUNT(*) FROM item').fetchone()[0]
+        setup.close()
+
+    return {
+        'rows': rows,
+        'lock_errors': sum(errors),
+        'seconds': round(elapsed, 4),
+        'rows_per_second': round(rows / elapsed, 1) if elapsed else 0.0
+    }
+
+
+def run_sqlite_writers(writers: int = 8, rows_per_writer: int = 200) -> Dict[str, Dict]:
+    """Compara journaling padrão (sem espera) com WAL + busy_timeout"""
+    return {
+        'default': sqlite_writer_throughput(None, writers, rows_per_writer),
+        'wal': sqlite_writer_throughput(sqlite_pragmas(busy_timeout_ms=20000), writers, rows_per_writer,
+                                        timeout=20.0),
+    }
+
+
+def sample_payload(cnpj: str, members: int = 8, side_activities: int = 12) -> Dict:
+    """Payload no formato da API CNPJA, com os blocos que o parse descarta"""
+    return {
+        'taxId': cnpj,
+        'updated': '2024-01-01T00:00:00.000Z',
+        'founded': '2010-05-20',
+        'head': True,
+        'statusDate': '2010-05-20',
+        'status': {'id': 2, 'text': 'Ativa'},
+        'company': {
+            'id': int(cnpj[:8]),
+            'name': f'INSTITUTO DE ENSINO {cnpj}',
+            'equity': 250000.0,
+            'nature': {'id': 2062, 'text': 'Sociedade Empresária Limitada'},
+            'size': {'id': 3, 'acronym': 'DEMAIS', 'text': 'Demais'},
+            'simples': {'optant': False, 'since': None},
+            'members': [
+                {
+                    'since': '2010-05-20',
+                    'person': {'id': f'{cnpj}-{i}', 'type': 'NATURAL', 'name': f'SOCIO {i} {cnpj}',
+                               'taxId': '***123456**', 'age': '41-50'},
+                    'role': {'id': 49, 'text': 'Sócio-Administrador' if i % 2 else 'Sócio'}
+                }
+                for i in range(members)
+            ],
+        },
+        'alias': None,
+        'address': {'municipality': 3550308, 'street': 'Avenida Paulista', 'number': '1000',
+                    'district': 'Bela Vista', 'city': 'São Paulo', 'state': 'SP', 'details': 'Andar 10',
+                    'zip': '01310100', 'country': {'id': 76, 'name': 'Brasil'}},
+        'mainActivity': {'id': 8532500, 'text': 'Educação superior - graduação e pós-graduação'},
+        'sideActivities': [
+            {'id': 8599600 + i, 'text': f'Treinamento em desenvolvimento profissional e gerencial {i}'}
+            for i in range(side_activities)
+        ],
+        'phones': [{'type': 'LANDLINE', 'area': '11', 'number': '30000000'}],
+        'emails': [{'ownership': 'CORPORATE', 'address': f'contato{cnpj}@exemplo.com.br', 'domain': 'exemplo.com.br'}],
+        'registrations': [
+            {'number': f'{i}{cnpj}', 'state': 'SP', 'enabled': True, 'statusDate': '2010-05-20',
+             'status': {'id': 1, 'text': 'Sem restrição'}, 'type': {'id': 1, 'text': 'IE Normal'}}
+            for i in range(3)
+        ],
+        'suframa': [],
+    }
+
+
+def legacy_parse(raw_data: Dict) -> Dict:
+    """Forma anterior do parse: dicionário com cópias das listas e referência ao payload"""
+    company = raw_data.get('company', {})
+    address = raw_data.get('address', {})
+    return {
+        'cnpj': raw_data.get('taxId', ''),
+        'company_name': company.get('name', ''),
+        'status': raw_data.get('status', {}).get('text', ''),
+        'founded_date': raw_data.get('founded', ''),
+        'equity': company.get('equity'),
+        'main_activity': raw_data.get('mainActivity', {}).get('text', ''),
+        'main_activity_id': raw_data.get('mainActivity', {}).get('id'),
+        'city': address.get('city', ''),
+        'state': address.get('state', ''),
+        'zip_code': address.get('zip', ''),
+        'district': address.get('district', ''),
+        'street': address.get('street', ''),
+        'number': address.get('number', ''),
+        'phones': raw_data.get('phones', []),
+        'emails': raw_data.get('emails', []),
+        'side_activities': raw_data.get('sideActivities', []),
+        'members': company.get('members', []),
+        'nature': company.get('nature', {}),
+        'size': company.get('size', {}),
+        'raw_data': raw_data
+    }
+
+
+def retained_memory(parse: Callable[[Dict], object], companies: int = 2000) -> Dict:
+    """
+    Memória mantida por `companies` empresas em processamento simultâneo
+
+    Cada payload é decodificado de JSON (como chega da API), passa pelo parse
+    e só o resultado fica vivo, como nos lotes.
+    """
+    template = json.dumps(sample_payload('00000000000000'))
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        alive = [
+            parse(json.loads(template.replace('00000000000000', f'{i:014d}')))
+            for i in range(companies)
+        ]
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'companies': len(alive),
+        'bytes': retained,
+        'bytes_per_company': round(retained / companies)
+    }
+
+
+def run_parsed_memory(companies: int = 2000) -> Dict[str, Dict]:
+    """Compara o dicionário legado com ParsedCompany (todos os campos e só os de pontuação)"""
+    from .engines import CNPJAnalysisEngine
+
+    criteria_fields = CNPJAnalysisEngine().criteria_fields
+    return {
+        'dict': retained_memory(legacy_parse, companies),
+        'parsed_company': retained_memory(ParsedCompany.from_payload, companies),
+        'parsed_company_scoring': retained_memory(
+            lambda raw: ParsedCompany.from_payload(raw, criteria_fields), companies
+        ),
+    }
+
+
+def _decode_cost(decode: Callable[[bytes], Dict], body: bytes, repeats: int) -> Dict:
+    from .services import CNPJAService
+
+    service = CNPJAService()
+
+    def pipeline(raw: bytes):
+        payload = decode(raw)
+        service.payload_hash(payload)
+        return service.parse_cnpj_data(payload)
+
+    timings = {}
+    for name, func in (('decode', decode), ('decode_hash_parse', pipeline)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            func(body)
+        timings[name] = round((time.perf_counter() - start) / repeats * 1000, 3)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        payload = decode(body)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del payload
+
+    return {
+        'ms_decode': timings['decode'],
+        'ms_decode_hash_parse': timings['decode_hash_parse'],
+        'peak_bytes': peak - baseline,
+        'retained_bytes': current - baseline
+    }
+
+
+def run_payload_decode(members: int = 300, side_activities: int = 300, repeats: int = 30,
+                       max_items: Optional[int] = 100) -> Dict[str, Dict]:
+    """
+    Decodificação completa (response.json()) x decodificação com projeção e limite de listas
+
+    Mede também o caminho do engine (decodificar, calcular payload_hash e
+    gerar o ParsedCompany), que se beneficia do payload reduzido.
+    """
+    from .engines import CNPJAnalysisEngine
+
+    body = json.dumps(sample_payload('11222333000181', members, side_activities)).encode('utf-8')
+    projection = build_projection(CNPJAnalysisEngine().parse_fields)
+    scenarios = {
+        'json_full': json.loads,
+        'json_projected': lambda raw: project(json.loads(raw), projection, max_items),
+    }
+    if orjson is not None:
+        scenarios['orjson_full'] = orjson.loads
+        scenarios['orjson_projected'] = lambda raw: project(orjson.loads(raw), projection, max_items)
+
+    result = {name: _decode_cost(decode, body, repeats) for name, decode in scenarios.items()}
+    result['payload_bytes'] = len(body)
+    return result
+
+
+class _Rollback(Exception):
+    pass
+
+
+def run_pipeline(companies: int = 200, fetch_latency: float = 0.02, **pipeline_options) -> Dict[str, Dict]:
+    """
+    analyze_cnpj em série x AnalysisPipeline, com latência de API simulada
+
+    Usa o banco configurado dentro de uma transação desfeita ao final.
+    """
+    from .engines import CNPJAnalysisEngine
+
+    cnpjs = [complete_cnpj(f'{i:08d}0001') for i in range(1, companies + 1)]
+    payloads = {cnpj: sample_payload(cnpj) for cnpj in cnpjs}
+
+    def fetch(cnpj):
+        time.sleep(fetch_latency)
+        return json.loads(json.dumps(payloads[cnpj]))
+
+    engine = CNPJAnalysisEngine()
+    engine.cnpja_service.get_cnpj_data = fetch
+    result = {}
+
+    try:
+        with transaction.atomic():
+            start = time.perf_counter()
+            for cnpj in cnpjs:
+                engine.analyze_cnpj(cnpj, force=True)
+            elapsed = time.perf_counter() - start
+            result['serial'] = {'seconds': round(elapsed, 3), 'items_per_second': round(companies / elapsed, 1)}
+
+            pipeline_options.setdefault('rate_per_minute', 0)
+            with AnalysisPipeline(engine, **pipeline_options) as pipeline:
+                stats = pipeline.run(cnpjs)
+            result['pipeline'] = {
+                'seconds': stats['wall_seconds'],
+                'items_per_second': round(companies / stats['wall_seconds'], 1),
+                'stages': stats
+            }
+            raise _Rollback
+    except _Rollback:
+        pass
+
+    return result
+
+
+def synthetic_snapshot(rows: int = 1_000_000, seed: int = 7):
+    """Snapshot colunar com carteira sintética (sem banco), para medir a simulação"""
+    import random
+    from array import array
+
+    from .simulation import CRITERIA_ORDER, PortfolioSnapshot
+
+    rng = random.Random(seed)
+    snapshot = PortfolioSnapshot()
+    snapshot.ids = array('q', range(1, rows + 1))
+    snapshot.status = array('b', (rng.randrange(3) for _ in range(rows)))
+    snapshot.equity = array('d', (rng.choice((0.0, 1000.0, 60000.0, 250000.0, 5e6)) for _ in range(rows)))
+    base = date.today().toordinal()
+    snapshot.founded = array('q', (base - rng.randrange(0, 20 * 365) for _ in range(rows)))
+    for name in CRITERIA_ORDER[:6]:
+        snapshot.scores[name] = array('h', (rng.choice((20, 60, 80, 100)) for _ in range(rows)))
+    return snapshot
+
+
+def run_simulation(rows: int = 1_000_000, repeats: int = 3) -> Dict[str, Dict]:
+    """Tempo de simulate() sobre uma carteira sintética (numpy x Python puro)"""
+    from . import simulation
+
+    snapshot = synthetic_snapshot(rows)
+    config = simulation.PolicyConfig(
+        weights={'capital_social': 0.3},
+        capital_thresholds=(2000000, 200000, 50000),
+        operating_years_thresholds=(5, 3, 1),
+        status_thresholds=(85, 60)
+    )
+
+    def measure(runs: int) -> Dict:
+        start = time.perf_counter()
+        for _ in range(runs):
+            result = simulation.simulate(snapshot, config)
+        return {
+            'seconds': round((time.perf_counter() - start) / runs, 3),
+            'changed': result['changed']
+        }
+
+    result = {'rows': rows, 'snapshot_bytes': sum(
+        column.itemsize * len(column)
+        for column in [snapshot.ids, snapshot.status, snapshot.equity, snapshot.founded, *snapshot.scores.values()]
+    )}
+    if simulation.np is not None:
+        result['numpy'] = measure(repeats)
+    numpy_module, simulation.np = simulation.np, None
+    try:
+        result['python'] = measure(1)
+    finally:
+        simulation.np = numpy_module
+    return result
+
+
+def run_criteria_memo(companies: int = 5000, seed: int = 11) -> Dict[str, Dict]:
+    """
+    Critérios puros de um lote com entradas repetidas, com e sem memorização
+
+    Cidades, capitais e CNAEs se repetem entre as empresas como em uma carteira
+    real; sócios são únicos por empresa (estrutura societária quase não acerta).
+    """
+    import random
+
+    from .engines import CNPJAnalysisEngine
+    from .memo import CriteriaMemo
+
+    rng = random.Random(seed)
+    cities = [('São Paulo', 'SP'), ('Campinas', 'SP'), ('Curitiba', 'PR'), ('Recife', 'PE'), ('Palmas', 'TO')]
+    parsed = []
+    for i in range(companies):
+        payload = sample_payload(complete_cnpj(f'{i + 1:08d}0001'), members=2, side_activities=3)
+        city, state = rng.choice(cities)
+        payload['address'].update(city=city, state=state)
+        payload['company']['equity'] = rng.choice((1000, 50000, 100000, 250000, 1000000))
+        payload['founded'] = f'{rng.randrange(1990, 2024)}-01-01'
+        parsed.append(ParsedCompany.from_payload(payload))
+
+    result = {}
+    for name, maxsize in (('without_memo', 0), ('with_memo', 4096)):
+        engine = CNPJAnalysisEngine()
+        engine.criteria_memo = CriteriaMemo(maxsize)
+        start = time.perf_counter()
+        for data in parsed:
+            engine._execute_analysis(data, include_db_criteria=False)
+        elapsed = time.perf_counter() - start
+        result[name] = {
+            'seconds': round(elapsed, 3),
+            'companies_per_second': round(companies / elapsed, 1),
+            'criteria': engine.criteria_memo.stats()
+        }
+    return result
+
+
+def run_score_only(companies: int = 500, explain_sample: int = 50) -> Dict[str, Dict]:
+    """
+    Lote completo x modo só score: vazão do pipeline e bytes gravados dos critérios
+
+    bytes_per_company soma descrição e detalhes (JSON) de AnalysisCriteria; no
+    modo só score também mede o custo de gerar a explicação sob demanda.
+    Usa o banco configurado dentro de uma transação desfeita ao final.
+    """
+    from .engines import CNPJAnalysisEngine
+    from .memo import CriteriaMemo
+    from .models import AnalysisCriteria, AnalysisResult
+
+    cnpjs = [complete_cnpj(f'{i:08d}0001') for i in range(1, companies + 1)]
+    payloads = {cnpj: sample_payload(cnpj) for cnpj in cnpjs}
+    result = {}
+
+    for name, explain in (('full', True), ('score_only', False)):
+        engine = CNPJAnalysisEngine(explain=explain)
+        engine.criteria_memo = CriteriaMemo(0)
+        engine.cnpja_service.get_cnpj_data = lambda cnpj: json.loads(json.dumps(payloads[cnpj]))
+        try:
+            with transaction.atomic():
+                with AnalysisPipeline(engine, score_in_processes=False, rate_per_minute=0) as pipeline:
+                    stats = pipeline.run(cnpjs)
+
+                stored = sum(
+                    len(description.encode('utf-8')) + len(json.dumps(details, ensure_ascii=False).encode('utf-8'))
+                    for description, details in AnalysisCriteria.objects.values_list(
+                        'criteria_description', 'details'
+                    ).iterator()
+                )
+                result[name] = {
+                    'seconds': stats['wall_seconds'],
+                    'items_per_second': round(companies / stats['wall_seconds'], 1),
+                    'score_ms_per_company': round(stats['score']['busy_seconds'] * 1000 / companies, 3),
+                    'criteria_bytes_per_company': round(stored / companies, 1)
+                }
+
+                if not explain:
+                    sample = list(AnalysisResult.objects.select_related('cnpj_data')[:explain_sample])
+                    reader = CNPJAnalysisEngine()
+                    start = time.perf_counter()
+                    for analysis in sample:
+                        reader.explain_criteria(analysis)
+                    elapsed = time.perf_counter() - start
+                    result[name]['explain_ms_per_company'] = round(elapsed * 1000 / len(sample), 3)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    return result
+
+
+# Módulos que um worker não deveria carregar na partida
+WATCHED_MODULES = (
+    'requests', 'numpy', 'django.contrib.admin', 'django.contrib.sessions', 'django.contrib.messages',
+    'corsheaders'
+)
+
+
+def _start_process(settings_module: str, statement: str, importtime: bool = False):
+    # Lista no stdout os módulos observados que ficaram carregados (o relatório
+    # do importtime omite pacotes importados por importlib durante o setup)
+    code = (
+        f'import django; django.setup(); {statement}\n'
+        f'import sys; print(",".join(m for m in {WATCHED_MODULES!r} if m in sys.modules))'
+    )
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    start = time.perf_counter()
+    completed = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+                               check=True)
+    last_line = (completed.stdout.splitlines() or [''])[-1]
+    loaded = last_line.split(',') if last_line else []
+    return time.perf_counter() - start, completed.stderr, loaded
+
+
+def import_profile(settings_module: str, statement: str = 'import analysis.engines', repeats: int = 3) -> Dict:
+    """
+    Partida a frio de um processo novo: django.setup() seguido de `statement`
+
+    wall_ms é o melhor de `repeats` execuções; o detalhamento vem de uma
+    execução com `python -X importtime` (soma do tempo próprio de cada módulo
+    e os pacotes de primeiro nível mais caros).
+    """
+    wall = min(_start_process(settings_module, statement)[0] for _ in range(repeats))
+
+    _, report, loaded = _start_process(settings_module, statement, importtime=True)
+    modules = {}
+    top_level = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(own)
+        if not name.startswith('  '):
+            top_level.append((int(cumulative), name.strip()))
+
+    return {
+        'wall_ms': round(wall * 1000, 1),
+        'import_ms': round(sum(modules.values()) / 1000, 1),
+        'modules': len(modules),
+        'heaviest': {name: round(us / 1000, 1) for us, name in sorted(top_level, reverse=True)[:8]},
+        'loaded': loaded
+    }
+
+
+def run_import_time(repeats: int = 5) -> Dict[str, Dict]:
+    """Partida de um worker de pontuação: perfil completo x perfil worker"""
+    return {
+        settings_module: import_profile(settings_module, repeats=repeats)
+        for settings_module in ('cnpj_analyzer.settings', 'cnpj_analyzer.settings_worker')
+    }
+
+
+_FIRST_REQUESTS = """
+import json, time
+from django.test import Client
+report = {}
+if WARM:
+    from analysis.warmup import warm_up
+    report['warmup_ms'] = warm_up('all', freeze=False)['total_ms']
+client = Client(HTTP_HOST='localhost')
+for path in ('/', '/api/health/'):
+    start = time.perf_counter()
+    client.get(path)
+    report[path] = round((time.perf_counter() - start) * 1000, 2)
+print(json.dumps(report))
+"""
+
+
+def run_warmup(repeats: int = 3) -> Dict[str, Dict]:
+    """
+    Latência da primeira requisição de um processo novo, com e sem warm-up
+
+    Cada medição roda em um processo separado (nada importado ou em cache);
+    resultado: mediana de `repeats` processos por variante.
+    """
+    result = {}
+    for name, warm in (('cold', False), ('warm', True)):
+        runs = []
+        for _ in range(repeats):
+            code = f'import django; django.setup()\nWARM = {warm}\n{_FIRST_REQUESTS}'
+            completed = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, env=dict(os.environ),
+                                       capture_output=True, text=True, check=True)
+            runs.append(json.loads(completed.stdout.splitlines()[-1]))
+        result[name] = {key: sorted(run[key] for run in runs)[len(runs) // 2] for key in runs[0]}
+    return result
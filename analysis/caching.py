@@ -0,0 +1,104 @@
+"""
+Cache das respostas de consulta de análises e suporte a GET condicional
+
+- Detalhe: corpo JSON em cache por (id, analysis_date); ETag e Last-Modified
+  derivam de analysis_date, então um 304 não precisa montar nem ler o corpo.
+- Histórico: corpo em cache por (geração, banco de origem, filtros); a geração
+  é incrementada sempre que uma análise é gravada.
+
+A geração fica no banco (CacheGeneration), não no cache: com o cache em
+memória local (padrão sem CACHE_URL) cada worker tem o próprio cache, e uma
+gravação feita em outro processo (outro worker do gunicorn, lotes) precisa
+invalidar o histórico de todos. O detalhe não depende disso: analysis_date é
+lido do banco a cada requisição.
+"""
+
+import hashlib
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .models import CacheGeneration
+
+HISTORY_GENERATION_KEY = 'analysis:history:generation'
+
+
+def analysis_stamp(analysis_date: datetime) -> int:
+    """Carimbo em microssegundos, estável entre bancos e processos"""
+    return int(analysis_date.timestamp() * 1_000_000)
+
+
+def detail_key(analysis_id: int, analysis_date: datetime) -> str:
+    return f'analysis:detail:{analysis_id}:{analysis_stamp(analysis_date)}'
+
+
+def detail_etag(analysis_id: int, analysis_date: datetime) -> str:
+    return f'"{analysis_id}-{analysis_stamp(analysis_date)}"'
+
+
+def history_generation(alias: str = 'default') -> int:
+    """
+    Geração atual do histórico, lida no mesmo banco que vai montar a página
+
+    Começa com o relógio, para que um banco recriado não repita gerações (e
+    ETags) já entregues a clientes.
+    """
+    generation = CacheGeneration.objects.using(alias).filter(
+        name=HISTORY_GENERATION_KEY
+    ).values_list('value', flat=True).first()
+    return generation or 0
+
+
+def history_key(generation: int, alias: str, query_string: str) -> str:
+    digest = hashlib.md5(query_string.encode('utf-8')).hexdigest()
+    return f'analysis:history:{generation}:{alias}:{digest}'
+
+
+def history_etag(key: str) -> str:
+    return '"h%s"' % hashlib.md5(key.encode('utf-8')).hexdigest()[:20]
+
+
+def invalidate_analysis(analysis_id: int, previous_date: Optional[datetime] = None):
+    """Remove o detalhe anterior e invalida todas as páginas de histórico"""
+    if previous_date is not None:
+        cache.delete(detail_key(analysis_id, previous_date))
+    bumped = CacheGeneration.objects.filter(name=HISTORY_GENERATION_KEY).update(value=F('value') + 1)
+    if not bumped:
+        CacheGeneration.objects.get_or_create(name=HISTORY_GENERATION_KEY, defaults={'value': time.time_ns()})
+
+
+def cached_body(key: str, build: Callable[[], bytes], timeout: int) -> bytes:
+    body = cache.get(key)
+    if body is None:
+        body = build()
+        cache.set(key, body, timeout)
+    return body
+
+
+def conditional_json(request, etag: str, load_body: Callable[[], bytes], last_modified: Optional[datetime] = None,
+                     max_age: int = 0) -> HttpResponse:
+    """
+    Resposta JSON com ETag/Last-Modified/Cache-Control
+
+    O corpo só é carregado se o cliente não tiver a versão atual (304).
+    """
+    response = HttpResponse(content_type='application/json')
+    response['ETag'] = etag
+    timestamp = None
+    if last_modified is not None:
+        timestamp = int(last_modified.timestamp())
+        response['Last-Modified'] = http_date(timestamp)
+    patch_cache_control(response, private=True, max_age=max_age, must_revalidate=True)
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=timestamp, response=response)
+    if conditional is not response:
+        return conditional
+
+    response.content = load_body()
+    return response
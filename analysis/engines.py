@@ -1,41 +1,166 @@
 import logging
+import math
+from bisect import bisect_left
 from datetime import datetime, date
-from typing import Dict, List, Tuple
+from functools import lru_cache, partial
+from typing import Callable, Dict, List, Optional, Set, Tuple
 from decimal import Decimal
-from .models import CNPJData, AnalysisResult, AnalysisCriteria
+from django.db import transaction
+from django.utils import timezone
+from django.conf import settings
+from .caching import invalidate_analysis
+from .freshness import FreshnessPolicy
+from .graph import get_partner_graph, partner_key, update_partner_graph
+from .memo import get_criteria_memo
+from .models import CNPJData, AnalysisResult, AnalysisCriteria, Activity, CompanyActivity, Member
+from .parsed import ActivityInfo, MemberInfo, ParsedCompany
 from .services import CNPJAService
+from .versioning import record_version
+from .webhooks import enqueue_analysis_completed
 
 logger = logging.getLogger('analysis')
 
+# Recebe (evento, dados) a cada etapa de analyze_cnpj (ver streams.py)
+ProgressCallback = Callable[[str, Dict], None]
+
+# Grupos de campos do ParsedCompany lidos por cada critério
+CRITERIA_FIELDS = {
+    'status_ativo': ('status',),
+    'tempo_operacao': ('founded_date',),
+    'capital_social': ('equity',),
+    'atividade_educacao': ('main_activity', 'side_activities'),
+    'estrutura_societaria': ('members',),
+    'localizacao': ('location',),
+    'rede_societaria': ('members',),
+}
+
+# Atributos do ParsedCompany que determinam o resultado de cada critério sem
+# acesso ao banco: o resultado é memorizado por esses valores (ver memo.py).
+# estrutura_societaria fica de fora: os detalhes listam os próprios sócios, então
+# entradas idênticas praticamente não se repetem entre empresas.
+CRITERIA_INPUTS = {
+    'status_ativo': ('status',),
+    'tempo_operacao': ('founded_date', 'founded_ordinal'),
+    'capital_social': ('equity',),
+    'atividade_educacao': ('main_activity', 'side_activities'),
+    'localizacao': ('state_upper', 'city_lower'),
+}
+
+# Pesos padrão dos critérios (rede_societaria só quando habilitada)
+DEFAULT_CRITERIA_WEIGHTS = {
+    'status_ativo': 0.25,
+    'tempo_operacao': 0.20,
+    'capital_social': 0.20,
+    'atividade_educacao': 0.15,
+    'estrutura_societaria': 0.10,
+    'localizacao': 0.10
+}
+PARTNER_NETWORK_WEIGHT = 0.10
+
+# Limiares das faixas de score 100 / 80 / 60 (abaixo de todos: 20)
+CAPITAL_THRESHOLDS = (1000000, 100000, 50000)  # R$ 1M / 100k / 50k
+OPERATING_YEARS_THRESHOLDS = (5, 2, 1)
+TIER_SCORES = (100, 80, 60, 20)
+
+DAYS_PER_YEAR = 365.25
+
+# Score mínimo para APROVADO e para ATENCAO (abaixo: REPROVADO)
+STATUS_THRESHOLDS = (80, 60)
+
+# Grupos gravados em CNPJData, tabelas normalizadas e histórico de versões
+PERSISTED_FIELDS = (
+    'company_name', 'status', 'founded_date', 'equity', 'main_activity', 'location',
+    'side_activities', 'members', 'nature', 'size'
+)
+
+
+def _ignore_progress(event: str, data: Dict):
+    pass
+
+
+@lru_cache(maxsize=64)
+def operating_years_boundaries(evaluation_date: date) -> Tuple[int, ...]:
+    """
+    Maior ordinal de fundação que atinge cada limiar de OPERATING_YEARS_THRESHOLDS
+
+    Fundada em F, a empresa tem (E - F) / 365,25 >= N anos na data E se, e
+    somente se, F <= E - ceil(N * 365,25). Em ordem crescente (limiar mais
+    exigente primeiro), para uso com bisect.
+    """
+    evaluation = evaluation_date.toordinal()
+    return tuple(evaluation - math.ceil(years * DAYS_PER_YEAR) for years in OPERATING_YEARS_THRESHOLDS)
+
 
 class CNPJAnalysisEngine:
     """Engine principal para análise de CNPJs"""
     
-    def __init__(self):
-        self.cnpja_service = CNPJAService()
-        self.criteria_weights = {
-            'status_ativo': 0.25,
-            'tempo_operacao': 0.20,
-            'capital_social': 0.20,
-            'atividade_educacao': 0.15,
-            'estrutura_societaria': 0.10,
-            'localizacao': 0.10
-        }
+    def __init__(self, evaluation_date: Optional[date] = None, explain: bool = True,
+                 api_key_id: Optional[int] = None):
+        """
+        Args:
+            evaluation_date: Data de referência dos critérios que dependem do
+                tempo; fixe-a para resultados reproduzíveis (padrão: hoje, no
+                momento de cada pontuação)
+            explain: Gera descrição e detalhes de cada critério; desligado
+                (modo só score), grava apenas score/peso/aprovação e a
+                explicação é gerada sob demanda por explain_criteria
+            api_key_id: Chave de API que originou as análises; os webhooks
+                dessa chave (e os sem dono) recebem os eventos
+        """
+        self.evaluation_date = evaluation_date
+        self.explain = explain
+        self.api_key_id = api_key_id
+        self.freshness_policy = FreshnessPolicy.from_settings()
+        self.criteria_weights = dict(DEFAULT_CRITERIA_WEIGHTS)
+        if settings.ANALYSIS_ENABLE_PARTNER_NETWORK:
+            self.criteria_weights['rede_societaria'] = PARTNER_NETWORK_WEIGHT
+        self.cnpja_service = CNPJAService(fields=self.parse_fields)
+        self.criteria_memo = get_criteria_memo()
     
-    def analyze_cnpj(self, cnpj: str) -> Dict:
+    @property
+    def criteria_fields(self) -> frozenset:
+        """Campos necessários para os critérios ativos"""
+        return frozenset(field for name in self.criteria_weights for field in CRITERIA_FIELDS[name])
+    
+    @property
+    def parse_fields(self) -> frozenset:
+        """Campos decodificados ao processar um payload que será persistido"""
+        return self.criteria_fields.union(PERSISTED_FIELDS)
+    
+    def analyze_cnpj(self, cnpj: str, force: bool = False, on_progress: Optional[ProgressCallback] = None) -> Dict:
         """
         Executa análise completa do CNPJ
         
         Args:
             cnpj: CNPJ para análise
+            force: Ignora a política de reaproveitamento e refaz a análise
+            on_progress: Chamado a cada etapa: ('stage', {'stage': ...}),
+                ('company', dados básicos) e ('criterion', resultado) por critério
             
         Returns:
-            Dict com resultado da análise
+            Dict com resultado da análise ('reused' indica se veio do banco)
         """
         start_time = datetime.now()
+        progress = on_progress or _ignore_progress
         
         try:
+            # Valida dígitos verificadores antes de consumir a API
+            progress('stage', {'stage': 'validating'})
+            if not self.cnpja_service._validate_cnpj(cnpj):
+                return {
+                    'success': False,
+                    'error': 'CNPJ inválido'
+                }
+            
+            # Reaproveita análise armazenada ainda válida
+            if not force:
+                progress('stage', {'stage': 'cache_lookup'})
+                stored = self._get_fresh_result(self.cnpja_service._clean_cnpj(cnpj), start_time)
+                if stored:
+                    return stored
+            
             # Busca dados na API
+            progress('stage', {'stage': 'fetching'})
             raw_data = self.cnpja_service.get_cnpj_data(cnpj)
             if not raw_data:
                 return {
@@ -43,112 +168,497 @@ class CNPJAnalysisEngine:
                     'error': 'CNPJ não encontrado ou dados indisponíveis'
                 }
             
-            # Processa dados
-            parsed_data = self.cnpja_service.parse_cnpj_data(raw_data)
+            return self._analyze_payload(raw_data, start_time, progress)
             
-            # Salva dados básicos
-            cnpj_data = self._save_cnpj_data(parsed_data)
+        except Exception as e:
+            logger.error(f"Erro na análise do CNPJ {cnpj}: {str(e)}")
+            return {
+                'success': False,
+                'error': f'Erro interno: {str(e)}'
+            }
+    
+    def refresh_cnpj(self, cnpj: str) -> Dict:
+        """
+        Reconsulta o CNPJ e só reprocessa se o conteúdo da API mudou
+        
+        Compara o hash do payload com CNPJData.content_hash: sem mudança,
+        apenas registra a verificação (checked_at) sem reescrever dados,
+        resultado ou critérios.
+        
+        Args:
+            cnpj: CNPJ para atualização
             
-            # Executa análise
-            analysis_results = self._execute_analysis(parsed_data)
+        Returns:
+            Dict com 'success' e 'changed' (mais o resultado completo quando mudou)
+        """
+        start_time = datetime.now()
+        
+        try:
+            raw_data = self.cnpja_service.get_cnpj_data(cnpj)
+            if not raw_data:
+                return {
+                    'success': False,
+                    'error': 'CNPJ não encontrado ou dados indisponíveis'
+                }
             
-            # Calcula score final
-            overall_score = self._calculate_overall_score(analysis_results)
-            status = self._determine_status(overall_score)
-            risk_level = self._determine_risk_level(overall_score)
+            content_hash = self.cnpja_service.payload_hash(raw_data)
+            unchanged = CNPJData.objects.filter(
+                cnpj=self.cnpja_service._clean_cnpj(cnpj),
+                content_hash=content_hash,
+                analysis__isnull=False
+            ).update(checked_at=timezone.now())
             
-            # Salva resultado
-            processing_time = (datetime.now() - start_time).total_seconds()
-            analysis_result = self._save_analysis_result(
-                cnpj_data, overall_score, status, risk_level, processing_time
-            )
+            if unchanged:
+                return {'success': True, 'changed': False}
             
-            # Salva critérios
-            self._save_analysis_criteria(analysis_result, analysis_results)
-            
-            return {
-                'success': True,
-                'cnpj_data': cnpj_data,
-                'analysis_result': analysis_result,
-                'criteria': analysis_results,
-                'overall_score': overall_score,
-                'status': status,
-                'risk_level': risk_level,
-                'processing_time': processing_time
-            }
+            result = self._analyze_payload(raw_data, start_time)
+            result['changed'] = True
+            return result
             
         except Exception as e:
-            logger.error(f"Erro na análise do CNPJ {cnpj}: {str(e)}")
+            logger.error(f"Erro na atualização do CNPJ {cnpj}: {str(e)}")
             return {
                 'success': False,
                 'error': f'Erro interno: {str(e)}'
             }
     
-    def _save_cnpj_data(self, parsed_data: Dict) -> CNPJData:
+    def _analyze_payload(self, raw_data: Dict, start_time: datetime,
+                         progress: Optional[ProgressCallback] = None) -> Dict:
+        """Processa, pontua e persiste um payload já obtido da API"""
+        progress = progress or _ignore_progress
+        progress('stage', {'stage': 'scoring'})
+        parsed_data, content_hash, analysis_results = self.score_payload(raw_data)
+        progress('company', {
+            'cnpj': parsed_data.cnpj,
+            'company_name': parsed_data.company_name,
+            'status': parsed_data.status,
+            'city': parsed_data.city,
+            'state': parsed_data.state
+        })
+        for criterion in analysis_results:
+            progress('criterion', criterion)
+        
+        progress('stage', {'stage': 'saving'})
+        return self.persist_scored(parsed_data, content_hash, analysis_results, start_time)
+    
+    def score_payload(self, raw_data: Dict,
+                      evaluation_date: Optional[date] = None) -> Tuple[ParsedCompany, str, List[Dict]]:
+        """
+        Etapa sem acesso ao banco: parse, hash e critérios puros
+        
+        Pode rodar em outro processo (pipeline de lotes); os critérios que
+        consultam o banco ficam para persist_scored. evaluation_date sobrescreve
+        a data de referência do engine (o pipeline fixa uma por lote).
+        """
+        # Processa dados (só os campos persistidos e os usados pelos critérios ativos)
+        parsed_data = self.cnpja_service.parse_cnpj_data(raw_data, self.parse_fields)
+        content_hash = self.cnpja_service.payload_hash(raw_data)
+        
+        # Executa análise
+        analysis_results = self._execute_analysis(
+            parsed_data, include_db_criteria=False, evaluation_date=evaluation_date
+        )
+        
+        return parsed_data, content_hash, analysis_results
+    
+    def persist_scored(self, parsed_data: ParsedCompany, content_hash: str, analysis_results: List[Dict],
+                       start_time: datetime) -> Dict:
+        """Grava dados e resultado de um payload já pontuado por score_payload"""
+        # Salva dados básicos
+        cnpj_data = self._save_cnpj_data(parsed_data, content_hash)
+        
+        # Critérios que dependem do banco (após gravar sócios da própria empresa)
+        analysis_results = analysis_results + self._execute_db_criteria(parsed_data)
+        
+        # Calcula score final
+        overall_score = self._calculate_overall_score(analysis_results)
+        status = self._determine_status(overall_score)
+        risk_level = self._determine_risk_level(overall_score)
+        
+        # Salva resultado e critérios juntos: leitores (e o cache) nunca veem um sem o outro
+        processing_time = (datetime.now() - start_time).total_seconds()
+        with transaction.atomic():
+            analysis_result = self._save_analysis_result(
+                cnpj_data, overall_score, status, risk_level, processing_time
+            )
+            self._save_analysis_criteria(analysis_result, analysis_results)
+            # Outbox: o dispatcher entrega depois; aqui só uma linha por assinatura ativa
+            enqueue_analysis_completed(analysis_result, self.api_key_id)
+        
+        return {
+            'success': True,
+            'cnpj_data': cnpj_data,
+            'analysis_result': analysis_result,
+            'criteria': analysis_results,
+            'overall_score': overall_score,
+            'status': status,
+            'risk_level': risk_level,
+            'processing_time': processing_time,
+            'reused': False
+        }
+    
+    def _get_fresh_result(self, cnpj_clean: str, start_time: datetime) -> Optional[Dict]:
+        """Retorna a análise armazenada se ainda estiver dentro do prazo de validade"""
+        analysis_result = AnalysisResult.objects.select_related('cnpj_data').filter(
+            cnpj_data__cnpj=cnpj_clean
+        ).first()
+        
+        if not analysis_result:
+            return None
+        
+        cnpj_data = analysis_result.cnpj_data
+        checked_at = cnpj_data.checked_at or analysis_result.analysis_date
+        if not self.freshness_policy.is_fresh(checked_at, cnpj_data.status):
+            return None
+        
+        # Critérios com prazo próprio vencido são recalculados com os dados gravados
+        stored_criteria = list(analysis_result.criteria.all())
+        stale = self.freshness_policy.stale_criteria({
+            c.criteria_name: c.evaluated_at or analysis_result.analysis_date for c in stored_criteria
+        })
+        stale &= set(self.criteria_weights)
+        if stale:
+            analysis_result = self._rescore_criteria(analysis_result, stored_criteria, stale)
+        
+        if self.explain:
+            criteria = self.explain_criteria(analysis_result)
+        else:
+            criteria = [
+                {
+                    'name': c.criteria_name,
+                    'description': c.criteria_description,
+                    'score': c.score,
+                    'weight': c.weight,
+                    'passed': c.passed,
+                    'details': c.details
+                }
+                for c in analysis_result.criteria.all()
+            ]
+        
+        result = {
+            'success': True,
+            'cnpj_data': analysis_result.cnpj_data,
+            'analysis_result': analysis_result,
+            'criteria': criteria,
+            'overall_score': analysis_result.overall_score,
+            'status': analysis_result.status,
+            'risk_level': analysis_result.risk_level,
+            'processing_time': (datetime.now() - start_time).total_seconds(),
+            'reused': True
+        }
+        if stale:
+            result['recomputed'] = sorted(stale)
+        return result
+    
+    def _rescore_criteria(self, analysis_result: AnalysisResult, stored_criteria: List[AnalysisCriteria],
+                          names: Set[str]) -> AnalysisResult:
+        """
+        Recalcula só os critérios informados e o score geral, sem consultar a API
+        
+        Os demais critérios mantêm a pontuação gravada; os que ainda não tinham
+        evaluated_at recebem a data da análise anterior, para não parecerem
+        recalculados agora.
+        """
+        cnpj_data = analysis_result.cnpj_data
+        parsed_data = self._parsed_from_record(cnpj_data)
+        evaluation_date = self.evaluation_date or timezone.localdate()
+        analyzers = {
+            'tempo_operacao': lambda: self._run_criterion(
+                'tempo_operacao', partial(self._analyze_tempo_operacao, evaluation_date=evaluation_date),
+                parsed_data, evaluation_date
+            ),
+            'rede_societaria': lambda: self._analyze_rede_societaria(parsed_data),
+        }
+        
+        now = timezone.now()
+        previous_date = analysis_result.analysis_date
+        for row in stored_criteria:
+            if row.criteria_name in names:
+                criteria = analyzers[row.criteria_name]()
+                row.criteria_description = criteria['description']
+                row.score = criteria['score']
+                row.weight = criteria['weight']
+                row.passed = criteria['passed']
+                row.details = criteria['details']
+                row.evaluated_at = now
+            elif row.evaluated_at is None:
+                row.evaluated_at = previous_date
+        
+        overall_score = self._calculate_overall_score([{'score': c.score, 'weight': c.weight} for c in stored_criteria])
+        analysis_result.overall_score = overall_score
+        analysis_result.status = self._determine_status(overall_score)
+        analysis_result.risk_level = self._determine_risk_level(overall_score)
+        analysis_result.analysis_date = now
+        
+        with transaction.atomic():
+            # A validade dos dados da API continua contando da verificação anterior
+            if cnpj_data.checked_at is None:
+                cnpj_data.checked_at = previous_date
+                CNPJData.objects.filter(pk=cnpj_data.pk).update(checked_at=previous_date)
+            AnalysisCriteria.objects.bulk_update(
+                stored_criteria,
+                ['criteria_description', 'score', 'weight', 'passed', 'details', 'evaluated_at']
+            )
+            analysis_result.save(update_fields=['overall_score', 'status', 'risk_level', 'analysis_date'])
+            transaction.on_commit(lambda: invalidate_analysis(analysis_result.id, previous_date))
+            enqueue_analysis_completed(analysis_result, self.api_key_id)
+        
+        logger.info(f"Critérios recalculados para {cnpj_data.cnpj}: {', '.join(sorted(names))}")
+        return analysis_result
+    
+    def _save_cnpj_data(self, parsed_data: ParsedCompany, content_hash: str = '') -> CNPJData:
         """Salva dados básicos do CNPJ"""
-        cnpj_clean = parsed_data['cnpj']
+        cnpj_clean = parsed_data.cnpj
         
-        # Converte data de fundação
-        founded_date = None
-        if parsed_data['founded_date']:
-            try:
-                founded_date = datetime.strptime(parsed_data['founded_date'], '%Y-%m-%d').date()
-            except:
-                pass
+        # Data de fundação já convertida no parse
+        founded_date = date.fromordinal(parsed_data.founded_ordinal) if parsed_data.founded_ordinal else None
         
         cnpj_data, created = CNPJData.objects.get_or_create(
             cnpj=cnpj_clean,
             defaults={
-                'company_name': parsed_data['company_name'],
-                'status': parsed_data['status'],
+                'company_name': parsed_data.company_name,
+                'status': parsed_data.status,
                 'founded_date': founded_date,
-                'equity': parsed_data['equity'],
-                'main_activity': parsed_data['main_activity'],
-                'city': parsed_data['city'],
-                'state': parsed_data['state']
+                'equity': parsed_data.equity,
+                'main_activity': parsed_data.main_activity,
+                'city': parsed_data.city,
+                'state': parsed_data.state,
+                'content_hash': content_hash,
+                'checked_at': timezone.now()
             }
         )
         
+        previous_hash = None if created else cnpj_data.content_hash
+        
         if not created:
             # Atualiza dados existentes
-            cnpj_data.company_name = parsed_data['company_name']
-            cnpj_data.status = parsed_data['status']
+            cnpj_data.company_name = parsed_data.company_name
+            cnpj_data.status = parsed_data.status
             cnpj_data.founded_date = founded_date
-            cnpj_data.equity = parsed_data['equity']
-            cnpj_data.main_activity = parsed_data['main_activity']
-            cnpj_data.city = parsed_data['city']
-            cnpj_data.state = parsed_data['state']
+            cnpj_data.equity = parsed_data.equity
+            cnpj_data.main_activity = parsed_data.main_activity
+            cnpj_data.city = parsed_data.city
+            cnpj_data.state = parsed_data.state
+            cnpj_data.content_hash = content_hash
+            cnpj_data.checked_at = timezone.now()
             cnpj_data.save()
         
+        # Tabelas normalizadas e histórico: só quando o conteúdo da API mudou
+        if not content_hash or content_hash != previous_hash:
+            self._save_activities(cnpj_data, parsed_data)
+            self._save_members(cnpj_data, parsed_data)
+            if content_hash:
+                record_version(cnpj_data, parsed_data, content_hash)
+        
         return cnpj_data
     
-    def _execute_analysis(self, parsed_data: Dict) -> List[Dict]:
-        """Executa todos os critérios de análise"""
+    def _save_activities(self, cnpj_data: CNPJData, parsed_data: ParsedCompany):
+        """Salva atividades principal e secundárias (CNAE) em lote"""
+        activities = {}
+        if parsed_data.main_activity_id:
+            activities[str(parsed_data.main_activity_id)] = (parsed_data.main_activity, True)
+        for side in parsed_data.side_activities:
+            if side.id:
+                activities.setdefault(side.id, (side.text, False))
+        
+        CompanyActivity.objects.filter(cnpj_data=cnpj_data).delete()
+        if not activities:
+            return
+        
+        Activity.objects.bulk_create(
+            [Activity(code=code, text=text[:500]) for code, (text, _) in activities.items()],
+            ignore_conflicts=True
+        )
+        activity_ids = dict(Activity.objects.filter(code__in=activities).values_list('code', 'id'))
+        CompanyActivity.objects.bulk_create([
+            CompanyActivity(cnpj_data=cnpj_data, activity_id=activity_ids[code], is_main=is_main)
+            for code, (_, is_main) in activities.items()
+        ])
+    
+    def _save_members(self, cnpj_data: CNPJData, parsed_data: ParsedCompany):
+        """Salva o quadro societário em lote"""
+        members = []
+        for m in parsed_data.members:
+            since = None
+            if m.since:
+                try:
+                    since = datetime.strptime(m.since, '%Y-%m-%d').date()
+                except ValueError:
+                    pass
+            members.append(Member(
+                cnpj_data=cnpj_data,
+                name=m.name.upper()[:255],
+                tax_id=m.tax_id[:20],
+                person_type=m.person_type,
+                role=m.role[:100],
+                is_administrator=m.is_administrator,
+                since=since
+            ))
+        
+        Member.objects.filter(cnpj_data=cnpj_data).delete()
+        Member.objects.bulk_create(members)
+        update_partner_graph(cnpj_data.id, {partner_key(m.tax_id, m.name) for m in members})
+    
+    def _execute_analysis(self, parsed_data: ParsedCompany, include_db_criteria: bool = True,
+                          evaluation_date: Optional[date] = None) -> List[Dict]:
+        """Executa todos os critérios de análise na data de referência informada"""
+        evaluation_date = evaluation_date or self.evaluation_date or timezone.localdate()
         criteria_results = []
         
         # Critério 1: Status Ativo
-        criteria_results.append(self._analyze_status_ativo(parsed_data))
+        criteria_results.append(self._run_criterion('status_ativo', self._analyze_status_ativo, parsed_data))
         
         # Critério 2: Tempo de Operação
-        criteria_results.append(self._analyze_tempo_operacao(parsed_data))
+        criteria_results.append(self._run_criterion(
+            'tempo_operacao', partial(self._analyze_tempo_operacao, evaluation_date=evaluation_date), parsed_data,
+            evaluation_date
+        ))
         
         # Critério 3: Capital Social
-        criteria_results.append(self._analyze_capital_social(parsed_data))
+        criteria_results.append(self._run_criterion('capital_social', self._analyze_capital_social, parsed_data))
         
         # Critério 4: Atividade de Educação
-        criteria_results.append(self._analyze_atividade_educacao(parsed_data))
+        criteria_results.append(
+            self._run_criterion('atividade_educacao', self._analyze_atividade_educacao, parsed_data)
+        )
         
         # Critério 5: Estrutura Societária
-        criteria_results.append(self._analyze_estrutura_societaria(parsed_data))
+        criteria_results.append(
+            self._run_criterion('estrutura_societaria', self._analyze_estrutura_societaria, parsed_data)
+        )
         
         # Critério 6: Localização
-        criteria_results.append(self._analyze_localizacao(parsed_data))
+        criteria_results.append(self._run_criterion('localizacao', self._analyze_localizacao, parsed_data))
+        
+        if include_db_criteria:
+            criteria_results.extend(self._execute_db_criteria(parsed_data))
+        
+        return criteria_results
+    
+    def _run_criterion(self, name: str, analyze, data: ParsedCompany,
+                       evaluation_date: Optional[date] = None) -> Dict:
+        """
+        Executa um critério puro, reaproveitando o resultado de entradas idênticas
+        
+        evaluation_date entra na configuração dos critérios que dependem do tempo;
+        explain também, já que muda o formato do resultado. A configuração faz
+        parte da chave da entrada, então engines com configurações diferentes
+        compartilham o memo sem se invalidarem.
+        """
+        if name not in CRITERIA_INPUTS:
+            return analyze(data)
+        fingerprint = tuple(getattr(data, field) for field in CRITERIA_INPUTS[name])
+        config = (self.criteria_weights[name], evaluation_date, self.explain)
+        return self.criteria_memo.get_or_compute(name, config, fingerprint, lambda: analyze(data))
+    
+    def _execute_db_criteria(self, parsed_data: ParsedCompany) -> List[Dict]:
+        """Critérios que consultam o banco"""
+        criteria_results = []
+        
+        # Critério opcional: Rede Societária
+        if 'rede_societaria' in self.criteria_weights:
+            criteria_results.append(self._analyze_rede_societaria(parsed_data))
         
         return criteria_results
     
-    def _analyze_status_ativo(self, data: Dict) -> Dict:
+    def explain_criteria(self, analysis_result: AnalysisResult,
+                         criteria: Optional[List[AnalysisCriteria]] = None) -> List[Dict]:
+        """
+        Critérios de uma análise gravada, com a explicação de cada um
+        
+        Critérios gravados no modo só score (descrição vazia) têm descrição e
+        detalhes regenerados a partir dos dados normalizados da empresa; score,
+        peso e aprovação continuam os gravados.
+        
+        Args:
+            analysis_result: Análise gravada
+            criteria: Critérios já carregados (padrão: analysis_result.criteria)
+        """
+        if criteria is None:
+            criteria = list(analysis_result.criteria.all())
+        
+        results = []
+        parsed_data = None
+        for c in criteria:
+            result = {
+                'name': c.criteria_name,
+                'description': c.criteria_description,
+                'score': c.score,
+                'weight': c.weight,
+                'passed': c.passed,
+                'details': c.details
+            }
+            if not c.criteria_description:
+                if parsed_data is None:
+                    parsed_data = self._parsed_from_record(analysis_result.cnpj_data)
+                explained = self._explain_criterion(c.criteria_name, parsed_data, c.details or {})
+                if explained is not None:
+                    result['description'] = explained['description']
+                    result['details'] = explained['details']
+            results.append(result)
+        return results
+    
+    def _explain_criterion(self, name: str, data: ParsedCompany, details: Dict) -> Optional[Dict]:
+        """Reexecuta um critério com explicação (rede_societaria: a partir das contagens gravadas)"""
+        if name == 'rede_societaria':
+            return {'description': self._describe_rede_societaria(details), 'details': details}
+        
+        analyze = getattr(self, f'_analyze_{name}', None)
+        if analyze is None:
+            return None
+        
+        explain = self.explain
+        self.explain = True
+        try:
+            if name == 'tempo_operacao' and details.get('evaluation_date'):
+                return analyze(data, evaluation_date=date.fromisoformat(details['evaluation_date']))
+            return analyze(data)
+        finally:
+            self.explain = explain
+    
+    def _parsed_from_record(self, cnpj_data: CNPJData) -> ParsedCompany:
+        """Reconstrói os campos usados pelos critérios a partir das tabelas normalizadas"""
+        parsed = ParsedCompany(cnpj_data.cnpj)
+        parsed.decoded = frozenset(self.criteria_fields)
+        parsed.status = cnpj_data.status
+        parsed.status_lower = cnpj_data.status.lower()
+        if cnpj_data.founded_date:
+            parsed.founded_date = cnpj_data.founded_date.isoformat()
+            parsed.founded_ordinal = cnpj_data.founded_date.toordinal()
+        parsed.equity = cnpj_data.equity
+        parsed.main_activity = cnpj_data.main_activity
+        parsed.main_activity_lower = cnpj_data.main_activity.lower()
+        parsed.city = cnpj_data.city
+        parsed.city_lower = cnpj_data.city.lower()
+        parsed.state = cnpj_data.state
+        parsed.state_upper = cnpj_data.state.upper()
+        parsed.side_activities = tuple(
+            ActivityInfo(code, text, text.lower())
+            for code, text in CompanyActivity.objects.filter(cnpj_data=cnpj_data, is_main=False).values_list(
+                'activity__code', 'activity__text'
+            )
+        )
+        parsed.members = tuple(
+            MemberInfo(m.name, m.tax_id, m.person_type, m.role, m.since.isoformat() if m.since else '',
+                       m.is_administrator)
+            for m in Member.objects.filter(cnpj_data=cnpj_data)
+        )
+        return parsed
+    
+    def _score_only(self, name: str, score: int, passed: bool, details: Optional[Dict] = None) -> Dict:
+        """Resultado compacto (modo só score): sem descrição; detalhes só o que não dá para reconstruir"""
+        return {
+            'name': name,
+            'description': '',
+            'score': score,
+            'weight': self.criteria_weights[name],
+            'passed': passed,
+            'details': details or {}
+        }
+    
+    def _analyze_status_ativo(self, data: ParsedCompany) -> Dict:
         """Analisa se a empresa está ativa"""
-        status = data.get('status', '').lower()
+        status = data.status_lower
         
         if 'ativa' in status:
             score = 100
@@ -165,22 +675,28 @@ class CNPJAnalysisEngine:
         else:
             score = 50
             passed = False
-            description = f"Status desconhecido: {status}"
+            description = None
+        
+        if not self.explain:
+            return self._score_only('status_ativo', score, passed)
         
         return {
             'name': 'status_ativo',
-            'description': description,
+            'description': description or f"Status desconhecido: {status}",
             'score': score,
             'weight': self.criteria_weights['status_ativo'],
             'passed': passed,
-            'details': {'status': data.get('status', '')}
+            'details': {'status': data.status}
         }
     
-    def _analyze_tempo_operacao(self, data: Dict) -> Dict:
-        """Analisa tempo de operação da empresa"""
-        founded_date = data.get('founded_date')
+    def _analyze_tempo_operacao(self, data: ParsedCompany, evaluation_date: Optional[date] = None) -> Dict:
+        """Analisa tempo de operação da empresa na data de referência"""
+        founded_date = data.founded_date
+        evaluation_date = evaluation_date or self.evaluation_date or timezone.localdate()
         
         if not founded_date:
+            if not self.explain:
+                return self._score_only('tempo_operacao', 0, False)
             return {
                 'name': 'tempo_operacao',
                 'description': 'Data de fundação não disponível',
@@ -190,55 +706,56 @@ class CNPJAnalysisEngine:
                 'details': {}
             }
         
-        try:
-            founded = datetime.strptime(founded_date, '%Y-%m-%d').date()
-            today = date.today()
-            years_operating = (today - founded).days / 365.25
-            
-            if years_operating >= 5:
-                score = 100
-                passed = True
-                description = f"Empresa operando há {years_operating:.1f} anos - excelente estabilidade"
-            elif years_operating >= 2:
-                score = 80
-                passed = True
-                description = f"Empresa operando há {years_operating:.1f} anos - boa estabilidade"
-            elif years_operating >= 1:
-                score = 60
-                passed = False
-                description = f"Empresa operando há {years_operating:.1f} anos - requer atenção"
-            else:
-                score = 20
-                passed = False
-                description = f"Empresa muito nova ({years_operating:.1f} anos) - alto risco"
-            
-            return {
-                'name': 'tempo_operacao',
-                'description': description,
-                'score': score,
-                'weight': self.criteria_weights['tempo_operacao'],
-                'passed': passed,
-                'details': {
-                    'founded_date': founded_date,
-                    'years_operating': round(years_operating, 1)
-                }
-            }
-            
-        except Exception as e:
+        founded = data.founded_ordinal
+        if not founded:
+            if not self.explain:
+                return self._score_only('tempo_operacao', 0, False)
             return {
                 'name': 'tempo_operacao',
-                'description': f'Erro ao processar data de fundação: {str(e)}',
+                'description': f'Erro ao processar data de fundação: formato inválido ({founded_date})',
                 'score': 0,
                 'weight': self.criteria_weights['tempo_operacao'],
                 'passed': False,
-                'details': {'error': str(e)}
+                'details': {'error': f'Data inválida: {founded_date}'}
             }
+        
+        # Só comparações de inteiros: limites de fundação pré-calculados para a data
+        tier = bisect_left(operating_years_boundaries(evaluation_date), founded)
+        score = TIER_SCORES[tier]
+        passed = tier <= 1
+        
+        if not self.explain:
+            # A data de referência é necessária para gerar a explicação depois
+            return self._score_only('tempo_operacao', score, passed, {'evaluation_date': evaluation_date.isoformat()})
+        
+        years_operating = (evaluation_date.toordinal() - founded) / DAYS_PER_YEAR
+        description = (
+            "Empresa operando há {:.1f} anos - excelente estabilidade",
+            "Empresa operando há {:.1f} anos - boa estabilidade",
+            "Empresa operando há {:.1f} anos - requer atenção",
+            "Empresa muito nova ({:.1f} anos) - alto risco",
+        )[tier].format(years_operating)
+        
+        return {
+            'name': 'tempo_operacao',
+            'description': description,
+            'score': score,
+            'weight': self.criteria_weights['tempo_operacao'],
+            'passed': passed,
+            'details': {
+                'founded_date': founded_date,
+                'years_operating': round(years_operating, 1),
+                'evaluation_date': evaluation_date.isoformat()
+            }
+        }
     
-    def _analyze_capital_social(self, data: Dict) -> Dict:
+    def _analyze_capital_social(self, data: ParsedCompany) -> Dict:
         """Analisa capital social da empresa"""
-        equity = data.get('equity')
+        equity = data.equity
         
         if not equity:
+            if not self.explain:
+                return self._score_only('capital_social', 30, False)
             return {
                 'name': 'capital_social',
                 'description': 'Capital social não informado',
@@ -250,22 +767,23 @@ class CNPJAnalysisEngine:
         
         equity_decimal = Decimal(str(equity))
         
-        if equity_decimal >= Decimal('1000000'):  # >= R$ 1M
-            score = 100
-            passed = True
-            description = f"Capital social robusto: R$ {equity_decimal:,.2f}"
-        elif equity_decimal >= Decimal('100000'):  # >= R$ 100k
-            score = 80
-            passed = True
-            description = f"Capital social adequado: R$ {equity_decimal:,.2f}"
-        elif equity_decimal >= Decimal('50000'):  # >= R$ 50k
-            score = 60
-            passed = False
-            description = f"Capital social baixo: R$ {equity_decimal:,.2f}"
-        else:
-            score = 20
-            passed = False
-            description = f"Capital social muito baixo: R$ {equity_decimal:,.2f}"
+        # Faixas: >= R$ 1M, >= R$ 100k, >= R$ 50k, abaixo
+        tier = next(
+            (index for index, threshold in enumerate(CAPITAL_THRESHOLDS) if equity_decimal >= threshold),
+            len(CAPITAL_THRESHOLDS)
+        )
+        score = TIER_SCORES[tier]
+        passed = tier <= 1
+        
+        if not self.explain:
+            return self._score_only('capital_social', score, passed)
+        
+        description = (
+            "Capital social robusto: R$ {:,.2f}",
+            "Capital social adequado: R$ {:,.2f}",
+            "Capital social baixo: R$ {:,.2f}",
+            "Capital social muito baixo: R$ {:,.2f}",
+        )[tier].format(equity_decimal)
         
         return {
             'name': 'capital_social',
@@ -276,10 +794,10 @@ class CNPJAnalysisEngine:
             'details': {'equity': float(equity_decimal)}
         }
     
-    def _analyze_atividade_educacao(self, data: Dict) -> Dict:
+    def _analyze_atividade_educacao(self, data: ParsedCompany) -> Dict:
         """Analisa se a atividade principal é relacionada à educação"""
-        main_activity = data.get('main_activity', '').lower()
-        side_activities = [act.get('text', '').lower() for act in data.get('side_activities', [])]
+        main_activity = data.main_activity_lower
+        side_activities = [act.text_lower for act in data.side_activities]
         
         education_keywords = [
             'educação', 'educacao', 'ensino', 'escola', 'universidade', 'faculdade',
@@ -314,6 +832,9 @@ class CNPJAnalysisEngine:
             passed = False
             description = "Atividades não relacionadas à educação"
         
+        if not self.explain:
+            return self._score_only('atividade_educacao', total_score, passed)
+        
         return {
             'name': 'atividade_educacao',
             'description': description,
@@ -321,17 +842,19 @@ class CNPJAnalysisEngine:
             'weight': self.criteria_weights['atividade_educacao'],
             'passed': passed,
             'details': {
-                'main_activity': data.get('main_activity', ''),
+                'main_activity': data.main_activity,
                 'education_side_activities': education_side_activities,
                 'total_side_activities': len(side_activities)
             }
         }
     
-    def _analyze_estrutura_societaria(self, data: Dict) -> Dict:
+    def _analyze_estrutura_societaria(self, data: ParsedCompany) -> Dict:
         """Analisa estrutura societária da empresa"""
-        members = data.get('members', [])
+        members = data.members
         
         if not members:
+            if not self.explain:
+                return self._score_only('estrutura_societaria', 50, False)
             return {
                 'name': 'estrutura_societaria',
                 'description': 'Informações societárias não disponíveis',
@@ -342,19 +865,26 @@ class CNPJAnalysisEngine:
             }
         
         # Conta sócios administradores
-        administrators = [m for m in members if 'administrador' in m.get('role', {}).get('text', '').lower()]
+        administrators = sum(1 for m in members if m.is_administrator)
         
-        if len(administrators) >= 2:
+        if administrators >= 2:
             score = 100
             passed = True
-            description = f"Boa estrutura societária com {len(administrators)} administradores"
-        elif len(administrators) == 1:
+        elif administrators == 1:
             score = 80
             passed = True
-            description = "Estrutura societária adequada com 1 administrador"
         else:
             score = 40
             passed = False
+        
+        if not self.explain:
+            return self._score_only('estrutura_societaria', score, passed)
+        
+        if administrators >= 2:
+            description = f"Boa estrutura societária com {administrators} administradores"
+        elif administrators == 1:
+            description = "Estrutura societária adequada com 1 administrador"
+        else:
             description = "Estrutura societária pode ser melhorada"
         
         return {
@@ -365,22 +895,18 @@ class CNPJAnalysisEngine:
             'passed': passed,
             'details': {
                 'total_members': len(members),
-                'administrators': len(administrators),
+                'administrators': administrators,
                 'members_info': [
-                    {
-                        'name': m.get('person', {}).get('name', ''),
-                        'role': m.get('role', {}).get('text', ''),
-                        'since': m.get('since', '')
-                    }
+                    {'name': m.name, 'role': m.role, 'since': m.since}
                     for m in members
                 ]
             }
         }
     
-    def _analyze_localizacao(self, data: Dict) -> Dict:
+    def _analyze_localizacao(self, data: ParsedCompany) -> Dict:
         """Analisa localização da empresa"""
-        state = data.get('state', '').upper()
-        city = data.get('city', '').lower()
+        state = data.state_upper
+        city = data.city_lower
         
         # Estados com maior concentração de IES
         major_states = ['SP', 'RJ', 'MG', 'RS', 'PR', 'SC', 'BA', 'GO', 'DF']
@@ -393,13 +919,18 @@ class CNPJAnalysisEngine:
         ]
         
         score = 50  # Score base
+        is_major_state = state in major_states
+        is_major_city = any(major_city in city for major_city in major_cities)
         
-        if state in major_states:
+        if is_major_state:
             score += 30
         
-        if any(major_city in city for major_city in major_cities):
+        if is_major_city:
             score += 20
         
+        if not self.explain:
+            return self._score_only('localizacao', score, score >= 60)
+        
         if score >= 80:
             passed = True
             description = f"Localização estratégica: {city.title()}/{state}"
@@ -419,11 +950,59 @@ class CNPJAnalysisEngine:
             'details': {
                 'state': state,
                 'city': city.title(),
-                'is_major_state': state in major_states,
-                'is_major_city': any(major_city in city for major_city in major_cities)
+                'is_major_state': is_major_state,
+                'is_major_city': is_major_city
             }
         }
     
+    def _analyze_rede_societaria(self, data: ParsedCompany) -> Dict:
+        """Analisa empresas ligadas por sócios em comum (baixadas ou reprovadas)"""
+        partner_keys = {partner_key(m.tax_id, m.name) for m in data.members}
+        depth = settings.PARTNER_NETWORK_DEPTH
+        related = get_partner_graph().related_by_partners(partner_keys, depth=depth)
+        
+        companies = list(
+            CNPJData.objects.filter(id__in=related).exclude(cnpj=data.cnpj)
+            .values_list('status', 'analysis__status')
+        )
+        risky = sum(
+            1 for status, analysis_status in companies
+            if 'baixada' in (status or '').lower() or analysis_status == 'REPROVADO'
+        )
+        
+        if not companies:
+            score = 100
+            passed = True
+        else:
+            score = round(100 * (1 - risky / len(companies)))
+            passed = score >= 60
+        
+        # Contagens dependem do estado do banco no momento: ficam mesmo no modo só score
+        details = {
+            'depth': depth,
+            'related_companies': len(companies),
+            'risky_companies': risky
+        }
+        if not self.explain:
+            return self._score_only('rede_societaria', score, passed, details)
+        
+        return {
+            'name': 'rede_societaria',
+            'description': self._describe_rede_societaria(details),
+            'score': score,
+            'weight': self.criteria_weights['rede_societaria'],
+            'passed': passed,
+            'details': details
+        }
+    
+    def _describe_rede_societaria(self, details: Dict) -> str:
+        related, risky = details['related_companies'], details['risky_companies']
+        if not related:
+            return "Nenhuma empresa relacionada por sócios em comum"
+        if risky == 0:
+            return f"{related} empresa(s) relacionada(s), nenhuma baixada ou reprovada"
+        return f"{risky} de {related} empresa(s) relacionada(s) baixada(s) ou reprovada(s)"
+    
     def _calculate_overall_score(self, criteria_results: List[Dict]) -> int:
         """Calcula score geral ponderado"""
         total_weighted_score = 0
@@ -443,18 +1022,18 @@ class CNPJAnalysisEngine:
     
     def _determine_status(self, score: int) -> str:
         """Determina status baseado no score"""
-        if score >= 80:
+        if score >= STATUS_THRESHOLDS[0]:
             return 'APROVADO'
-        elif score >= 60:
+        elif score >= STATUS_THRESHOLDS[1]:
             return 'ATENCAO'
         else:
             return 'REPROVADO'
     
     def _determine_risk_level(self, score: int) -> str:
         """Determina nível de risco baseado no score"""
-        if score >= 80:
+        if score >= STATUS_THRESHOLDS[0]:
             return 'Baixo'
-        elif score >= 60:
+        elif score >= STATUS_THRESHOLDS[1]:
             return 'Médio'
         else:
             return 'Alto'
@@ -472,13 +1051,19 @@ class CNPJAnalysisEngine:
             }
         )
         
+        previous_date = None
         if not created:
+            previous_date = analysis_result.analysis_date
             analysis_result.overall_score = overall_score
             analysis_result.status = status
             analysis_result.risk_level = risk_level
             analysis_result.processing_time = processing_time
+            analysis_result.analysis_date = timezone.now()
             analysis_result.save()
         
+        # Invalida respostas em cache só depois que os critérios também forem gravados
+        transaction.on_commit(lambda: invalidate_analysis(analysis_result.id, previous_date))
+        
         return analysis_result
     
     def _save_analysis_criteria(self, analysis_result: AnalysisResult, criteria_results: List[Dict]):
@@ -487,9 +1072,11 @@ class CNPJAnalysisEngine:
         AnalysisCriteria.objects.filter(analysis_result=analysis_result).delete()
         
         # Salva novos critérios
-        for criteria in criteria_results:
-            AnalysisCriteria.objects.create(
+        evaluated_at = timezone.now()
+        AnalysisCriteria.objects.bulk_create([
+            AnalysisCriteria(
                 analysis_result=analysis_result,
+                evaluated_at=evaluated_at,
                 criteria_name=criteria['name'],
                 criteria_description=criteria['description'],
                 score=criteria['score'],
@@ -497,3 +1084,5 @@ class CNPJAnalysisEngine:
                 passed=criteria['passed'],
                 details=criteria['details']
             )
+            for criteria in criteria_results
+        ])
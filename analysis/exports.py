@@ -0,0 +1,92 @@
+import csv
+import json
+from typing import Dict, Iterable, Iterator, List
+
+from django.db.models import Prefetch
+
+from .models import AnalysisResult, AnalysisCriteria
+
+EXPORT_CHUNK_SIZE = 2000
+
+BASE_COLUMNS = [
+    'analysis_id', 'cnpj', 'company_name', 'company_status', 'founded_date',
+    'equity', 'main_activity', 'city', 'state', 'overall_score', 'status',
+    'risk_level', 'analysis_date', 'processing_time'
+]
+
+
+class _Echo:
+    """Pseudo-buffer usado pelo csv.writer para devolver cada linha escrita"""
+
+    def write(self, value):
+        return value
+
+
+def build_export_queryset(queryset) -> Iterator[AnalysisResult]:
+    """
+    Itera análises em blocos com os critérios pré-carregados por bloco
+
+    Usa cursor do servidor (quando suportado) e um único SELECT de critérios
+    por bloco, mantendo a memória constante independente do volume.
+    """
+    criteria_qs = AnalysisCriteria.objects.only(
+        'analysis_result_id', 'criteria_name', 'score', 'passed'
+    ).order_by()
+
+    return queryset.select_related('cnpj_data').prefetch_related(
+        Prefetch('criteria', queryset=criteria_qs)
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def export_columns(criteria_names: Iterable[str]) -> List[str]:
+    """Colunas do export com os critérios pivotados"""
+    columns = list(BASE_COLUMNS)
+    for name in criteria_names:
+        columns.append(f'{name}_score')
+        columns.append(f'{name}_passed')
+    return columns
+
+
+def serialize_row(analysis: AnalysisResult, criteria_names: Iterable[str]) -> Dict:
+    """Achata análise, dados do CNPJ e critérios em uma única linha"""
+    cnpj_data = analysis.cnpj_data
+    row = {
+        'analysis_id': analysis.id,
+        'cnpj': cnpj_data.cnpj,
+        'company_name': cnpj_data.company_name,
+        'company_status': cnpj_data.status,
+        'founded_date': cnpj_data.founded_date.isoformat() if cnpj_data.founded_date else None,
+        'equity': float(cnpj_data.equity) if cnpj_data.equity is not None else None,
+        'main_activity': cnpj_data.main_activity,
+        'city': cnpj_data.city,
+        'state': cnpj_data.state,
+        'overall_score': analysis.overall_score,
+        'status': analysis.status,
+        'risk_level': analysis.risk_level,
+        'analysis_date': analysis.analysis_date.isoformat(),
+        'processing_time': analysis.processing_time
+    }
+
+    criteria = {c.criteria_name: c for c in analysis.criteria.all()}
+    for name in criteria_names:
+        item = criteria.get(name)
+        row[f'{name}_score'] = item.score if item else None
+        row[f'{name}_passed'] = item.passed if item else None
+
+    return row
+
+
+def stream_csv(queryset, criteria_names: List[str]) -> Iterator[str]:
+    """Gera o export em CSV linha a linha"""
+    columns = export_columns(criteria_names)
+    writer = csv.DictWriter(_Echo(), fieldnames=columns)
+
+    yield writer.writerow(dict(zip(columns, columns)))
+    for analysis in build_export_queryset(queryset):
+        yield writer.writerow(serialize_row(analysis, criteria_names))
+
+
+def stream_ndjson(queryset, criteria_names: List[str]) -> Iterator[str]:
+    """Gera o export em NDJSON (um objeto JSON por linha)"""
+    for analysis in build_export_queryset(queryset):
+        yield json.dumps(serialize_row(analysis, criteria_names), ensure_ascii=False) + '\n'
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+
+# Critérios cujo resultado muda sem que os dados da API mudem: o prazo deles
+# conta a partir da pontuação (evaluated_at), não da última consulta à API
+LOCAL_INPUT_CRITERIA = frozenset({
+    'tempo_operacao',   # data de referência da avaliação
+    'rede_societaria',  # empresas ligadas gravadas no banco
+})
+
+
+class FreshnessPolicy:
+    """
+    Política de reaproveitamento de análises armazenadas
+
+    A validade dos dados da API é definida por um prazo global, sobrescrito
+    por status da empresa (ex.: 'baixada' raramente muda) e limitado pelos
+    prazos dos critérios que só dependem desses dados. Critérios de
+    LOCAL_INPUT_CRITERIA com prazo próprio vencem individualmente, conforme a
+    idade da última pontuação de cada um, e são recalculados sem consultar a
+    API (ver CNPJAnalysisEngine).
+    """
+
+    def __init__(self, default_days: float, status_days: Optional[Dict[str, float]] = None,
+                 criteria_days: Optional[Dict[str, float]] = None):
+        self.default = timedelta(days=default_days)
+        self.by_status = {
+            status.strip().lower(): timedelta(days=days)
+            for status, days in (status_days or {}).items()
+        }
+        self.by_criterion = {name: timedelta(days=days) for name, days in (criteria_days or {}).items()}
+        self.criteria_cap = min(
+            (max_age for name, max_age in self.by_criterion.items() if name not in LOCAL_INPUT_CRITERIA),
+            default=None
+        )
+
+    @classmethod
+    def from_settings(cls) -> 'FreshnessPolicy':
+        """Cria a política a partir de settings.ANALYSIS_FRESHNESS"""
+        config = settings.ANALYSIS_FRESHNESS
+        return cls(
+            default_days=config.get('default', settings.ANALYSIS_FRESHNESS_DAYS),
+            status_days=config.get('status'),
+            criteria_days=config.get('criteria')
+        )
+
+    def _cap(self, max_age: timedelta) -> timedelta:
+        if self.criteria_cap is not None:
+            return min(max_age, self.criteria_cap)
+        return max_age
+
+    def max_age(self, company_status: str) -> timedelta:
+        """Prazo de validade para uma empresa com o status informado"""
+        return self._cap(self.by_status.get((company_status or '').strip().lower(), self.default))
+
+    def stale_criteria(self, evaluated_at: Dict[str, datetime], now: Optional[datetime] = None) -> Set[str]:
+        """
+        Critérios de LOCAL_INPUT_CRITERIA com prazo próprio já vencido
+
+        Args:
+            evaluated_at: Quando cada critério gravado foi pontuado
+        """
+        now = now or timezone.now()
+        return {
+            name for name, moment in evaluated_at.items()
+            if name in LOCAL_INPUT_CRITERIA and name in self.by_criterion
+            and moment < now - self.by_criterion[name]
+        }
+
+    def is_fresh(self, checked_at: datetime, company_status: str, now: Optional[datetime] = None) -> bool:
+        """Indica se dados verificados na API em checked_at ainda são válidos"""
+        now = now or timezone.now()
+        return checked_at >= now - self.max_age(company_status)
+
+    def fresh_q(self, now: Optional[datetime] = None, status_field: str = 'cnpj_data__status',
+                date_field: str = 'cnpj_data__checked_at') -> Q:
+        """
+        Filtro equivalente a is_fresh para uso em consultas
+
+        Args:
+            now: Referência de tempo (padrão: agora)
+            status_field: Campo com o status da empresa
+            date_field: Campo com a data da última verificação na API
+        """
+        now = now or timezone.now()
+
+        query = Q()
+        for status, max_age in self.by_status.items():
+            query |= Q(**{f'{status_field}__iexact': status, f'{date_field}__gte': now - self._cap(max_age)})
+
+        others = Q(**{f'{date_field}__gte': now - self._cap(self.default)})
+        for status in self.by_status:
+            others &= ~Q(**{f'{status_field}__iexact': status})
+
+        return query | others
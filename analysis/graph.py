@@ -0,0 +1,196 @@
+"""
+Índice em memória de vínculos empresa ↔ sócio
+
+Construído a partir da tabela Member e atualizado incrementalmente quando uma
+empresa é reanalisada. Responde "empresas que compartilham sócio com X até a
+profundidade N" com uma busca em largura sobre dicionários de conjuntos.
+
+As atualizações incrementais são aplicadas só depois que a transação que
+gravou os sócios confirma (um rollback não deixa vínculos fantasmas). Após
+PARTNER_GRAPH_MAX_AGE segundos o grafo é reconstruído em segundo plano: as
+requisições continuam usando o grafo atual, e as atualizações confirmadas
+durante a reconstrução são reaplicadas no grafo novo antes da troca.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Member
+
+logger = logging.getLogger('analysis')
+
+
+def partner_key(tax_id: str, name: str) -> str:
+    """Chave do sócio: CPF mascarado sozinho colide, então combina com o nome"""
+    return f"{(tax_id or '').strip()}|{(name or '').strip().upper()}"
+
+
+class PartnerGraph:
+    """Grafo bipartido empresa (id de CNPJData) ↔ sócio (partner_key)"""
+
+    def __init__(self):
+        self.company_partners: Dict[int, Set[str]] = {}
+        self.partner_companies: Dict[str, Set[int]] = {}
+        self.built_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls) -> 'PartnerGraph':
+        """Constrói o grafo completo a partir dos sócios armazenados"""
+        graph = cls()
+        rows = Member.objects.values_list('cnpj_data_id', 'tax_id', 'name').order_by().iterator(chunk_size=5000)
+        for cnpj_id, tax_id, name in rows:
+            key = partner_key(tax_id, name)
+            graph.company_partners.setdefault(cnpj_id, set()).add(key)
+            graph.partner_companies.setdefault(key, set()).add(cnpj_id)
+        return graph
+
+    def update_company(self, cnpj_id: int, partner_keys: Iterable[str]):
+        """Substitui os vínculos de uma empresa sem reconstruir o grafo"""
+        partner_keys = set(partner_keys)
+        with self._lock:
+            for key in self.company_partners.pop(cnpj_id, set()) - partner_keys:
+                companies = self.partner_companies.get(key)
+                if companies is not None:
+                    companies.discard(cnpj_id)
+                    if not companies:
+                        del self.partner_companies[key]
+
+            if partner_keys:
+                self.company_partners[cnpj_id] = partner_keys
+                for key in partner_keys:
+                    self.partner_companies.setdefault(key, set()).add(cnpj_id)
+
+    def related_by_partners(self, partner_keys: Iterable[str], depth: int = 1,
+                            exclude: Optional[int] = None) -> Dict[int, int]:
+        """
+        Empresas alcançáveis a partir de um conjunto de sócios
+
+        Returns:
+            Dict {id da empresa: distância (1 = sócio em comum direto)}
+        """
+        distances: Dict[int, int] = {}
+        seen_partners = set(partner_keys)
+        frontier = set(seen_partners)
+
+        for distance in range(1, depth + 1):
+            companies = set()
+            for key in frontier:
+                companies.update(self.partner_companies.get(key, ()))
+            companies.difference_update(distances)
+            companies.discard(exclude)
+            if not companies:
+                break
+
+            for cnpj_id in companies:
+                distances[cnpj_id] = distance
+
+            frontier = set()
+            for cnpj_id in companies:
+                frontier.update(self.company_partners.get(cnpj_id, ()))
+            frontier -= seen_partners
+            seen_partners |= frontier
+
+        return distances
+
+    def related(self, cnpj_id: int, depth: int = 1) -> Dict[int, int]:
+        """Empresas que compartilham sócio com a empresa informada"""
+        return self.related_by_partners(self.company_partners.get(cnpj_id, ()), depth, exclude=cnpj_id)
+
+
+_graph: Optional[PartnerGraph] = None
+_graph_lock = threading.Lock()
+# Atualizações confirmadas durante uma reconstrução (None: nenhuma em andamento)
+_pending: Optional[List[Tuple[int, Set[str]]]] = None
+_rebuild_lock = threading.Lock()
+
+
+def _swap_in_rebuild() -> PartnerGraph:
+    """Constrói o grafo fora de _graph_lock e o publica com as atualizações do meio tempo"""
+    global _graph, _pending
+    with _graph_lock:
+        _pending = []
+    try:
+        graph = PartnerGraph.build()
+    except Exception:
+        with _graph_lock:
+            _pending = None
+        raise
+
+    with _graph_lock:
+        for cnpj_id, partner_keys in _pending:
+            graph.update_company(cnpj_id, partner_keys)
+        _pending = None
+        _graph = graph
+    return graph
+
+
+def refresh_partner_graph() -> Optional[PartnerGraph]:
+    """Reconstrói o grafo do banco e troca o atual; None se outra reconstrução está em andamento"""
+    if not _rebuild_lock.acquire(blocking=False):
+        return None
+    try:
+        return _swap_in_rebuild()
+    finally:
+        _rebuild_lock.release()
+
+
+def _refresh_in_background():
+    try:
+        refresh_partner_graph()
+    except Exception as e:
+        logger.error(f"Erro ao reconstruir o grafo societário: {str(e)}")
+    finally:
+        connection.close()
+
+
+def get_partner_graph() -> PartnerGraph:
+    """
+    Grafo compartilhado do processo
+
+    Só o primeiro acesso espera a construção. Com o grafo mais velho que
+    PARTNER_GRAPH_MAX_AGE, dispara a reconstrução em uma thread e devolve o
+    grafo atual.
+    """
+    graph = _graph
+    if graph is None:
+        with _rebuild_lock:
+            graph = _graph
+            if graph is None:
+                graph = _swap_in_rebuild()
+        return graph
+
+    if time.monotonic() - graph.built_at > settings.PARTNER_GRAPH_MAX_AGE and not _rebuild_lock.locked():
+        threading.Thread(target=_refresh_in_background, name='partner-graph-rebuild', daemon=True).start()
+    return graph
+
+
+def _apply_update(cnpj_id: int, partner_keys: Set[str]):
+    with _graph_lock:
+        if _pending is not None:
+            _pending.append((cnpj_id, partner_keys))
+        graph = _graph
+    if graph is not None:
+        graph.update_company(cnpj_id, partner_keys)
+
+
+def update_partner_graph(cnpj_id: int, partner_keys: Iterable[str]):
+    """
+    Atualização incremental, aplicada quando a transação corrente confirmar
+
+    Se o grafo ainda não existe, será construído do banco.
+    """
+    partner_keys = set(partner_keys)
+    transaction.on_commit(lambda: _apply_update(cnpj_id, partner_keys))
+
+
+def reset_partner_graph():
+    """Descarta o grafo do processo (próximo acesso reconstrói)"""
+    global _graph
+    with _graph_lock:
+        _graph = None
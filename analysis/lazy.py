@@ -0,0 +1,57 @@
+"""
+Importação tardia de módulos pesados
+
+Workers de pontuação e comandos de gerenciamento importam engines/services
+sem nunca fazer uma requisição HTTP ou uma validação vetorizada; requests e
+numpy só são carregados no primeiro uso. Dependências opcionais são
+verificadas com find_spec, que localiza o módulo sem executá-lo.
+"""
+
+import importlib
+import importlib.util
+import threading
+from types import ModuleType
+from typing import Optional
+
+
+class LazyModule:
+    """Representa um módulo que só é importado no primeiro acesso a um atributo"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module: Optional[ModuleType] = None
+        self._lock = threading.Lock()
+
+    def load(self) -> ModuleType:
+        """Importa o módulo agora (ex.: no warm-up, antes do fork dos workers)"""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        # Sem cópia dos atributos: mock.patch('requests.get') continua valendo
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = 'carregado' if self._module is not None else 'não carregado'
+        return f'<LazyModule {self._name!r} ({state})>'
+
+
+def lazy_import(name: str, optional: bool = False) -> Optional[LazyModule]:
+    """
+    Módulo importado no primeiro uso
+
+    Args:
+        name: Nome do módulo
+        optional: Retorna None se o módulo não estiver instalado (como o
+            `except ImportError: np = None` das dependências opcionais)
+    """
+    if optional and importlib.util.find_spec(name) is None:
+        return None
+    return LazyModule(name)
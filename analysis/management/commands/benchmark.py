@@ -0,0 +1,29 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from analysis import benchmarks
+
+SCENARIOS = {
+    'sqlite-writers': benchmarks.run_sqlite_writers,
+    'parsed-memory': benchmarks.run_parsed_memory,
+    'payload-decode': benchmarks.run_payload_decode,
+    'pipeline': benchmarks.run_pipeline,
+    'simulation': benchmarks.run_simulation,
+    'criteria-memo': benchmarks.run_criteria_memo,
+    'score-only': benchmarks.run_score_only,
+    'import-time': benchmarks.run_import_time,
+    'warmup': benchmarks.run_warmup,
+}
+
+
+class Command(BaseCommand):
+    help = 'Executa benchmarks de desempenho e imprime os resultados em JSON'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS), help='Cenário de benchmark')
+
+    def handle(self, *args, **options):
+        result = SCENARIOS[options['scenario']]()
+        self.stdout.write(json.dumps(result, indent=2, ensure_ascii=False))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from analysis.apikeys import create_api_key
+
+
+class Command(BaseCommand):
+    help = 'Cria uma chave de API (a chave só é exibida agora; o banco guarda apenas o hash)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='Cliente/sistema dono da chave')
+        parser.add_argument('--rate', type=int, default=None,
+                            help='Requisições por minuto (padrão: API_KEY_RATE_LIMIT_PER_MINUTE)')
+        parser.add_argument('--quota', type=int, default=None,
+                            help='Análises por mês (padrão: sem limite)')
+
+    def handle(self, *args, **options):
+        api_key, raw_key = create_api_key(
+            options['name'], rate_limit_per_minute=options['rate'], monthly_quota=options['quota']
+        )
+        self.stdout.write(self.style.SUCCESS(f"Chave criada para {api_key.name} (id {api_key.id}):"))
+        self.stdout.write(raw_key)
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from analysis.webhooks import WebhookDispatcher
+
+
+class Command(BaseCommand):
+    help = 'Entrega os eventos de webhook pendentes no outbox (em lotes por endpoint, com retentativas)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Envia o que estiver vencido e termina (para cron)')
+        parser.add_argument('--poll', type=float, default=None,
+                            help='Intervalo entre consultas ao outbox em segundos (padrão: WEBHOOK_POLL_SECONDS)')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Eventos por requisição (padrão: WEBHOOK_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        dispatcher = WebhookDispatcher(batch_size=options['batch_size'])
+
+        if not options['once']:
+            self.stdout.write('Dispatcher de webhooks iniciado (Ctrl+C para encerrar)')
+            try:
+                dispatcher.run(poll_seconds=options['poll'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        totals = {'events': 0, 'requests': 0, 'delivered': 0, 'retried': 0, 'failed': 0}
+        try:
+            while True:
+                stats = dispatcher.dispatch_once()
+                for key, value in stats.items():
+                    totals[key] += value
+                if stats['events'] < dispatcher.claim_size:
+                    break
+        finally:
+            dispatcher.close()
+
+        style = self.style.WARNING if totals['retried'] or totals['failed'] else self.style.SUCCESS
+        self.stdout.write(style(
+            f"Eventos: {totals['events']} | Requisições: {totals['requests']} | Entregues: {totals['delivered']} | "
+            f"Reagendados: {totals['retried']} | Falhas: {totals['failed']}"
+        ))
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from analysis.apikeys import flush_usage, month_start
+from analysis.models import ApiKey
+
+
+class Command(BaseCommand):
+    help = 'Grava no banco o consumo das chaves de API acumulado no cache (mês corrente e anterior)'
+
+    def handle(self, *args, **options):
+        current = month_start()
+        previous = month_start(current - timedelta(days=1))
+        key_ids = list(ApiKey.objects.values_list('id', flat=True))
+
+        written = flush_usage((key_id, month) for key_id in key_ids for month in (previous, current))
+        self.stdout.write(self.style.SUCCESS(f"Consumo gravado: {written} registro(s) de {len(key_ids)} chave(s)"))
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from analysis.retention import is_partitioned, prune_logs
+
+
+class Command(BaseCommand):
+    help = 'Arquiva em NDJSON.gz e descarta em bloco os logs de análise mais antigos que o prazo de retenção'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Prazo de retenção em dias (padrão: LOG_RETENTION_DAYS)')
+        parser.add_argument('--archive-dir', default=None,
+                            help='Diretório dos arquivos (padrão: LOG_ARCHIVE_DIR)')
+        parser.add_argument('--no-archive', action='store_true',
+                            help='Descarta sem arquivar')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Só lista os meses que seriam descartados')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError('--days não pode ser negativo')
+        archive_dir = None if options['no_archive'] else (options['archive_dir'] or settings.LOG_ARCHIVE_DIR)
+
+        report = prune_logs(days=options['days'], archive_dir=archive_dir, dry_run=options['dry_run'])
+        if not report:
+            self.stdout.write('Nenhum mês fora do prazo de retenção')
+            return
+
+        storage = 'partições mensais' if is_partitioned() else 'DELETE em blocos'
+        for entry in report:
+            if options['dry_run']:
+                self.stdout.write(f"{entry['month']}: seria descartado ({storage})")
+                continue
+            archived = f" | Arquivo: {entry['archive']} ({entry['archived_rows']} linhas)" if 'archive' in entry else ''
+            dropped = 'partição removida' if entry['partition_dropped'] else f"{entry['deleted_rows']} linhas apagadas"
+            self.stdout.write(self.style.SUCCESS(f"{entry['month']}: {dropped}{archived}"))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from analysis.refresh import PortfolioRefresher
+
+
+class Command(BaseCommand):
+    help = 'Reverifica na API CNPJA as empresas vencidas pela política de reaproveitamento'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Máximo de CNPJs consultados nesta execução')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='CNPJs lidos do banco por bloco')
+        parser.add_argument('--rate', type=int, default=None,
+                            help='Requisições por minuto (padrão: CNPJA_RATE_LIMIT_PER_MINUTE)')
+        parser.add_argument('--all', action='store_true',
+                            help='Inclui CNPJs ainda dentro do prazo de validade')
+
+    def handle(self, *args, **options):
+        refresher = PortfolioRefresher(rate_per_minute=options['rate'], batch_size=options['batch_size'])
+        stats = refresher.run(limit=options['limit'], include_fresh=options['all'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Verificados: {stats['checked']} | Alterados: {stats['changed']} | "
+            f"Sem alteração: {stats['unchanged']} | Falhas: {stats['failed']}"
+        ))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analysis.batch import BatchProcessor, resumable_jobs
+from analysis.models import BatchJob
+
+
+class Command(BaseCommand):
+    help = 'Retoma lotes interrompidos a partir do último checkpoint gravado'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', type=int, action='append', default=None,
+                            help='Processa só este lote (pode ser repetido)')
+        parser.add_argument('--claim-size', type=int, default=None,
+                            help='Itens reservados por vez (padrão: BATCH_CLAIM_SIZE)')
+        parser.add_argument('--lease', type=int, default=None,
+                            help='Validade da reserva em segundos (padrão: BATCH_LEASE_SECONDS)')
+
+    def handle(self, *args, **options):
+        if options['job']:
+            jobs = list(BatchJob.objects.filter(id__in=options['job']).order_by('id'))
+            missing = set(options['job']) - {job.id for job in jobs}
+            if missing:
+                raise CommandError(f"Lote(s) não encontrado(s): {', '.join(map(str, sorted(missing)))}")
+        else:
+            jobs = list(resumable_jobs())
+
+        if not jobs:
+            self.stdout.write('Nenhum lote com itens pendentes')
+            return
+
+        for job in jobs:
+            job = BatchProcessor(job, claim_size=options['claim_size'], lease_seconds=options['lease']).run()
+            style = self.style.ERROR if job.status == 'FAILED' else self.style.SUCCESS
+            self.stdout.write(style(
+                f"Lote {job.id}: {job.status} | Processados: {job.processed_items} | "
+                f"Falhas: {job.failed_items} | Progresso: {job.progress}%"
+            ))
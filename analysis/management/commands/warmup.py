@@ -0,0 +1,17 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from analysis.warmup import PHASES, warm_up
+
+
+class Command(BaseCommand):
+    help = 'Executa o aquecimento dos workers web e imprime o tempo de cada etapa em JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--phase', choices=PHASES + ('all',), default='all',
+                            help='Fase do aquecimento (padrão: all)')
+
+    def handle(self, *args, **options):
+        report = warm_up(options['phase'], freeze=False)
+        self.stdout.write(json.dumps(report, indent=2, ensure_ascii=False))
@@ -0,0 +1,112 @@
+"""
+Memorização de resultados de critérios
+
+Cada critério sem acesso ao banco declara os atributos do ParsedCompany que
+usa (CRITERIA_INPUTS em engines.py); o resultado fica em um LRU limitado,
+por critério, indexado pelos valores desses atributos. Em lotes, combinações
+como (UF, cidade), capital social ou textos de CNAE se repetem muito.
+
+A configuração do critério (peso, data da avaliação quando for o caso e modo
+de explicação) faz parte da chave de cada entrada: lotes só score e análises
+interativas com explicação, ou lotes retomados com outra data de referência,
+convivem no mesmo LRU sem descartar as entradas uns dos outros. Entradas de
+configurações que deixam de ser usadas saem pelo LRU.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+from django.conf import settings
+
+
+class CriterionCache:
+    """LRU de um critério, com contadores de acerto"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'size': len(self.entries)
+        }
+
+
+class CriteriaMemo:
+    """LRUs de resultados de critérios, compartilhados entre engines do processo"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._caches: Dict[str, CriterionCache] = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, name: str, config: Hashable, fingerprint: Hashable,
+                       compute: Callable[[], Dict]) -> Dict:
+        """
+        Retorna o resultado memorizado ou calcula e guarda
+
+        Args:
+            name: Nome do critério
+            config: Configuração que afeta o resultado (entra na chave da entrada)
+            fingerprint: Valores dos atributos de entrada do critério
+            compute: Calcula o resultado quando não está em cache
+        """
+        if self.maxsize <= 0:
+            return compute()
+
+        key = (config, fingerprint)
+        with self._lock:
+            cache = self._caches.get(name)
+            if cache is None:
+                cache = self._caches[name] = CriterionCache(self.maxsize)
+
+            result = cache.entries.get(key)
+            if result is not None:
+                cache.entries.move_to_end(key)
+                cache.hits += 1
+                return dict(result)
+            cache.misses += 1
+
+        result = compute()
+
+        with self._lock:
+            cache.entries[key] = result
+            if len(cache.entries) > cache.maxsize:
+                cache.entries.popitem(last=False)
+        return dict(result)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Acertos, falhas, taxa de acerto e tamanho por critério"""
+        with self._lock:
+            return {name: cache.stats() for name, cache in sorted(self._caches.items())}
+
+    def clear(self):
+        with self._lock:
+            self._caches.clear()
+
+
+_memo: Optional[CriteriaMemo] = None
+_memo_lock = threading.Lock()
+
+
+def get_criteria_memo() -> CriteriaMemo:
+    """Memo compartilhado do processo (tamanho por critério: ANALYSIS_CRITERIA_MEMO_SIZE)"""
+    global _memo
+    with _memo_lock:
+        if _memo is None:
+            _memo = CriteriaMemo(settings.ANALYSIS_CRITERIA_MEMO_SIZE)
+        return _memo
+
+
+def reset_criteria_memo():
+    """Descarta o memo (usado nos testes e ao mudar a configuração em tempo de execução)"""
+    global _memo
+    with _memo_lock:
+        _memo = None
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('PENDING', 'Pendente'), ('RUNNING', 'Em processamento'), ('COMPLETED', 'Concluído'), ('FAILED', 'Falhou')], default='PENDING', max_length=10)),
+                ('total_items', models.IntegerField(default=0, help_text='CNPJs válidos e únicos do arquivo')),
+                ('invalid_items', models.IntegerField(default=0, help_text='Linhas com CNPJ inválido')),
+                ('duplicate_items', models.IntegerField(default=0, help_text='CNPJs repetidos no arquivo')),
+                ('skipped_items', models.IntegerField(default=0, help_text='CNPJs com análise recente reaproveitada')),
+                ('processed_items', models.IntegerField(default=0)),
+                ('failed_items', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Lote de Análise',
+                'verbose_name_plural': 'Lotes de Análise',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BatchItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cnpj', models.CharField(max_length=14)),
+                ('status', models.CharField(choices=[('PENDING', 'Pendente'), ('SKIPPED', 'Reaproveitado'), ('DONE', 'Processado'), ('FAILED', 'Falhou')], default='PENDING', max_length=10)),
+                ('error', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('analysis_result', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='batch_items', to='analysis.analysisresult')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='analysis.batchjob')),
+            ],
+            options={
+                'verbose_name': 'Item do Lote',
+                'verbose_name_plural': 'Itens dos Lotes',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['job', 'status'], name='analysis_ba_job_id_dc49c1_idx')],
+                'unique_together': {('job', 'cnpj')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:26
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_checked_at(apps, schema_editor):
+    CNPJData = apps.get_model('analysis', 'CNPJData')
+    CNPJData.objects.filter(checked_at__isnull=True).update(checked_at=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0002_batch_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cnpjdata',
+            name='checked_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='Última verificação na API', null=True),
+        ),
+        migrations.AddField(
+            model_name='cnpjdata',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 do último payload da API', max_length=64),
+        ),
+        migrations.RunPython(backfill_checked_at, migrations.RunPython.noop),
+    ]
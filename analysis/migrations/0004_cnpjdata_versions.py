@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0003_cnpjdata_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CNPJDataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('is_snapshot', models.BooleanField(default=False, help_text='True: data é o estado completo; False: diff')),
+                ('data', models.JSONField(default=dict, help_text="Estado completo ou campos alterados ({'set': ..., 'unset': ...})")),
+                ('changed_fields', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('cnpj_data', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='analysis.cnpjdata')),
+            ],
+            options={
+                'verbose_name': 'Versão dos Dados do CNPJ',
+                'verbose_name_plural': 'Versões dos Dados dos CNPJs',
+                'ordering': ['cnpj_data', 'version'],
+                'unique_together': {('cnpj_data', 'version')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CNPJDataChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=50)),
+                ('old_value', models.JSONField(blank=True, null=True)),
+                ('new_value', models.JSONField(blank=True, null=True)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('cnpj_data', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='analysis.cnpjdata')),
+                ('version', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='analysis.cnpjdataversion')),
+            ],
+            options={
+                'verbose_name': 'Alteração dos Dados do CNPJ',
+                'verbose_name_plural': 'Alterações dos Dados dos CNPJs',
+                'ordering': ['-changed_at'],
+                'indexes': [models.Index(fields=['changed_at'], name='analysis_cn_changed_49e817_idx'), models.Index(fields=['field', 'changed_at'], name='analysis_cn_field_ac85af_idx')],
+            },
+        ),
+    ]
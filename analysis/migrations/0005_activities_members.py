@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0004_cnpjdata_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Activity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(help_text='Código CNAE apenas com dígitos', max_length=7, unique=True)),
+                ('text', models.CharField(max_length=500)),
+            ],
+            options={
+                'verbose_name': 'Atividade (CNAE)',
+                'verbose_name_plural': 'Atividades (CNAE)',
+                'ordering': ['code'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Member',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, help_text='Nome em maiúsculas', max_length=255)),
+                ('tax_id', models.CharField(blank=True, db_index=True, default='', help_text='CPF mascarado (***999999**) ou CNPJ do sócio', max_length=20)),
+                ('person_type', models.CharField(blank=True, default='', max_length=20)),
+                ('role', models.CharField(blank=True, default='', max_length=100)),
+                ('is_administrator', models.BooleanField(default=False)),
+                ('since', models.DateField(blank=True, null=True)),
+                ('cnpj_data', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='analysis.cnpjdata')),
+            ],
+            options={
+                'verbose_name': 'Sócio',
+                'verbose_name_plural': 'Sócios',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CompanyActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_main', models.BooleanField(default=False)),
+                ('activity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='companies', to='analysis.activity')),
+                ('cnpj_data', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activities', to='analysis.cnpjdata')),
+            ],
+            options={
+                'verbose_name': 'Atividade da Empresa',
+                'verbose_name_plural': 'Atividades das Empresas',
+                'unique_together': {('cnpj_data', 'activity')},
+            },
+        ),
+    ]
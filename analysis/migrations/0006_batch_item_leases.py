@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0005_activities_members'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchitem',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='batchitem',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, help_text='Após este instante o item pode ser reservado de novo', null=True),
+        ),
+        migrations.AddField(
+            model_name='batchitem',
+            name='lease_token',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Identifica o bloco reservado por um worker', max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='batchitem',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pendente'), ('RUNNING', 'Em processamento'), ('SKIPPED', 'Reaproveitado'), ('DONE', 'Processado'), ('FAILED', 'Falhou')], default='PENDING', max_length=10),
+        ),
+    ]
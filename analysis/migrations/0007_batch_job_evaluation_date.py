@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0006_batch_item_leases'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchjob',
+            name='evaluation_date',
+            field=models.DateField(blank=True, help_text='Data de referência dos critérios, fixada na primeira execução', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0007_batch_job_evaluation_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchjob',
+            name='score_only',
+            field=models.BooleanField(default=False, help_text='Grava só score e aprovação dos critérios; explicação gerada sob demanda'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0009_webhooks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Cliente/sistema dono da chave', max_length=255)),
+                ('prefix', models.CharField(db_index=True, help_text='Início da chave, para identificação', max_length=8)),
+                ('key_hash', models.CharField(help_text='SHA-256 da chave (a chave não é armazenada)', max_length=64, unique=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('rate_limit_per_minute', models.IntegerField(blank=True, help_text='Requisições por minuto (vazio: API_KEY_RATE_LIMIT_PER_MINUTE)', null=True)),
+                ('monthly_quota', models.IntegerField(blank=True, help_text='Análises por mês (vazio: sem limite)', null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Chave de API',
+                'verbose_name_plural': 'Chaves de API',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ApiKeyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='Primeiro dia do mês')),
+                ('cached_requests', models.IntegerField(default=0, help_text='Análises reaproveitadas (sem consulta à API)')),
+                ('upstream_requests', models.IntegerField(default=0, help_text='Análises com consulta paga à API CNPJA')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('api_key', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='analysis.apikey')),
+            ],
+            options={
+                'verbose_name': 'Consumo da Chave de API',
+                'verbose_name_plural': 'Consumo das Chaves de API',
+                'ordering': ['-month', 'api_key'],
+                'unique_together': {('api_key', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:11
+
+from datetime import datetime, time, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+LOG_TABLE = 'analysis_analysislog'
+
+# Partições criadas além do mês corrente (depois, o comando prune_logs mantém a antecedência)
+PARTITIONS_AHEAD = 3
+
+
+def _next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _bound(month):
+    return timezone.make_aware(datetime.combine(month, time.min)).isoformat()
+
+
+def partition_analysis_log(apps, schema_editor):
+    """
+    PostgreSQL: recria a tabela de logs particionada por mês de timestamp
+
+    A chave primária passa a ser (id, timestamp), exigência do PostgreSQL para
+    tabelas particionadas; o id continua único (sequência/identity mantida).
+    Outros bancos mantêm a tabela simples (retenção por DELETE em blocos).
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+
+    quote = connection.ops.quote_name
+    old = f'{LOG_TABLE}_old'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = %s', [LOG_TABLE, 'p']
+        )
+        primary_key = cursor.fetchone()[0]
+        cursor.execute(
+            'SELECT indexname, indexdef FROM pg_indexes '
+            'WHERE schemaname = current_schema() AND tablename = %s AND indexname <> %s',
+            [LOG_TABLE, primary_key]
+        )
+        indexes = cursor.fetchall()
+
+        # Os índices secundários são recriados na tabela nova com os mesmos nomes
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX {quote(name)}')
+        cursor.execute(f'ALTER TABLE {LOG_TABLE} RENAME TO {old}')
+        cursor.execute(f'ALTER TABLE {old} RENAME CONSTRAINT {quote(primary_key)} TO {old}_pkey')
+
+        cursor.execute(
+            f'CREATE TABLE {LOG_TABLE} (LIKE {old} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING STORAGE) '
+            f'PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute(f'ALTER TABLE {LOG_TABLE} ADD CONSTRAINT {quote(primary_key)} PRIMARY KEY (id, "timestamp")')
+        for _, definition in indexes:
+            cursor.execute(definition)
+
+        cursor.execute(f'SELECT MIN("timestamp") FROM {old}')
+        oldest = cursor.fetchone()[0] or timezone.now()
+        month = timezone.localtime(oldest).date().replace(day=1)
+        last = timezone.localdate().replace(day=1)
+        for _ in range(PARTITIONS_AHEAD):
+            last = _next_month(last)
+        while month <= last:
+            cursor.execute(
+                f'CREATE TABLE {LOG_TABLE}_p{month:%Y%m} PARTITION OF {LOG_TABLE} '
+                f"FOR VALUES FROM ('{_bound(month)}') TO ('{_bound(_next_month(month))}')"
+            )
+            month = _next_month(month)
+        cursor.execute(f'CREATE TABLE {LOG_TABLE}_default PARTITION OF {LOG_TABLE} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {LOG_TABLE} SELECT * FROM {old}')
+
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [LOG_TABLE])
+        sequence = cursor.fetchone()[0]
+        if sequence is None:
+            # Coluna serial (não identity): a sequência antiga passa para a tabela nova
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [old])
+            cursor.execute(f'ALTER SEQUENCE {cursor.fetchone()[0]} OWNED BY {LOG_TABLE}.id')
+        else:
+            cursor.execute(
+                f'SELECT setval(%s, COALESCE((SELECT MAX(id) FROM {LOG_TABLE}), 0) + 1, false)', [sequence]
+            )
+        cursor.execute(f'DROP TABLE {old}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0010_api_keys'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='analysislog',
+            index=models.Index(fields=['timestamp', 'level'], name='analysis_an_timesta_bb8095_idx'),
+        ),
+        migrations.RunPython(partition_analysis_log, migrations.RunPython.noop),
+    ]
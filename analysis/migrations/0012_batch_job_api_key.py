@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0011_analysis_log_partitions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchjob',
+            name='api_key',
+            field=models.ForeignKey(blank=True, help_text='Chave que enviou o lote; o consumo de cada item é contado nela', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='batch_jobs', to='analysis.apikey'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0012_batch_job_api_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhooksubscription',
+            name='api_key',
+            field=models.ForeignKey(blank=True, help_text='Chave dona da assinatura (vazio: cadastrada pela equipe)', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='webhook_subscriptions', to='analysis.apikey'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analysis', '0013_webhook_subscription_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysiscriteria',
+            name='evaluated_at',
+            field=models.DateTimeField(blank=True, help_text='Quando o critério foi pontuado (vazio: data da análise)', null=True),
+        ),
+    ]
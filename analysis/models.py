@@ -13,6 +13,8 @@ class CNPJData(models.Model):
     main_activity = models.CharField(max_length=500)
     city = models.CharField(max_length=100)
     state = models.CharField(max_length=2)
+    content_hash = models.CharField(max_length=64, blank=True, default='', help_text="SHA-256 do último payload da API")
+    checked_at = models.DateTimeField(null=True, blank=True, db_index=True, help_text="Última verificação na API")
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -60,6 +62,8 @@ class AnalysisCriteria(models.Model):
     weight = models.FloatField(help_text="Peso do critério na análise geral")
     passed = models.BooleanField()
     details = models.JSONField(default=dict, help_text="Detalhes específicos do critério")
+    evaluated_at = models.DateTimeField(null=True, blank=True,
+                                        help_text="Quando o critério foi pontuado (vazio: data da análise)")
     
     class Meta:
         verbose_name = "Critério da Análise"
@@ -90,6 +94,300 @@ class AnalysisLog(models.Model):
         verbose_name = "Log de Análise"
         verbose_name_plural = "Logs de Análise"
         ordering = ['-timestamp']
+        # Ordenação e filtros do admin; no PostgreSQL a tabela é particionada por mês (ver retention.py)
+        indexes = [models.Index(fields=['timestamp', 'level'])]
     
     def __str__(self):
         return f"{self.level} - {self.cnpj} - {self.timestamp}"
+
+
+class BatchJob(models.Model):
+    """Modelo para lotes de CNPJs enviados por arquivo"""
+
+    STATUS_CHOICES = [
+        ('PENDING', 'Pendente'),
+        ('RUNNING', 'Em processamento'),
+        ('COMPLETED', 'Concluído'),
+        ('FAILED', 'Falhou'),
+    ]
+
+    file_name = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    total_items = models.IntegerField(default=0, help_text="CNPJs válidos e únicos do arquivo")
+    invalid_items = models.IntegerField(default=0, help_text="Linhas com CNPJ inválido")
+    duplicate_items = models.IntegerField(default=0, help_text="CNPJs repetidos no arquivo")
+    skipped_items = models.IntegerField(default=0, help_text="CNPJs com análise recente reaproveitada")
+    processed_items = models.IntegerField(default=0)
+    failed_items = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    evaluation_date = models.DateField(null=True, blank=True,
+                                       help_text="Data de referência dos critérios, fixada na primeira execução")
+    score_only = models.BooleanField(default=False,
+                                     help_text="Grava só score e aprovação dos critérios; explicação gerada sob demanda")
+    api_key = models.ForeignKey('ApiKey', on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='batch_jobs',
+                                help_text="Chave que enviou o lote; o consumo de cada item é contado nela")
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Lote de Análise"
+        verbose_name_plural = "Lotes de Análise"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Lote {self.id} - {self.file_name} - {self.status}"
+
+    @property
+    def progress(self) -> float:
+        """Percentual de itens finalizados (reaproveitados, processados ou com falha)"""
+        if not self.total_items:
+            return 100.0 if self.status == 'COMPLETED' else 0.0
+        done = self.skipped_items + self.processed_items + self.failed_items
+        return round(done * 100 / self.total_items, 2)
+
+
+class BatchItem(models.Model):
+    """Modelo para cada CNPJ de um lote"""
+
+    STATUS_CHOICES = [
+        ('PENDING', 'Pendente'),
+        ('RUNNING', 'Em processamento'),
+        ('SKIPPED', 'Reaproveitado'),
+        ('DONE', 'Processado'),
+        ('FAILED', 'Falhou'),
+    ]
+
+    job = models.ForeignKey(BatchJob, on_delete=models.CASCADE, related_name='items')
+    cnpj = models.CharField(max_length=14)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    analysis_result = models.ForeignKey(
+        AnalysisResult, on_delete=models.SET_NULL, null=True, blank=True, related_name='batch_items'
+    )
+    error = models.TextField(blank=True, default='')
+    lease_token = models.CharField(max_length=32, blank=True, default='', db_index=True,
+                                   help_text="Identifica o bloco reservado por um worker")
+    lease_expires_at = models.DateTimeField(null=True, blank=True,
+                                            help_text="Após este instante o item pode ser reservado de novo")
+    attempts = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Item do Lote"
+        verbose_name_plural = "Itens dos Lotes"
+        ordering = ['id']
+        unique_together = [('job', 'cnpj')]
+        indexes = [models.Index(fields=['job', 'status'])]
+
+    def __str__(self):
+        return f"{self.cnpj} - {self.status}"
+
+
+class CNPJDataVersion(models.Model):
+    """Modelo para histórico versionado dos dados do CNPJ (snapshot ou diff)"""
+
+    cnpj_data = models.ForeignKey(CNPJData, on_delete=models.CASCADE, related_name='versions')
+    version = models.PositiveIntegerField()
+    content_hash = models.CharField(max_length=64)
+    is_snapshot = models.BooleanField(default=False, help_text="True: data é o estado completo; False: diff")
+    data = models.JSONField(default=dict, help_text="Estado completo ou campos alterados ({'set': ..., 'unset': ...})")
+    changed_fields = models.JSONField(default=list)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Versão dos Dados do CNPJ"
+        verbose_name_plural = "Versões dos Dados dos CNPJs"
+        ordering = ['cnpj_data', 'version']
+        unique_together = [('cnpj_data', 'version')]
+
+    def __str__(self):
+        return f"{self.cnpj_data.cnpj} v{self.version}"
+
+
+class CNPJDataChange(models.Model):
+    """Índice de alterações por campo, para consultas por período"""
+
+    version = models.ForeignKey(CNPJDataVersion, on_delete=models.CASCADE, related_name='changes')
+    cnpj_data = models.ForeignKey(CNPJData, on_delete=models.CASCADE, related_name='changes')
+    field = models.CharField(max_length=50)
+    old_value = models.JSONField(null=True, blank=True)
+    new_value = models.JSONField(null=True, blank=True)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Alteração dos Dados do CNPJ"
+        verbose_name_plural = "Alterações dos Dados dos CNPJs"
+        ordering = ['-changed_at']
+        indexes = [
+            models.Index(fields=['changed_at']),
+            models.Index(fields=['field', 'changed_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.cnpj_data.cnpj} - {self.field} - {self.changed_at}"
+
+
+class Activity(models.Model):
+    """Modelo para atividades econômicas (CNAE)"""
+
+    code = models.CharField(max_length=7, unique=True, help_text="Código CNAE apenas com dígitos")
+    text = models.CharField(max_length=500)
+
+    class Meta:
+        verbose_name = "Atividade (CNAE)"
+        verbose_name_plural = "Atividades (CNAE)"
+        ordering = ['code']
+
+    def __str__(self):
+        return f"{self.code} - {self.text}"
+
+
+class CompanyActivity(models.Model):
+    """Modelo para atividades principal e secundárias de cada empresa"""
+
+    cnpj_data = models.ForeignKey(CNPJData, on_delete=models.CASCADE, related_name='activities')
+    activity = models.ForeignKey(Activity, on_delete=models.CASCADE, related_name='companies')
+    is_main = models.BooleanField(default=False)
+
+    class Meta:
+        verbose_name = "Atividade da Empresa"
+        verbose_name_plural = "Atividades das Empresas"
+        unique_together = [('cnpj_data', 'activity')]
+
+    def __str__(self):
+        return f"{self.cnpj_data.cnpj} - {self.activity.code}"
+
+
+class Member(models.Model):
+    """Modelo para o quadro societário de cada empresa"""
+
+    cnpj_data = models.ForeignKey(CNPJData, on_delete=models.CASCADE, related_name='members')
+    name = models.CharField(max_length=255, db_index=True, help_text="Nome em maiúsculas")
+    tax_id = models.CharField(max_length=20, db_index=True, blank=True, default='',
+                              help_text="CPF mascarado (***999999**) ou CNPJ do sócio")
+    person_type = models.CharField(max_length=20, blank=True, default='')
+    role = models.CharField(max_length=100, blank=True, default='')
+    is_administrator = models.BooleanField(default=False)
+    since = models.DateField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Sócio"
+        verbose_name_plural = "Sócios"
+        ordering = ['name']
+
+    def __str__(self):
+        return f"{self.name} - {self.cnpj_data.cnpj}"
+
+
+class WebhookSubscription(models.Model):
+    """Modelo para endpoints que recebem os eventos de análises concluídas"""
+
+    url = models.URLField(max_length=500)
+    secret = models.CharField(max_length=64, help_text="Chave HMAC-SHA256 das assinaturas")
+    description = models.CharField(max_length=255, blank=True, default='')
+    api_key = models.ForeignKey('ApiKey', on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='webhook_subscriptions',
+                                help_text="Chave dona da assinatura (vazio: cadastrada pela equipe)")
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Assinatura de Webhook"
+        verbose_name_plural = "Assinaturas de Webhook"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.url} ({'ativa' if self.is_active else 'inativa'})"
+
+
+class WebhookEvent(models.Model):
+    """Outbox de webhooks: gravado na transação da análise, entregue pelo dispatcher"""
+
+    STATUS_CHOICES = [
+        ('PENDING', 'Pendente'),
+        ('SENDING', 'Em envio'),
+        ('DELIVERED', 'Entregue'),
+        ('FAILED', 'Falhou'),
+    ]
+
+    subscription = models.ForeignKey(WebhookSubscription, on_delete=models.CASCADE, related_name='events')
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, help_text="Entregue a partir deste instante")
+    lease_token = models.CharField(max_length=32, blank=True, default='', db_index=True,
+                                   help_text="Identifica o bloco reservado por um dispatcher")
+    lease_expires_at = models.DateTimeField(null=True, blank=True,
+                                            help_text="Após este instante o evento pode ser reservado de novo")
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Evento de Webhook"
+        verbose_name_plural = "Eventos de Webhook"
+        ordering = ['id']
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.event_type} #{self.id} - {self.status}"
+
+
+class ApiKey(models.Model):
+    """Modelo para chaves de acesso à API (uma ou mais por cliente)"""
+
+    name = models.CharField(max_length=255, help_text="Cliente/sistema dono da chave")
+    prefix = models.CharField(max_length=8, db_index=True, help_text="Início da chave, para identificação")
+    key_hash = models.CharField(max_length=64, unique=True, help_text="SHA-256 da chave (a chave não é armazenada)")
+    is_active = models.BooleanField(default=True)
+    rate_limit_per_minute = models.IntegerField(null=True, blank=True,
+                                                help_text="Requisições por minuto (vazio: API_KEY_RATE_LIMIT_PER_MINUTE)")
+    monthly_quota = models.IntegerField(null=True, blank=True, help_text="Análises por mês (vazio: sem limite)")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Chave de API"
+        verbose_name_plural = "Chaves de API"
+        ordering = ['name']
+
+    def __str__(self):
+        return f"{self.name} ({self.prefix}...)"
+
+
+class ApiKeyUsage(models.Model):
+    """Consumo mensal por chave: análises servidas do banco x consultas à API CNPJA"""
+
+    api_key = models.ForeignKey(ApiKey, on_delete=models.CASCADE, related_name='usage')
+    month = models.DateField(help_text="Primeiro dia do mês")
+    cached_requests = models.IntegerField(default=0, help_text="Análises reaproveitadas (sem consulta à API)")
+    upstream_requests = models.IntegerField(default=0, help_text="Análises com consulta paga à API CNPJA")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Consumo da Chave de API"
+        verbose_name_plural = "Consumo das Chaves de API"
+        ordering = ['-month', 'api_key']
+        unique_together = [('api_key', 'month')]
+
+    def __str__(self):
+        return f"{self.api_key} - {self.month:%Y-%m}"
+
+    @property
+    def total_requests(self) -> int:
+        return self.cached_requests + self.upstream_requests
+
+
+class CacheGeneration(models.Model):
+    """Contadores de geração compartilhados entre processos (ver caching.py)"""
+
+    name = models.CharField(max_length=64, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Geração de Cache"
+        verbose_name_plural = "Gerações de Cache"
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
@@ -0,0 +1,175 @@
+"""
+Representação compacta dos dados de uma empresa retornados pela API CNPJA
+
+ParsedCompany usa __slots__ e não guarda referência ao payload bruto: depois
+do parse, o JSON original pode ser coletado. Só os grupos de campos pedidos
+são decodificados (os critérios ativos declaram o que usam) e as formas
+normalizadas (minúsculas/maiúsculas) são calculadas uma única vez. Textos de
+baixa cardinalidade (status, cargos, CNAE, cidades) são compartilhados entre
+empresas via sys.intern. A data de fundação é convertida uma única vez em
+ordinal (date.toordinal) para que critérios comparem apenas inteiros.
+"""
+
+import sys
+from datetime import date
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, NamedTuple, Optional, Tuple
+
+
+class MemberInfo(NamedTuple):
+    """Sócio do quadro societário"""
+    name: str
+    tax_id: str
+    person_type: str
+    role: str
+    since: str
+    is_administrator: bool
+
+
+class ActivityInfo(NamedTuple):
+    """Atividade (CNAE) secundária"""
+    id: Optional[str]
+    text: str
+    text_lower: str
+
+
+ALL_FIELDS: FrozenSet[str] = frozenset({
+    'company_name', 'status', 'founded_date', 'equity', 'main_activity', 'location', 'address',
+    'contacts', 'side_activities', 'members', 'nature', 'size'
+})
+
+
+def _text(value) -> str:
+    return value if isinstance(value, str) else ''
+
+
+def _shared(value) -> str:
+    """Compartilha strings de baixa cardinalidade (status, UF, cargos, textos de CNAE)"""
+    return sys.intern(value) if isinstance(value, str) else ''
+
+
+@lru_cache(maxsize=8192)
+def _lower(text: str) -> str:
+    return sys.intern(text.lower())
+
+
+class ParsedCompany:
+    """
+    Dados relevantes de uma empresa, decodificados seletivamente
+
+    Campos fora de `fields` mantêm o valor vazio padrão; `decoded` informa
+    quais grupos foram de fato lidos do payload.
+    """
+
+    __slots__ = (
+        'cnpj', 'decoded', 'company_name', 'status', 'status_lower', 'founded_date', 'founded_ordinal', 'equity',
+        'main_activity', 'main_activity_lower', 'main_activity_id', 'city', 'city_lower', 'state',
+        'state_upper', 'zip_code', 'district', 'street', 'number', 'phones', 'emails',
+        'side_activities', 'members', 'nature', 'size'
+    )
+
+    def __init__(self, cnpj: str = ''):
+        self.cnpj = cnpj
+        self.decoded: FrozenSet[str] = frozenset()
+        self.company_name = ''
+        self.status = self.status_lower = ''
+        self.founded_date = ''
+        self.founded_ordinal = 0  # 0 = ausente ou inválida
+        self.equity = None
+        self.main_activity = self.main_activity_lower = ''
+        self.main_activity_id = None
+        self.city = self.city_lower = ''
+        self.state = self.state_upper = ''
+        self.zip_code = self.district = self.street = self.number = ''
+        self.phones: Tuple = ()
+        self.emails: Tuple = ()
+        self.side_activities: Tuple[ActivityInfo, ...] = ()
+        self.members: Tuple[MemberInfo, ...] = ()
+        self.nature = ''
+        self.size = ''
+
+    def __repr__(self):
+        return f'ParsedCompany(cnpj={self.cnpj!r}, decoded={sorted(self.decoded)})'
+
+    @classmethod
+    def from_payload(cls, raw_data: Dict, fields: Optional[Iterable[str]] = None) -> 'ParsedCompany':
+        """
+        Decodifica o payload da API
+
+        Args:
+            raw_data: Resposta da API CNPJA
+            fields: Grupos de campos a decodificar (padrão: todos, ver ALL_FIELDS)
+        """
+        fields = ALL_FIELDS if fields is None else ALL_FIELDS.intersection(fields)
+        company = raw_data.get('company') or {}
+        parsed = cls(_text(raw_data.get('taxId')))
+        parsed.decoded = frozenset(fields)
+
+        if 'company_name' in fields:
+            parsed.company_name = _text(company.get('name'))
+        if 'status' in fields:
+            parsed.status = _shared((raw_data.get('status') or {}).get('text'))
+            parsed.status_lower = _lower(parsed.status)
+        if 'founded_date' in fields:
+            parsed.founded_date = _text(raw_data.get('founded'))
+            parsed.founded_ordinal = _ordinal(parsed.founded_date)
+        if 'equity' in fields:
+            parsed.equity = company.get('equity')
+        if 'main_activity' in fields:
+            main_activity = raw_data.get('mainActivity') or {}
+            parsed.main_activity = _shared(main_activity.get('text'))
+            parsed.main_activity_lower = _lower(parsed.main_activity)
+            parsed.main_activity_id = main_activity.get('id')
+        if 'location' in fields or 'address' in fields:
+            address = raw_data.get('address') or {}
+            if 'location' in fields:
+                parsed.city = _shared(address.get('city'))
+                parsed.city_lower = _lower(parsed.city)
+                parsed.state = _shared(address.get('state'))
+                parsed.state_upper = sys.intern(parsed.state.upper())
+                parsed.zip_code = _text(address.get('zip'))
+            if 'address' in fields:
+                parsed.district = _text(address.get('district'))
+                parsed.street = _text(address.get('street'))
+                parsed.number = _text(address.get('number'))
+        if 'contacts' in fields:
+            parsed.phones = tuple(raw_data.get('phones') or ())
+            parsed.emails = tuple(raw_data.get('emails') or ())
+        if 'side_activities' in fields:
+            parsed.side_activities = tuple(_activity(a) for a in raw_data.get('sideActivities') or ())
+        if 'members' in fields:
+            parsed.members = tuple(_member(m) for m in company.get('members') or ())
+        if 'nature' in fields:
+            parsed.nature = _shared((company.get('nature') or {}).get('text'))
+        if 'size' in fields:
+            parsed.size = _shared((company.get('size') or {}).get('acronym'))
+
+        return parsed
+
+
+def _ordinal(value: str) -> int:
+    """Data AAAA-MM-DD como date.toordinal(); 0 se vazia ou inválida"""
+    if not value:
+        return 0
+    try:
+        return date.fromisoformat(value).toordinal()
+    except ValueError:
+        return 0
+
+
+def _member(raw: Dict) -> MemberInfo:
+    person = raw.get('person') or {}
+    role = _shared((raw.get('role') or {}).get('text'))
+    return MemberInfo(
+        name=_text(person.get('name')),
+        tax_id=_text(person.get('taxId')),
+        person_type=_shared(person.get('type')),
+        role=role,
+        since=_shared(raw.get('since')),
+        is_administrator='administrador' in _lower(role)
+    )
+
+
+def _activity(raw: Dict) -> ActivityInfo:
+    text = _shared(raw.get('text'))
+    return ActivityInfo(sys.intern(str(raw['id'])) if raw.get('id') else None, text, _lower(text))
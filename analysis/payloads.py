@@ -0,0 +1,97 @@
+"""
+Decodificação seletiva das respostas da API CNPJA
+
+O corpo da resposta é decodificado (com orjson, se instalado) e imediatamente
+projetado para as chaves que ParsedCompany lê; inscrições estaduais, SUFRAMA,
+metadados e demais blocos são descartados antes de o payload seguir adiante.
+Listas de sócios e atividades secundárias podem ser limitadas.
+"""
+
+import json
+from typing import Dict, Iterable, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson é opcional
+    orjson = None
+
+from .parsed import ALL_FIELDS
+
+# Chaves do payload lidas por grupo de campos do ParsedCompany.
+# Um dict indica subchaves; uma lista de um elemento indica lista de objetos.
+FIELD_PROJECTIONS = {
+    'company_name': {'company': {'name': True}},
+    'status': {'status': {'text': True}},
+    'founded_date': {'founded': True},
+    'equity': {'company': {'equity': True}},
+    'main_activity': {'mainActivity': {'id': True, 'text': True}},
+    'location': {'address': {'city': True, 'state': True, 'zip': True}},
+    'address': {'address': {'district': True, 'street': True, 'number': True}},
+    'contacts': {'phones': True, 'emails': True},
+    'side_activities': {'sideActivities': [{'id': True, 'text': True}]},
+    'members': {'company': {'members': [{
+        'since': True,
+        'person': {'name': True, 'taxId': True, 'type': True},
+        'role': {'text': True}
+    }]}},
+    'nature': {'company': {'nature': {'text': True}}},
+    'size': {'company': {'size': {'acronym': True}}},
+}
+
+
+def _merge(target: Dict, spec: Dict) -> Dict:
+    for key, value in spec.items():
+        current = target.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            _merge(current, value)
+        elif isinstance(value, list) and isinstance(current, list):
+            _merge(current[0], value[0])
+        elif isinstance(value, dict):
+            target[key] = _merge({}, value)
+        elif isinstance(value, list):
+            target[key] = [_merge({}, value[0])]
+        else:
+            target[key] = value
+    return target
+
+
+def build_projection(fields: Optional[Iterable[str]] = None) -> Dict:
+    """Projeção (árvore de chaves) para os grupos de campos pedidos"""
+    fields = ALL_FIELDS if fields is None else ALL_FIELDS.intersection(fields)
+    projection = {'taxId': True}
+    for field in sorted(fields):
+        _merge(projection, FIELD_PROJECTIONS[field])
+    return projection
+
+
+def project(value, spec, max_items: Optional[int] = None):
+    """Mantém só as chaves da projeção; listas de objetos são cortadas em max_items"""
+    if spec is True:
+        return value
+    if isinstance(spec, list):
+        if not isinstance(value, list):
+            return []
+        items = value[:max_items] if max_items else value
+        return [project(item, spec[0], max_items) for item in items]
+    if not isinstance(value, dict):
+        return None
+    return {key: project(value[key], sub, max_items) for key, sub in spec.items() if key in value}
+
+
+def loads(body: bytes):
+    """Decodifica JSON com orjson quando disponível"""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def decode_payload(body: bytes, projection: Optional[Dict] = None, max_items: Optional[int] = None) -> Dict:
+    """
+    Decodifica a resposta da API e descarta o que não será usado
+
+    Args:
+        body: Corpo bruto da resposta
+        projection: Resultado de build_projection (padrão: todos os campos)
+        max_items: Limite de sócios/atividades secundárias mantidos (None = sem limite)
+    """
+    return project(loads(body), projection or build_projection(), max_items)
@@ -0,0 +1,355 @@
+"""
+Pipeline em estágios para analisar muitos CNPJs
+
+    entrada ──► busca (threads, limitada pela cota da API)
+            ──► pontuação (pool de processos: parse + critérios puros)
+            ──► gravação (thread chamadora, transações em lote)
+
+Os estágios são ligados por filas limitadas: se a gravação atrasa, a
+pontuação e a busca param de consumir (backpressure) em vez de acumular
+payloads em memória. Toda escrita no banco acontece na thread que chamou
+run(), em uma transação por lote de resultados.
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger('analysis')
+
+_DONE = object()
+
+# Engine de cada processo do pool de pontuação (criado na primeira tarefa)
+_worker_engine = None
+
+
+def score_in_worker(raw_data: Dict, evaluation_date: date, explain: bool = True):
+    """Tarefa do pool de processos: não acessa o banco"""
+    global _worker_engine
+    if _worker_engine is None:
+        from .engines import CNPJAnalysisEngine
+        _worker_engine = CNPJAnalysisEngine()
+    _worker_engine.explain = explain
+    return _worker_engine.score_payload(raw_data, evaluation_date)
+
+
+def _init_worker(settings_module: str = ''):
+    # Processo novo (spawn): sobe com o perfil enxuto, se configurado
+    if settings_module:
+        os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+    import django
+    django.setup()
+
+
+class RateLimiter:
+    """Espaça chamadas entre threads para respeitar N requisições por minuto"""
+
+    def __init__(self, per_minute: Optional[int], sleep: Callable[[float], None] = time.sleep):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            self.sleep(delay)
+
+
+class StageStats:
+    """Contadores de um estágio (seguros entre threads)"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.items = 0
+        self.failed = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, items: int = 1, failed: int = 0, batches: int = 0):
+        with self._lock:
+            self.items += items
+            self.failed += failed
+            self.batches += batches
+            self.busy_seconds += seconds
+
+    def as_dict(self, wall_seconds: float) -> Dict:
+        data = {
+            'workers': self.workers,
+            'items': self.items,
+            'failed': self.failed,
+            'busy_seconds': round(self.busy_seconds, 4),
+            'items_per_second': round(self.items / wall_seconds, 2) if wall_seconds else 0.0,
+            'utilization': round(self.busy_seconds / (wall_seconds * self.workers), 3) if wall_seconds else 0.0
+        }
+        if self.batches:
+            data['batches'] = self.batches
+        return data
+
+
+class _Failure:
+    __slots__ = ('cnpj', 'error')
+
+    def __init__(self, cnpj: str, error: str):
+        self.cnpj = cnpj
+        self.error = error
+
+
+class AnalysisPipeline:
+    """
+    Executa busca, pontuação e gravação em paralelo, com concorrência por estágio
+
+    Uso:
+        with AnalysisPipeline(engine) as pipeline:
+            pipeline.run(cnpjs, on_batch=callback)
+
+    on_batch recebe [(cnpj, resultado)] de cada lote gravado, dentro da mesma
+    transação; resultado tem o formato de CNPJAnalysisEngine.analyze_cnpj.
+    """
+
+    def __init__(self, engine=None, fetch_workers: Optional[int] = None, score_workers: Optional[int] = None,
+                 score_in_processes: Optional[bool] = None, queue_size: Optional[int] = None,
+                 write_batch_size: Optional[int] = None, rate_per_minute: Optional[int] = None,
+                 flush_interval: float = 1.0):
+        from .engines import CNPJAnalysisEngine
+
+        self.engine = engine or CNPJAnalysisEngine()
+        self.fetch_workers = fetch_workers or settings.PIPELINE_FETCH_WORKERS
+        self.score_workers = score_workers or settings.PIPELINE_SCORE_WORKERS or os.cpu_count() or 1
+        self.score_in_processes = (
+            settings.PIPELINE_SCORE_PROCESSES if score_in_processes is None else score_in_processes
+        )
+        self.queue_size = queue_size or settings.PIPELINE_QUEUE_SIZE
+        self.write_batch_size = write_batch_size or settings.PIPELINE_WRITE_BATCH_SIZE
+        self.limiter = RateLimiter(
+            settings.CNPJA_RATE_LIMIT_PER_MINUTE if rate_per_minute is None else rate_per_minute
+        )
+        self.flush_interval = flush_interval
+        self._pool = None
+        self.stats: Dict[str, Dict] = {}
+
+    def __enter__(self):
+        if self.score_in_processes and self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.score_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(settings.PIPELINE_WORKER_SETTINGS,)
+            )
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def run(self, cnpjs: Iterable[str], on_batch: Optional[Callable[[List[Tuple[str, Dict]]], None]] = None,
+            evaluation_date: Optional[date] = None) -> Dict:
+        """
+        Analisa os CNPJs (sempre consulta a API; a seleção do que precisa de
+        análise é de quem chama) e retorna as estatísticas por estágio
+
+        Todos os itens são pontuados na mesma data de referência
+        (evaluation_date; padrão: a do engine ou hoje, fixada no início).
+        """
+        self.evaluation_date = evaluation_date or self.engine.evaluation_date or timezone.localdate()
+        owns_pool = self.score_in_processes and self._pool is None
+        if owns_pool:
+            self.__enter__()
+
+        self._abort = threading.Event()
+        self._fetch_queue = queue.Queue(self.queue_size)
+        self._score_queue = queue.Queue(self.queue_size)
+        self._write_queue = queue.Queue(self.queue_size)
+        self._stats = {
+            'fetch': StageStats(self.fetch_workers),
+            'score': StageStats(self.score_workers),
+            'write': StageStats(1),
+        }
+
+        fetchers = [
+            threading.Thread(target=self._fetch_stage, name=f'pipeline-fetch-{i}', daemon=True)
+            for i in range(self.fetch_workers)
+        ]
+        scorers = [
+            threading.Thread(target=self._score_stage, name=f'pipeline-score-{i}', daemon=True)
+            for i in range(self.score_workers)
+        ]
+        feeder = threading.Thread(
+            target=self._feed, args=(list(cnpjs), fetchers, scorers), name='pipeline-feed', daemon=True
+        )
+
+        start = time.perf_counter()
+        for thread in fetchers + scorers + [feeder]:
+            thread.start()
+        try:
+            self._write_stage(on_batch)
+        except BaseException:
+            self._abort.set()
+            raise
+        finally:
+            feeder.join()
+            if owns_pool:
+                self.close()
+
+        wall = time.perf_counter() - start
+        self.stats = {name: stage.as_dict(wall) for name, stage in self._stats.items()}
+        self.stats['wall_seconds'] = round(wall, 4)
+        if not self.score_in_processes:
+            # Com pool, cada processo tem o seu memo e as estatísticas ficam lá
+            self.stats['criteria_memo'] = self.engine.criteria_memo.stats()
+        logger.info(f"Pipeline concluído: {self.stats}")
+        return self.stats
+
+    def _put(self, target: queue.Queue, item) -> bool:
+        """put bloqueante que desiste se a execução foi abortada"""
+        while not self._abort.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source: queue.Queue):
+        """get bloqueante que devolve _DONE se a execução foi abortada"""
+        while not self._abort.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _feed(self, cnpjs: List[str], fetchers, scorers):
+        """Alimenta a busca e encerra os estágios em ordem"""
+        try:
+            for cnpj in cnpjs:
+                if not self._put(self._fetch_queue, cnpj):
+                    return
+            for _ in fetchers:
+                self._put(self._fetch_queue, _DONE)
+            for thread in fetchers:
+                thread.join()
+            for _ in scorers:
+                self._put(self._score_queue, _DONE)
+            for thread in scorers:
+                thread.join()
+        finally:
+            self._put(self._write_queue, _DONE)
+
+    def _fetch_stage(self):
+        try:
+            while True:
+                cnpj = self._get(self._fetch_queue)
+                if cnpj is _DONE:
+                    return
+
+                self.limiter.wait()
+                started = time.perf_counter()
+                start_time = datetime.now()
+                try:
+                    raw_data = self.engine.cnpja_service.get_cnpj_data(cnpj)
+                except Exception as e:
+                    logger.error(f"Erro ao buscar CNPJ {cnpj} no pipeline: {str(e)}")
+                    raw_data = None
+                self._stats['fetch'].record(time.perf_counter() - started, failed=int(raw_data is None))
+
+                if raw_data is None:
+                    self._put(self._write_queue, _Failure(cnpj, 'Erro ao obter dados da API'))
+                else:
+                    self._put(self._score_queue, (cnpj, start_time, raw_data))
+        finally:
+            # get_cnpj_data grava AnalysisLog pela conexão desta thread
+            connection.close()
+
+    def _score_stage(self):
+        while True:
+            item = self._get(self._score_queue)
+            if item is _DONE:
+                return
+
+            cnpj, start_time, raw_data = item
+            started = time.perf_counter()
+            try:
+                if self._pool is not None:
+                    scored = self._pool.submit(
+                        score_in_worker, raw_data, self.evaluation_date, self.engine.explain
+                    ).result()
+                else:
+                    scored = self.engine.score_payload(raw_data, self.evaluation_date)
+            except Exception as e:
+                logger.error(f"Erro ao pontuar CNPJ {cnpj} no pipeline: {str(e)}")
+                self._stats['score'].record(time.perf_counter() - started, failed=1)
+                self._put(self._write_queue, _Failure(cnpj, f'Erro interno: {str(e)}'))
+                continue
+
+            self._stats['score'].record(time.perf_counter() - started)
+            self._put(self._write_queue, (cnpj, start_time, scored))
+
+    def _write_stage(self, on_batch):
+        batch = []
+        while True:
+            try:
+                item = self._write_queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if batch:
+                    self._flush(batch, on_batch)
+                    batch = []
+                continue
+
+            if item is _DONE:
+                break
+            batch.append(item)
+            if len(batch) >= self.write_batch_size:
+                self._flush(batch, on_batch)
+                batch = []
+
+        if batch:
+            self._flush(batch, on_batch)
+
+    def _flush(self, batch: List, on_batch):
+        """Grava um lote de resultados em uma única transação"""
+        started = time.perf_counter()
+        results = []
+        failed = 0
+
+        with transaction.atomic():
+            for item in batch:
+                if isinstance(item, _Failure):
+                    results.append((item.cnpj, {'success': False, 'error': item.error}))
+                    failed += 1
+                    continue
+
+                cnpj, start_time, (parsed_data, content_hash, analysis_results) = item
+                try:
+                    with transaction.atomic():
+                        result = self.engine.persist_scored(parsed_data, content_hash, analysis_results, start_time)
+                except Exception as e:
+                    logger.error(f"Erro ao gravar CNPJ {cnpj} no pipeline: {str(e)}")
+                    result = {'success': False, 'error': f'Erro interno: {str(e)}'}
+                    failed += 1
+                results.append((cnpj, result))
+
+            if on_batch is not None:
+                on_batch(results)
+
+        self._stats['write'].record(time.perf_counter() - started, items=len(batch), failed=failed, batches=1)
@@ -0,0 +1,116 @@
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .freshness import FreshnessPolicy
+from .models import CNPJData
+
+logger = logging.getLogger('analysis')
+
+
+class PortfolioRefresher:
+    """
+    Reverifica periodicamente as empresas armazenadas
+
+    Seleciona os CNPJs vencidos pela política de reaproveitamento, do mais
+    antigo para o mais recente (checked_at), e espaça as consultas para
+    respeitar o orçamento de requisições por minuto da API.
+
+    A carteira é percorrida por cursor (checked_at, id) e só considera CNPJs
+    verificados antes do início da execução: cada bloco é uma consulta de
+    tamanho fixo pelo índice, e os CNPJs já tentados (inclusive os que
+    falharam e mantêm o checked_at antigo) não voltam na mesma execução.
+    """
+
+    def __init__(self, engine=None, rate_per_minute: Optional[int] = None, batch_size: int = 100,
+                 sleep: Callable[[float], None] = time.sleep):
+        from .engines import CNPJAnalysisEngine
+
+        self.engine = engine or CNPJAnalysisEngine()
+        self.policy = FreshnessPolicy.from_settings()
+        self.rate_per_minute = rate_per_minute or settings.CNPJA_RATE_LIMIT_PER_MINUTE
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.stats = {'checked': 0, 'changed': 0, 'unchanged': 0, 'failed': 0}
+
+    def due_queryset(self, include_fresh: bool = False):
+        """CNPJs a reverificar, dos mais antigos para os mais recentes"""
+        queryset = CNPJData.objects.all()
+        if not include_fresh:
+            queryset = queryset.exclude(
+                self.policy.fresh_q(status_field='status', date_field='checked_at')
+            )
+        return queryset.order_by(F('checked_at').asc(nulls_first=True), 'id')
+
+    def next_batch(self, started_at: datetime, after: Optional[Tuple[Optional[datetime], int]] = None,
+                   include_fresh: bool = False) -> List[Tuple[int, str, Optional[datetime]]]:
+        """
+        Próximo bloco de (id, cnpj, checked_at) depois do cursor
+
+        Args:
+            started_at: Início da execução; CNPJs verificados depois dele ficam de fora
+            after: (checked_at, id) do último CNPJ do bloco anterior
+        """
+        queryset = self.due_queryset(include_fresh).filter(
+            Q(checked_at__isnull=True) | Q(checked_at__lt=started_at)
+        )
+        if after is not None:
+            checked_at, last_id = after
+            if checked_at is None:
+                queryset = queryset.filter(Q(checked_at__isnull=True, id__gt=last_id) | Q(checked_at__isnull=False))
+            else:
+                queryset = queryset.filter(Q(checked_at__gt=checked_at) | Q(checked_at=checked_at, id__gt=last_id))
+        return list(queryset.values_list('id', 'cnpj', 'checked_at')[:self.batch_size])
+
+    def run(self, limit: Optional[int] = None, include_fresh: bool = False) -> Dict:
+        """
+        Executa a atualização até esgotar os vencidos ou atingir o limite
+
+        Args:
+            limit: Número máximo de CNPJs consultados nesta execução
+            include_fresh: Também reverifica CNPJs ainda dentro do prazo
+
+        Returns:
+            Dict com contadores da execução
+        """
+        interval = 60.0 / self.rate_per_minute
+        started_at = timezone.now()
+        cursor = None
+        last_request = None
+
+        while limit is None or self.stats['checked'] < limit:
+            batch = self.next_batch(started_at, cursor, include_fresh)
+            if not batch:
+                break
+
+            for cnpj_id, cnpj, checked_at in batch:
+                if limit is not None and self.stats['checked'] >= limit:
+                    break
+
+                if last_request is not None:
+                    wait = interval - (time.monotonic() - last_request)
+                    if wait > 0:
+                        self.sleep(wait)
+                last_request = time.monotonic()
+
+                cursor = (checked_at, cnpj_id)
+                self._refresh(cnpj)
+
+        logger.info(f"Atualização de carteira concluída: {self.stats}")
+        return self.stats
+
+    def _refresh(self, cnpj: str):
+        result = self.engine.refresh_cnpj(cnpj)
+        self.stats['checked'] += 1
+
+        if not result['success']:
+            self.stats['failed'] += 1
+        elif result['changed']:
+            self.stats['changed'] += 1
+        else:
+            self.stats['unchanged'] += 1
@@ -0,0 +1,224 @@
+"""
+Retenção do AnalysisLog: partições mensais, arquivo NDJSON.gz e descarte em bloco
+
+No PostgreSQL a tabela é particionada por mês de timestamp (migração 0011):
+descartar um mês é DETACH + DROP da partição, sem varrer nem reescrever
+linhas. As partições dos próximos meses são criadas com antecedência
+(LOG_PARTITIONS_AHEAD); linhas fora delas caem na partição padrão.
+
+Nos demais bancos (SQLite) não há partições: o mês é apagado em blocos de
+ids consecutivos, cada um em um único DELETE pela chave primária, em
+transações curtas que não prendem os outros escritores.
+
+Antes do descarte cada mês pode ser arquivado em
+<LOG_ARCHIVE_DIR>/analysis_log_AAAAMM.ndjson.gz. Só meses inteiros mais
+antigos que o prazo de retenção são descartados.
+"""
+
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import AnalysisLog
+
+logger = logging.getLogger('analysis')
+
+LOG_TABLE = AnalysisLog._meta.db_table
+
+ARCHIVE_CHUNK_SIZE = 2000
+DELETE_CHUNK_SIZE = 10000
+
+ARCHIVE_FIELDS = ('id', 'cnpj', 'level', 'message', 'details', 'timestamp')
+
+
+def month_of(moment: datetime) -> date:
+    """Primeiro dia do mês (no fuso do projeto) de um instante"""
+    return timezone.localtime(moment).date().replace(day=1)
+
+
+def next_month(month: date) -> date:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def month_bounds(month: date) -> Tuple[datetime, datetime]:
+    """[início, fim) do mês como instantes com fuso"""
+    return (
+        timezone.make_aware(datetime.combine(month, time.min)),
+        timezone.make_aware(datetime.combine(next_month(month), time.min))
+    )
+
+
+def partition_name(month: date) -> str:
+    return f'{LOG_TABLE}_p{month:%Y%m}'
+
+
+def _connection():
+    return connections[router.db_for_write(AnalysisLog)]
+
+
+def is_partitioned() -> bool:
+    """True se a tabela do AnalysisLog é particionada (PostgreSQL após a migração 0011)"""
+    connection = _connection()
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid '
+            'WHERE c.relname = %s AND pg_table_is_visible(c.oid)',
+            [LOG_TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def partition_months() -> List[date]:
+    """Meses com partição própria (vazio se a tabela não é particionada)"""
+    if not is_partitioned():
+        return []
+    pattern = re.compile(rf'^{LOG_TABLE}_p(\d{{4}})(\d{{2}})$')
+    with _connection().cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s AND pg_table_is_visible(p.oid)',
+            [LOG_TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    return sorted(
+        date(int(match.group(1)), int(match.group(2)), 1)
+        for match in map(pattern.match, names) if match
+    )
+
+
+def ensure_partitions(months_ahead: Optional[int] = None, start: Optional[date] = None) -> List[str]:
+    """Cria as partições do mês corrente (ou de start) até N meses à frente; retorna as criadas"""
+    if not is_partitioned():
+        return []
+    months_ahead = settings.LOG_PARTITIONS_AHEAD if months_ahead is None else months_ahead
+    month = start or month_of(timezone.now())
+    existing = set(partition_months())
+    connection = _connection()
+
+    created = []
+    for _ in range(months_ahead + 1):
+        if month not in existing:
+            lower, upper = month_bounds(month)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS {connection.ops.quote_name(partition_name(month))} '
+                    f'PARTITION OF {connection.ops.quote_name(LOG_TABLE)} '
+                    f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+                )
+            created.append(partition_name(month))
+        month = next_month(month)
+    return created
+
+
+def expired_months(before: date) -> List[date]:
+    """Meses anteriores a `before` com logs (ou com partição, mesmo vazia)"""
+    months = {month for month in partition_months() if month < before}
+    # Um MIN(timestamp) pelo índice para cada mês com logs; meses vazios são pulados
+    remaining = AnalysisLog.objects.filter(timestamp__lt=month_bounds(before)[0])
+    while True:
+        oldest = remaining.aggregate(oldest=Min('timestamp'))['oldest']
+        if oldest is None:
+            return sorted(months)
+        month = month_of(oldest)
+        months.add(month)
+        remaining = remaining.filter(timestamp__gte=month_bounds(month)[1])
+
+
+def month_logs(month: date):
+    lower, upper = month_bounds(month)
+    return AnalysisLog.objects.filter(timestamp__gte=lower, timestamp__lt=upper)
+
+
+def archive_month(month: date, directory: Path) -> Tuple[Path, int]:
+    """
+    Grava os logs do mês em NDJSON comprimido (em streaming) e retorna (arquivo, linhas)
+
+    O arquivo é escrito com outro nome e renomeado ao final: um arquivo com o
+    nome definitivo está sempre completo.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'analysis_log_{month:%Y%m}.ndjson.gz'
+    partial = path.with_name(path.name + '.tmp')
+
+    rows = 0
+    queryset = month_logs(month).order_by('id').values(*ARCHIVE_FIELDS)
+    with gzip.open(partial, 'wt', encoding='utf-8') as output:
+        for row in queryset.iterator(chunk_size=ARCHIVE_CHUNK_SIZE):
+            output.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+            rows += 1
+    os.replace(partial, path)
+    return path, rows
+
+
+def _delete_range(queryset) -> int:
+    """Apaga em blocos de ids consecutivos (DELETE ... WHERE id >= a AND id < b)"""
+    bounds = queryset.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return 0
+
+    deleted = 0
+    for low in range(bounds['low'], bounds['high'] + 1, DELETE_CHUNK_SIZE):
+        with transaction.atomic(using=queryset.db):
+            # Sem sinais nem cascatas: o Django executa um único DELETE, sem carregar as linhas
+            count, _ = queryset.filter(id__gte=low, id__lt=low + DELETE_CHUNK_SIZE).delete()
+        deleted += count
+    return deleted
+
+
+def drop_month(month: date) -> Dict:
+    """Descarta os logs do mês: DROP da partição (PostgreSQL) ou DELETE em blocos"""
+    result = {'partition_dropped': False, 'deleted_rows': 0}
+    if month in partition_months():
+        connection = _connection()
+        name = connection.ops.quote_name(partition_name(month))
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {connection.ops.quote_name(LOG_TABLE)} DETACH PARTITION {name}')
+            cursor.execute(f'DROP TABLE {name}')
+        result['partition_dropped'] = True
+
+    # Restos do mês na partição padrão (ou a tabela inteira, sem partições)
+    result['deleted_rows'] = _delete_range(month_logs(month))
+    return result
+
+
+def prune_logs(days: Optional[int] = None, archive_dir: Optional[Path] = None,
+               dry_run: bool = False) -> List[Dict]:
+    """
+    Arquiva e descarta os meses inteiros mais antigos que `days` dias
+
+    Args:
+        days: Prazo de retenção (padrão: LOG_RETENTION_DAYS)
+        archive_dir: Diretório dos arquivos NDJSON.gz (None: descarta sem arquivar)
+        dry_run: Só lista os meses que seriam descartados
+    """
+    days = settings.LOG_RETENTION_DAYS if days is None else days
+    before = month_of(timezone.now() - timedelta(days=days))
+
+    report = []
+    for month in expired_months(before):
+        entry = {'month': f'{month:%Y-%m}'}
+        if not dry_run:
+            if archive_dir is not None:
+                path, rows = archive_month(month, archive_dir)
+                entry.update(archive=str(path), archived_rows=rows)
+            entry.update(drop_month(month))
+            logger.info(f"Retenção de logs: {entry}")
+        report.append(entry)
+
+    if not dry_run:
+        ensure_partitions()
+    return report
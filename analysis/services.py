@@ -1,8 +1,16 @@
-import requests
+import hashlib
+import json
 import logging
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional
 from django.conf import settings
+from .lazy import lazy_import
 from .models import AnalysisLog
+from .parsed import ParsedCompany
+from .payloads import build_projection, decode_payload
+from .validators import clean_cnpj, validate_cnpj
+
+# Carregado na primeira requisição: workers de pontuação e comandos não fazem HTTP
+requests = lazy_import('requests')
 
 logger = logging.getLogger('analysis')
 
@@ -10,7 +18,14 @@ logger = logging.getLogger('analysis')
 class CNPJAService:
     """Serviço para consumir a API CNPJA"""
     
-    def __init__(self):
+    def __init__(self, fields: Optional[Iterable[str]] = None):
+        """
+        Args:
+            fields: Grupos de campos do ParsedCompany que serão usados; o resto
+                do payload é descartado logo após a decodificação
+        """
+        self.projection = build_projection(fields)
+        self.max_list_items = settings.CNPJA_MAX_LIST_ITEMS or None
         self.api_url = settings.CNPJA_API_URL
         self.api_token = settings.CNPJA_API_TOKEN
         self.headers = {
@@ -33,21 +48,17 @@ class CNPJAService:
         )
     
     def _clean_cnpj(self, cnpj: str) -> str:
-        """Remove formatação do CNPJ"""
-        return ''.join(filter(str.isdigit, cnpj))
+        """Remove formatação do CNPJ (mantém letras do CNPJ alfanumérico)"""
+        return clean_cnpj(cnpj)
     
     def _validate_cnpj(self, cnpj: str) -> bool:
-        """Validação básica do CNPJ"""
-        cnpj = self._clean_cnpj(cnpj)
-        
-        if len(cnpj) != 14:
-            return False
-        
-        # Verifica se todos os dígitos são iguais
-        if cnpj == cnpj[0] * 14:
-            return False
-        
-        return True
+        """Validação completa do CNPJ (formato e dígitos verificadores)"""
+        return validate_cnpj(cnpj)
+    
+    def payload_hash(self, raw_data: Dict) -> str:
+        """Hash SHA-256 do payload em forma canônica (chaves ordenadas)"""
+        canonical = json.dumps(raw_data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
     
     def get_cnpj_data(self, cnpj: str) -> Optional[Dict]:
         """
@@ -72,7 +83,7 @@ class CNPJAService:
             response = requests.get(url, headers=self.headers, timeout=30)
             
             if response.status_code == 200:
-                data = response.json()
+                data = decode_payload(response.content, self.projection, self.max_list_items)
                 self._log_request(cnpj_clean, 'INFO', 'Dados obtidos com sucesso', {
                     'company_name': data.get('company', {}).get('name'),
                     'status': data.get('status', {}).get('text')
@@ -105,46 +116,20 @@ class CNPJAService:
             self._log_request(cnpj_clean, 'ERROR', f'Erro inesperado: {str(e)}')
             return None
     
-    def parse_cnpj_data(self, raw_data: Dict) -> Dict:
+    def parse_cnpj_data(self, raw_data: Dict, fields: Optional[Iterable[str]] = None) -> ParsedCompany:
         """
         Extrai e organiza dados relevantes da resposta da API
         
         Args:
             raw_data: Dados brutos da API
+            fields: Grupos de campos a decodificar (padrão: todos)
             
         Returns:
-            Dict com dados organizados
+            ParsedCompany (sem referência ao payload bruto)
         """
         try:
-            company = raw_data.get('company', {})
-            address = raw_data.get('address', {})
-            main_activity = raw_data.get('mainActivity', {})
-            status = raw_data.get('status', {})
-            
-            parsed_data = {
-                'cnpj': raw_data.get('taxId', ''),
-                'company_name': company.get('name', ''),
-                'status': status.get('text', ''),
-                'founded_date': raw_data.get('founded', ''),
-                'equity': company.get('equity'),
-                'main_activity': main_activity.get('text', ''),
-                'city': address.get('city', ''),
-                'state': address.get('state', ''),
-                'zip_code': address.get('zip', ''),
-                'district': address.get('district', ''),
-                'street': address.get('street', ''),
-                'number': address.get('number', ''),
-                'phones': raw_data.get('phones', []),
-                'emails': raw_data.get('emails', []),
-                'side_activities': raw_data.get('sideActivities', []),
-                'members': company.get('members', []),
-                'nature': company.get('nature', {}),
-                'size': company.get('size', {}),
-                'raw_data': raw_data
-            }
-            
-            return parsed_data
+            return ParsedCompany.from_payload(raw_data, fields)
             
         except Exception as e:
             logger.error(f"Erro ao processar dados do CNPJ: {str(e)}")
-            return {}
+            raise
@@ -0,0 +1,401 @@
+"""
+Simulação de mudanças de política (pesos e limiares) sobre a carteira
+
+Reavalia todas as análises armazenadas em memória, sem gravar nada, a partir
+de um snapshot colunar: um array por coluna (id da análise, status e score
+geral gravados, score de cada critério, capital social e data de fundação). O snapshot é
+construído uma vez por processo e atualizado incrementalmente com as análises
+gravadas desde a última leitura (analysis_date); exclusões forçam a
+reconstrução. Com numpy instalado o cálculo é vetorizado.
+
+Scores dos critérios vêm de AnalysisCriteria; só os critérios cujos limiares
+foram alterados são recalculados a partir dos dados da empresa.
+"""
+
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from .engines import (
+    CAPITAL_THRESHOLDS, CRITERIA_FIELDS, DEFAULT_CRITERIA_WEIGHTS, OPERATING_YEARS_THRESHOLDS,
+    PARTNER_NETWORK_WEIGHT, STATUS_THRESHOLDS, TIER_SCORES
+)
+from .lazy import lazy_import
+from .models import AnalysisCriteria, AnalysisResult
+
+# numpy é opcional e só é carregado na primeira simulação
+np = lazy_import('numpy', optional=True)
+
+STATUSES = ('APROVADO', 'ATENCAO', 'REPROVADO')
+_STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+# Critérios na ordem em que o engine soma os scores (mesmo arredondamento)
+CRITERIA_ORDER = tuple(CRITERIA_FIELDS)
+
+# Análises gravadas com analysis_date um pouco anterior ao último refresh podem
+# ter sido confirmadas depois dele; a janela é relida a cada atualização
+REFRESH_OVERLAP = timedelta(minutes=5)
+
+MISSING = -1
+
+
+class PolicyConfig:
+    """Pesos e limiares candidatos (o que não for informado mantém o valor atual)"""
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None,
+                 capital_thresholds: Optional[Sequence[float]] = None,
+                 operating_years_thresholds: Optional[Sequence[float]] = None,
+                 status_thresholds: Optional[Sequence[float]] = None):
+        self.weights = dict(DEFAULT_CRITERIA_WEIGHTS)
+        if settings.ANALYSIS_ENABLE_PARTNER_NETWORK:
+            self.weights['rede_societaria'] = PARTNER_NETWORK_WEIGHT
+        self.weights.update(weights or {})
+        self.capital_thresholds = tuple(capital_thresholds) if capital_thresholds else None
+        self.operating_years_thresholds = tuple(operating_years_thresholds) if operating_years_thresholds else None
+        self.status_thresholds = tuple(status_thresholds or STATUS_THRESHOLDS)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'PolicyConfig':
+        """
+        Valida a configuração recebida pela API
+
+        {"weights": {"capital_social": 0.3}, "thresholds": {"capital_social": [2000000, 200000, 50000],
+         "tempo_operacao": [5, 3, 1], "status": [85, 60]}}
+
+        Raises:
+            ValueError: Configuração inválida (mensagem para o cliente)
+        """
+        if not isinstance(data, dict):
+            raise ValueError('Configuração deve ser um objeto JSON')
+
+        weights = data.get('weights') or {}
+        if not isinstance(weights, dict):
+            raise ValueError('"weights" deve ser um objeto {critério: peso}')
+        for name, weight in weights.items():
+            if name not in CRITERIA_FIELDS:
+                raise ValueError(f'Critério desconhecido: {name}')
+            if not isinstance(weight, (int, float)) or isinstance(weight, bool) or weight < 0:
+                raise ValueError(f'Peso inválido para {name}')
+
+        thresholds = data.get('thresholds') or {}
+        if not isinstance(thresholds, dict):
+            raise ValueError('"thresholds" deve ser um objeto')
+        unknown = set(thresholds) - {'capital_social', 'tempo_operacao', 'status'}
+        if unknown:
+            raise ValueError(f"Limiar desconhecido: {', '.join(sorted(unknown))}")
+
+        return cls(
+            weights={name: float(weight) for name, weight in weights.items()},
+            capital_thresholds=_tiers(thresholds, 'capital_social', 3),
+            operating_years_thresholds=_tiers(thresholds, 'tempo_operacao', 3),
+            status_thresholds=_tiers(thresholds, 'status', 2)
+        )
+
+    def as_dict(self) -> Dict:
+        """Configuração efetiva (limiares não alterados com o valor atual)"""
+        return {
+            'weights': self.weights,
+            'thresholds': {
+                'capital_social': list(self.capital_thresholds or CAPITAL_THRESHOLDS),
+                'tempo_operacao': list(self.operating_years_thresholds or OPERATING_YEARS_THRESHOLDS),
+                'status': list(self.status_thresholds)
+            }
+        }
+
+
+def _tiers(thresholds: Dict, name: str, size: int) -> Optional[Tuple[float, ...]]:
+    """Limiares em ordem decrescente, do mais exigente ao menos exigente"""
+    values = thresholds.get(name)
+    if values is None:
+        return None
+    if (not isinstance(values, list) or len(values) != size
+            or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values)):
+        raise ValueError(f'"{name}" deve ser uma lista com {size} números')
+    if list(values) != sorted(values, reverse=True):
+        raise ValueError(f'"{name}" deve estar em ordem decrescente')
+    return tuple(float(v) for v in values)
+
+
+class PortfolioSnapshot:
+    """Colunas da carteira analisada, ordenadas por id da análise"""
+
+    def __init__(self):
+        self.ids = array('q')
+        self.status = array('b')
+        self.overall = array('h')  # score geral gravado: base da variação média
+        self.equity = array('d')
+        self.founded = array('q')  # date.toordinal(); 0 = sem data
+        self.scores: Dict[str, array] = {}
+        self.watermark = None
+        self.built_at = self.refreshed_at = time.monotonic()
+        self.stale = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls) -> 'PortfolioSnapshot':
+        """Carrega a carteira inteira"""
+        snapshot = cls()
+        snapshot._load(AnalysisResult.objects.all(), AnalysisCriteria.objects.all())
+        return snapshot
+
+    def refresh(self) -> int:
+        """
+        Relê as análises gravadas desde o último carregamento
+
+        Returns:
+            Linhas atualizadas; se detectar exclusões ou ids fora de ordem,
+            marca o snapshot como obsoleto (stale) para reconstrução
+        """
+        with self._lock:
+            if self.watermark is None:
+                changed = self._load(AnalysisResult.objects.all(), AnalysisCriteria.objects.all())
+            else:
+                since = self.watermark - REFRESH_OVERLAP
+                changed = self._load(
+                    AnalysisResult.objects.filter(analysis_date__gte=since),
+                    AnalysisCriteria.objects.filter(analysis_result__analysis_date__gte=since)
+                )
+            if AnalysisResult.objects.count() != len(self.ids):
+                self.stale = True
+            self.refreshed_at = time.monotonic()
+            return changed
+
+    def _row(self, analysis_id: int) -> Optional[int]:
+        """Posição da análise (acrescenta no fim se o id for maior que todos)"""
+        if not self.ids or analysis_id > self.ids[-1]:
+            self.ids.append(analysis_id)
+            self.status.append(MISSING)
+            self.overall.append(0)
+            self.equity.append(math.nan)
+            self.founded.append(0)
+            for column in self.scores.values():
+                column.append(MISSING)
+            return len(self.ids) - 1
+
+        row = bisect_left(self.ids, analysis_id)
+        if row < len(self.ids) and self.ids[row] == analysis_id:
+            return row
+        # id menor que o último e ausente: confirmado fora de ordem
+        self.stale = True
+        return None
+
+    def _load(self, results, criteria) -> int:
+        rows = {}
+        values = results.order_by('id').values_list(
+            'id', 'status', 'overall_score', 'analysis_date', 'cnpj_data__equity', 'cnpj_data__founded_date'
+        )
+        for analysis_id, status, overall, analysis_date, equity, founded in values.iterator(chunk_size=5000):
+            row = self._row(analysis_id)
+            if row is None:
+                continue
+            rows[analysis_id] = row
+            self.status[row] = _STATUS_CODES.get(status, MISSING)
+            self.overall[row] = overall
+            self.equity[row] = float(equity) if equity is not None else math.nan
+            self.founded[row] = founded.toordinal() if founded else 0
+            for column in self.scores.values():
+                column[row] = MISSING
+            if self.watermark is None or analysis_date > self.watermark:
+                self.watermark = analysis_date
+
+        if not rows:
+            return 0
+
+        values = criteria.order_by().values_list('analysis_result_id', 'criteria_name', 'score')
+        for analysis_id, name, score in values.iterator(chunk_size=10000):
+            row = rows.get(analysis_id)
+            if row is None:
+                continue
+            column = self.scores.get(name)
+            if column is None:
+                column = self.scores[name] = array('h', [MISSING]) * len(self.ids)
+            column[row] = score
+        return len(rows)
+
+
+def simulate(snapshot: PortfolioSnapshot, config: PolicyConfig, sample: int = 20,
+             today: Optional[date] = None) -> Dict:
+    """
+    Reavalia a carteira com a configuração candidata
+
+    Returns:
+        Dict com total, mudanças de status (por transição), contagem por
+        status antes/depois, variação média do score e amostra de análises
+        que mudariam de status
+    """
+    today = today or timezone.localdate()
+    with snapshot._lock:
+        if np is not None:
+            counts, delta, changed_rows = _simulate_numpy(snapshot, config, today)
+        else:
+            counts, delta, changed_rows = _simulate_python(snapshot, config, today)
+        changed_ids = [snapshot.ids[row] for row in changed_rows[:sample]]
+
+    transitions = {
+        f'{STATUSES[old]}->{STATUSES[new]}': counts[old][new]
+        for old in range(len(STATUSES)) for new in range(len(STATUSES))
+        if old != new and counts[old][new]
+    }
+    return {
+        'total': len(snapshot),
+        'changed': sum(transitions.values()),
+        'transitions': transitions,
+        'before': {status: sum(counts[code]) for code, status in enumerate(STATUSES)},
+        'after': {status: sum(row[code] for row in counts) for code, status in enumerate(STATUSES)},
+        'average_score_delta': round(delta, 2),
+        'changed_analysis_ids': changed_ids
+    }
+
+
+def _tier_score(value: float, thresholds: Sequence[float]) -> int:
+    for threshold, score in zip(thresholds, TIER_SCORES):
+        if value >= threshold:
+            return score
+    return TIER_SCORES[-1]
+
+
+def _overrides(config: PolicyConfig) -> Dict[str, str]:
+    overrides = {}
+    if config.capital_thresholds:
+        overrides['capital_social'] = 'capital'
+    if config.operating_years_thresholds:
+        overrides['tempo_operacao'] = 'tempo'
+    return overrides
+
+
+def _ordered_columns(snapshot: PortfolioSnapshot) -> List[str]:
+    extra = sorted(set(snapshot.scores) - set(CRITERIA_ORDER))
+    return [name for name in CRITERIA_ORDER + tuple(extra) if name in snapshot.scores]
+
+
+def _simulate_python(snapshot: PortfolioSnapshot, config: PolicyConfig, today: date):
+    overrides = _overrides(config)
+    columns = [(name, snapshot.scores[name], config.weights.get(name, 0.0)) for name in _ordered_columns(snapshot)]
+    first, second = config.status_thresholds
+    today_ordinal = today.toordinal()
+
+    counts = [[0] * len(STATUSES) for _ in STATUSES]
+    changed_rows = []
+    delta = 0.0
+    for row, old in enumerate(snapshot.status):
+        total = weight_sum = 0.0
+        for name, column, weight in columns:
+            score = column[row]
+            if score == MISSING:
+                continue
+            if name in overrides:
+                score = _override_score(snapshot, row, overrides[name], config, today_ordinal)
+            total += score * weight
+            weight_sum += weight
+
+        overall = round(total / weight_sum) if weight_sum else 0
+        delta += overall - snapshot.overall[row]
+        if old == MISSING:
+            continue
+        new = 0 if overall >= first else 1 if overall >= second else 2
+        counts[old][new] += 1
+        if old != new:
+            changed_rows.append(row)
+
+    return counts, delta / len(snapshot) if len(snapshot) else 0.0, changed_rows
+
+
+def _override_score(snapshot: PortfolioSnapshot, row: int, kind: str, config: PolicyConfig,
+                    today_ordinal: int) -> int:
+    if kind == 'capital':
+        equity = snapshot.equity[row]
+        if math.isnan(equity) or equity == 0:
+            return 30  # capital social não informado
+        return _tier_score(equity, config.capital_thresholds)
+    founded = snapshot.founded[row]
+    if not founded:
+        return 0  # data de fundação não disponível
+    return _tier_score((today_ordinal - founded) / 365.25, config.operating_years_thresholds)
+
+
+def _simulate_numpy(snapshot: PortfolioSnapshot, config: PolicyConfig, today: date):
+    overrides = _overrides(config)
+    size = len(snapshot)
+    total = np.zeros(size)
+    weight_sum = np.zeros(size)
+
+    for name in _ordered_columns(snapshot):
+        weight = config.weights.get(name, 0.0)
+        scores = np.frombuffer(snapshot.scores[name], dtype=np.int16).astype(np.float64)
+        present = scores != MISSING
+        if name in overrides:
+            scores = _override_scores_numpy(snapshot, overrides[name], config, today)
+        total += np.where(present, scores * weight, 0.0)
+        weight_sum += np.where(present, weight, 0.0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        overall = np.where(weight_sum > 0, np.round(total / weight_sum), 0.0)
+
+    first, second = config.status_thresholds
+    before = np.frombuffer(snapshot.status, dtype=np.int8).astype(np.int64)
+    after = np.select([overall >= first, overall >= second], [0, 1], 2)
+    known = before != MISSING
+    pairs = np.bincount(before[known] * len(STATUSES) + after[known], minlength=len(STATUSES) ** 2)
+    counts = pairs.reshape(len(STATUSES), len(STATUSES)).tolist()
+    changed_rows = np.flatnonzero(known & (before != after))
+    stored = np.frombuffer(snapshot.overall, dtype=np.int16)
+    delta = float((overall - stored).mean()) if size else 0.0
+    return counts, delta, changed_rows.tolist()
+
+
+def _override_scores_numpy(snapshot: PortfolioSnapshot, kind: str, config: PolicyConfig, today: date):
+    if kind == 'capital':
+        equity = np.frombuffer(snapshot.equity, dtype=np.float64)
+        thresholds = config.capital_thresholds
+        missing = np.isnan(equity) | (equity == 0)
+        values, missing_score = equity, 30
+    else:
+        founded = np.frombuffer(snapshot.founded, dtype=np.int64)
+        thresholds = config.operating_years_thresholds
+        missing = founded == 0
+        values, missing_score = (today.toordinal() - founded) / 365.25, 0
+
+    with np.errstate(invalid='ignore'):
+        conditions = [missing] + [values >= threshold for threshold in thresholds]
+    return np.select(conditions, [missing_score] + list(TIER_SCORES[:-1]), TIER_SCORES[-1]).astype(np.float64)
+
+
+_snapshot: Optional[PortfolioSnapshot] = None
+_snapshot_lock = threading.Lock()
+
+
+def get_portfolio_snapshot() -> PortfolioSnapshot:
+    """
+    Snapshot compartilhado do processo
+
+    Atualizado incrementalmente após SIMULATION_REFRESH_SECONDS e reconstruído
+    por completo após SIMULATION_REBUILD_SECONDS ou quando fica obsoleto.
+    """
+    global _snapshot
+    with _snapshot_lock:
+        now = time.monotonic()
+        if (_snapshot is None or _snapshot.stale
+                or now - _snapshot.built_at > settings.SIMULATION_REBUILD_SECONDS):
+            _snapshot = PortfolioSnapshot.build()
+        elif now - _snapshot.refreshed_at > settings.SIMULATION_REFRESH_SECONDS:
+            _snapshot.refresh()
+            if _snapshot.stale:
+                _snapshot = PortfolioSnapshot.build()
+        return _snapshot
+
+
+def reset_portfolio_snapshot():
+    """Descarta o snapshot (usado nos testes)"""
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
@@ -0,0 +1,232 @@
+"""
+Server-Sent Events: progresso de análises e de lotes em andamento
+
+Cada fluxo tem duas formas, escolhidas pela view conforme o servidor:
+
+    WSGI (gunicorn sync, runserver)  geradores síncronos: o Django envia cada
+                                     evento assim que é produzido (um gerador
+                                     assíncrono seria acumulado inteiro antes
+                                     do envio)
+    ASGI (uvicorn)                   geradores assíncronos: um cliente
+                                     conectado não ocupa uma thread enquanto
+                                     espera
+
+A análise individual roda em outra thread e repassa cada etapa ao gerador
+por uma fila. O progresso de lotes é obtido por consultas periódicas ao banco
+(o lote pode estar sendo processado em outro processo), com uma pausa entre
+elas.
+
+Itens finalizados são lidos por updated_at com uma janela de sobreposição
+(STREAM_OVERLAP), como o snapshot da simulação: itens gravados por uma
+transação que confirmou depois da leitura anterior não se perdem, e os já
+enviados dentro da janela são descartados. O id de cada evento 'item' é o
+updated_at do item; ao reconectar, o EventSource envia Last-Event-ID e o
+fluxo continua dali (itens da janela de sobreposição podem se repetir: o
+cliente identifica cada item pelo id).
+
+Cada conexão dura no máximo SSE_MAX_SECONDS (o EventSource reconecta
+sozinho); sob WSGI esse limite precisa ficar abaixo do timeout do worker
+(ver gunicorn.conf.py).
+"""
+
+import asyncio
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.utils import timezone
+
+from .engines import ProgressCallback
+from .models import BatchItem, BatchJob
+
+STREAM_OVERLAP = timedelta(seconds=5)
+
+# Todo status final de item: reaproveitados também contam no progresso do lote
+FINISHED_ITEM_STATUSES = ('SKIPPED', 'DONE', 'FAILED')
+FINISHED_JOB_STATUSES = ('COMPLETED', 'FAILED')
+
+KEEPALIVE = b': keepalive\n\n'
+
+_DONE = object()
+
+AnalysisRun = Callable[[ProgressCallback], Tuple[str, Dict]]
+
+
+def sse_event(event: str, data, event_id: Optional[str] = None) -> bytes:
+    """Formata um evento SSE (data em JSON, uma linha)"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False)}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def _final_event(run: AnalysisRun, on_progress: ProgressCallback) -> Tuple[str, Dict]:
+    try:
+        return run(on_progress)
+    except Exception as e:
+        return 'error', {'error': f'Erro interno: {str(e)}'}
+
+
+def analysis_events(run: AnalysisRun) -> Iterator[bytes]:
+    """
+    Executa `run` em uma thread e transmite as etapas conforme acontecem (WSGI)
+
+    Args:
+        run: Recebe o callback de progresso e retorna o evento final
+            ('result' ou 'error', dados já serializados)
+    """
+    events: queue.Queue = queue.Queue()
+
+    def target():
+        try:
+            events.put((_DONE, _final_event(run, lambda event, data: events.put((event, data)))))
+        finally:
+            connection.close()
+
+    # Se o cliente desconectar, a análise continua e é gravada normalmente
+    threading.Thread(target=target, name='sse-analysis', daemon=True).start()
+    while True:
+        try:
+            item = events.get(timeout=settings.SSE_KEEPALIVE_SECONDS)
+        except queue.Empty:
+            yield KEEPALIVE
+            continue
+        if item[0] is _DONE:
+            yield sse_event(*item[1])
+            return
+        yield sse_event(*item)
+
+
+async def aanalysis_events(run: AnalysisRun) -> AsyncIterator[bytes]:
+    """Versão ASGI de analysis_events: a análise roda no executor de sync_to_async"""
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def on_progress(event: str, data: Dict):
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    def target():
+        try:
+            return _final_event(run, on_progress)
+        finally:
+            loop.call_soon_threadsafe(events.put_nowait, _DONE)
+
+    task = asyncio.ensure_future(sync_to_async(target)())
+    while True:
+        try:
+            item = await asyncio.wait_for(events.get(), timeout=settings.SSE_KEEPALIVE_SECONDS)
+        except asyncio.TimeoutError:
+            yield KEEPALIVE
+            continue
+        if item is _DONE:
+            break
+        yield sse_event(*item)
+    yield sse_event(*await task)
+
+
+def parse_event_id(value: str) -> Optional[datetime]:
+    """Cursor do fluxo de lote a partir de Last-Event-ID (ISO 8601); None se inválido"""
+    try:
+        cursor = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return cursor if timezone.is_aware(cursor) else None
+
+
+class BatchProgress:
+    """
+    Estado de um fluxo de lote: cada poll() lê o banco e devolve os eventos novos
+
+    Eventos: 'item' a cada item finalizado, 'progress' quando os contadores
+    mudam e 'done' quando o lote termina.
+    """
+
+    def __init__(self, job_id: int, serialize_job: Callable[[BatchJob], Dict],
+                 serialize_item: Callable[[BatchItem], Dict], since: Optional[datetime] = None):
+        self.job_id = job_id
+        self.serialize_job = serialize_job
+        self.serialize_item = serialize_item
+        self.cursor = since or timezone.now()
+        self.sent: Dict[int, datetime] = {}
+        self.last_progress = None
+        self.finished = False
+
+    def poll(self) -> List[bytes]:
+        # O job é lido antes dos itens: se já terminou, todos os itens estão gravados
+        job = BatchJob.objects.get(pk=self.job_id)
+        items = BatchItem.objects.filter(
+            job_id=self.job_id, status__in=FINISHED_ITEM_STATUSES,
+            updated_at__gte=self.cursor - STREAM_OVERLAP
+        ).select_related('analysis_result').order_by('updated_at', 'id')
+
+        chunks = []
+        for item in items:
+            if item.id in self.sent:
+                continue
+            self.sent[item.id] = item.updated_at
+            self.cursor = max(self.cursor, item.updated_at)
+            chunks.append(sse_event('item', self.serialize_item(item), event_id=item.updated_at.isoformat()))
+        horizon = self.cursor - STREAM_OVERLAP
+        self.sent = {item_id: updated_at for item_id, updated_at in self.sent.items() if updated_at >= horizon}
+
+        progress = self.serialize_job(job)
+        if job.status in FINISHED_JOB_STATUSES:
+            chunks.append(sse_event('done', progress))
+            self.finished = True
+        elif progress != self.last_progress:
+            self.last_progress = progress
+            chunks.append(sse_event('progress', progress))
+        return chunks
+
+
+def batch_events(progress: BatchProgress) -> Iterator[bytes]:
+    """Transmite o progresso de um lote até o fim do lote ou de SSE_MAX_SECONDS (WSGI)"""
+    last_write = time.monotonic()
+    deadline = last_write + settings.SSE_MAX_SECONDS
+    while True:
+        chunks = progress.poll()
+        if chunks:
+            last_write = time.monotonic()
+            yield from chunks
+        if progress.finished:
+            return
+
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        if now - last_write >= settings.SSE_KEEPALIVE_SECONDS:
+            last_write = now
+            yield KEEPALIVE
+        time.sleep(settings.SSE_POLL_SECONDS)
+
+
+async def abatch_events(progress: BatchProgress) -> AsyncIterator[bytes]:
+    """Versão ASGI de batch_events: consultas no executor, pausa com asyncio.sleep"""
+    last_write = time.monotonic()
+    deadline = last_write + settings.SSE_MAX_SECONDS
+    poll = sync_to_async(progress.poll)
+    while True:
+        chunks = await poll()
+        if chunks:
+            last_write = time.monotonic()
+            for chunk in chunks:
+                yield chunk
+        if progress.finished:
+            return
+
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        if now - last_write >= settings.SSE_KEEPALIVE_SECONDS:
+            last_write = now
+            yield KEEPALIVE
+        await asyncio.sleep(settings.SSE_POLL_SECONDS)
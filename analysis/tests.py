@@ -0,0 +1,1748 @@
+import csv
+import gc
+import gzip
+import io
+import json
+import tempfile
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, router, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from cnpj_analyzer.database import parse_database_url, sqlite_pragmas
+from cnpj_analyzer.routers import REPLICA_DB_ALIAS, STICKY_COOKIE
+
+from . import benchmarks, validators
+from .apikeys import (
+    create_api_key, flush_usage, get_usage_meter, month_start, month_usage, reset_usage_meter, usage_cache_key
+)
+from .engines import CNPJAnalysisEngine, operating_years_boundaries
+from .freshness import FreshnessPolicy
+from .lazy import LazyModule, lazy_import
+from .memo import CriteriaMemo, reset_criteria_memo
+from .parsed import ParsedCompany
+from .payloads import build_projection, decode_payload, project
+from .pipeline import AnalysisPipeline, RateLimiter
+from .services import CNPJAService
+from .streams import analysis_events, parse_event_id, sse_event
+from . import simulation
+from .simulation import PolicyConfig, PortfolioSnapshot, get_portfolio_snapshot, reset_portfolio_snapshot
+from .refresh import PortfolioRefresher
+from .retention import month_bounds, month_of, next_month, prune_logs
+from .versioning import SNAPSHOT_INTERVAL, rebuild_version
+from . import graph, warmup
+from .graph import (
+    PartnerGraph, get_partner_graph, partner_key, refresh_partner_graph, reset_partner_graph, update_partner_graph
+)
+from .batch import BatchProcessor, claim_items, resumable_jobs
+from .models import (
+    CNPJData, AnalysisResult, AnalysisCriteria, BatchJob, BatchItem, CNPJDataVersion, WebhookEvent,
+    WebhookSubscription, ApiKeyUsage, AnalysisLog
+)
+from .webhooks import (
+    WebhookDispatcher, WebhookURLError, check_webhook_url, enqueue_analysis_completed, verify_signature
+)
+
+
+def make_member(name, tax_id='***123456**', role='Sócio-Administrador'):
+    return {
+        'since': '2015-01-01',
+        'person': {'id': name, 'type': 'NATURAL', 'name': name, 'taxId': tax_id},
+        'role': {'id': 49, 'text': role}
+    }
+
+
+def make_payload(cnpj, status='Ativa', equity=150000, founded='2015-01-01', city='São Paulo', state='SP',
+                 members=None):
+    """Resposta simulada da API CNPJA"""
+    return {
+        'taxId': cnpj,
+        'founded': founded,
+        'status': {'id': 2, 'text': status},
+        'company': {
+            'name': f'EMPRESA {cnpj}',
+            'equity': equity,
+            'nature': {'id': 2062, 'text': 'Sociedade Empresária Limitada'},
+            'size': {'id': 1, 'acronym': 'ME', 'text': 'Microempresa'},
+            'members': members if members is not None else [make_member('MARIA SILVA')]
+        },
+        'address': {'city': city, 'state': state, 'zip': '01000000', 'district': 'Centro',
+                     'street': 'Rua A', 'number': '1'},
+        'mainActivity': {'id': 8532500, 'text': 'Educação superior - graduação'},
+        'sideActivities': [{'id': 8599604, 'text': 'Treinamento em desenvolvimento profissional'}],
+        'phones': [],
+        'emails': []
+    }
+
+
+def create_analysis(cnpj, status='APROVADO', score=85, state='SP', criteria=None):
+    """Cria CNPJData + AnalysisResult + critérios para os testes"""
+    cnpj_data = CNPJData.objects.create(
+        cnpj=cnpj,
+        company_name=f'EMPRESA {cnpj}',
+        status='Ativa',
+        founded_date=date(2015, 1, 1),
+        equity=Decimal('150000.00'),
+        main_activity='Educação superior',
+        city='São Paulo',
+        state=state,
+        checked_at=timezone.now()
+    )
+    analysis = AnalysisResult.objects.create(
+        cnpj_data=cnpj_data,
+        overall_score=score,
+        status=status,
+        risk_level='Baixo',
+        processing_time=0.5
+    )
+    for name, criteria_score in (criteria or {'status_ativo': 100, 'capital_social': 80}).items():
+        AnalysisCriteria.objects.create(
+            analysis_result=analysis,
+            criteria_name=name,
+            criteria_description=name,
+            score=criteria_score,
+            weight=0.2,
+            passed=criteria_score >= 80
+        )
+    return analysis
+
+
+class AnalysisExportViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        create_analysis('11222333000181', status='APROVADO', state='SP')
+        create_analysis('11444777000161', status='REPROVADO', score=40, state='RJ',
+                        criteria={'status_ativo': 0})
+
+    def _content(self, response):
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv_export_pivots_criteria(self):
+        response = self.client.get(reverse('analysis_export'))
+
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(io.StringIO(self._content(response))))
+        self.assertEqual(len(rows), 2)
+        row = next(r for r in rows if r['cnpj'] == '11222333000181')
+        self.assertEqual(row['status_ativo_score'], '100')
+        self.assertEqual(row['capital_social_score'], '80')
+        self.assertEqual(row['localizacao_score'], '')
+
+    def test_ndjson_export_applies_history_filters(self):
+        response = self.client.get(reverse('analysis_export'), {'format': 'ndjson', 'status': 'reprovado'})
+
+        lines = self._content(response).splitlines()
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual(row['cnpj'], '11444777000161')
+        self.assertIs(row['status_ativo_passed'], False)
+
+    def test_export_criteria_query_count_is_constant(self):
+        for i in range(10):
+            create_analysis(f'{i:02d}345678000100')
+
+        # análises + critérios do único bloco
+        with self.assertNumQueries(2):
+            self._content(self.client.get(reverse('analysis_export')))
+
+    def test_invalid_format(self):
+        response = self.client.get(reverse('analysis_export'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_history_filters(self):
+        response = self.client.get(reverse('analysis_history'), {'state': 'rj'})
+        data = response.json()['data']
+        self.assertEqual([item['cnpj'] for item in data], ['11444777000161'])
+
+        response = self.client.get(reverse('analysis_history'), {'date_from': 'ontem'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(BATCH_RUN_IN_BACKGROUND=False)
+class BatchUploadTests(TestCase):
+
+    def _upload(self, content, name='lote.csv'):
+        return self.client.post(reverse('batch_upload'), {'file': SimpleUploadedFile(name, content)})
+
+    def test_upload_dedupes_validates_and_reuses_fresh_results(self):
+        create_analysis('11222333000181')
+        content = (
+            'nome;cnpj\n'
+            'A;11.222.333/0001-81\n'
+            'B;11444777000161\n'
+            'C;11444777000161\n'
+            'D;123\n'
+        ).encode('utf-8')
+
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data',
+                        side_effect=lambda cnpj: make_payload(cnpj)) as fetch:
+            response = self._upload(content)
+
+        self.assertEqual(response.status_code, 202)
+        data = response.json()['data']
+        self.assertEqual(data['status'], 'COMPLETED')
+        self.assertEqual(data['total_items'], 2)
+        self.assertEqual(data['invalid_items'], 1)
+        self.assertEqual(data['duplicate_items'], 1)
+        self.assertEqual(data['skipped_items'], 1)
+        self.assertEqual(data['processed_items'], 1)
+        self.assertEqual(data['progress'], 100.0)
+        fetch.assert_called_once_with('11444777000161')
+
+        job = BatchJob.objects.get(id=data['job_id'])
+        self.assertEqual(set(job.items.values_list('status', flat=True)), {'SKIPPED', 'DONE'})
+        self.assertFalse(job.items.filter(analysis_result__isnull=True).exists())
+
+        progress = self.client.get(reverse('batch_job', args=[job.id])).json()['data']
+        self.assertEqual(progress['processed_items'], 1)
+
+    def test_upload_xlsx_reads_cnpj_column(self):
+        from openpyxl import Workbook
+
+        leading_zero = validators.complete_cnpj('000000010001')
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['Nome', 'CNPJ'])
+        sheet.append(['A', '11.222.333/0001-81'])
+        sheet.append(['B', int(leading_zero)])  # Excel descarta os zeros à esquerda
+        sheet.append(['C', '11.222.333/0001-81'])
+        sheet.append(['D', '123'])
+        content = io.BytesIO()
+        workbook.save(content)
+
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data',
+                        side_effect=lambda cnpj: make_payload(cnpj)) as fetch:
+            response = self._upload(content.getvalue(), name='lote.xlsx')
+
+        self.assertEqual(response.status_code, 202)
+        data = response.json()['data']
+        self.assertEqual((data['total_items'], data['invalid_items'], data['duplicate_items']), (2, 1, 1))
+        self.assertEqual((data['status'], data['processed_items']), ('COMPLETED', 2))
+        self.assertEqual(
+            set(BatchJob.objects.get(id=data['job_id']).items.values_list('cnpj', flat=True)),
+            {'11222333000181', leading_zero}
+        )
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_upload_rejects_unknown_format(self):
+        response = self._upload(b'x', name='lote.pdf')
+        self.assertEqual(response.status_code, 400)
+
+
+class CNPJValidationTests(TestCase):
+
+    def test_check_digits(self):
+        self.assertTrue(validators.validate_cnpj('11.222.333/0001-81'))
+        self.assertTrue(validators.validate_cnpj('12.ABC.345/01DE-35'))
+        self.assertTrue(validators.validate_cnpj('12abc34501de35'))
+        self.assertFalse(validators.validate_cnpj('11222333000182'))
+        self.assertFalse(validators.validate_cnpj('00000000000000'))
+        self.assertFalse(validators.validate_cnpj('12ABC34501DE3A'))
+        self.assertFalse(validators.validate_cnpj('1122233300018'))
+
+    def test_batch_matches_scalar_with_and_without_numpy(self):
+        values = ['11222333000181', '12ABC34501DE35', '11222333000182', '00000000000000',
+                  '112223330001811', '', 'ÇÇ222333000181', '11.444.777/0001-61']
+        expected = [validators.validate_cnpj(v) for v in values]
+
+        self.assertEqual(validators.validate_cnpj_batch(values), expected)
+        with mock.patch.object(validators, 'np', None):
+            self.assertEqual(validators.validate_cnpj_batch(values), expected)
+
+    def test_validate_endpoint_never_calls_upstream(self):
+        with mock.patch('requests.get') as upstream:
+            response = self.client.post(
+                reverse('validate_api'),
+                json.dumps({'cnpjs': ['11.222.333/0001-81', '11222333000182']}),
+                content_type='application/json'
+            )
+            single = self.client.get(reverse('validate_api'), {'cnpj': '12ABC34501DE35'})
+
+        upstream.assert_not_called()
+        data = response.json()['data']
+        self.assertEqual((data['valid'], data['invalid']), (1, 1))
+        self.assertEqual(data['results'][0]['cnpj'], '11222333000181')
+        self.assertTrue(single.json()['data']['results'][0]['valid'])
+
+    def test_engine_rejects_invalid_cnpj_before_fetching(self):
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data') as fetch:
+            result = CNPJAnalysisEngine().analyze_cnpj('11222333000182')
+
+        fetch.assert_not_called()
+        self.assertEqual(result, {'success': False, 'error': 'CNPJ inválido'})
+
+
+class FreshnessPolicyTests(TestCase):
+
+    def setUp(self):
+        self.fetch = mock.patch('analysis.services.CNPJAService.get_cnpj_data',
+                                side_effect=lambda cnpj: make_payload(cnpj)).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _analyze(self, **kwargs):
+        return self.client.post(
+            reverse('analyze_api'),
+            json.dumps({'cnpj': '11222333000181', **kwargs}),
+            content_type='application/json'
+        ).json()['data']
+
+    def test_fresh_result_is_reused_unless_forced(self):
+        first = self._analyze()
+        second = self._analyze()
+        forced = self._analyze(force=True)
+
+        self.assertFalse(first['reused'])
+        self.assertTrue(second['reused'])
+        self.assertEqual(second['overall_score'], first['overall_score'])
+        self.assertEqual(len(second['criteria']), len(first['criteria']))
+        self.assertFalse(forced['reused'])
+        self.assertEqual(self.fetch.call_count, 2)
+        self.assertGreater(forced['analysis_date'], first['analysis_date'])
+
+    def test_stale_result_is_recomputed(self):
+        self._analyze()
+        CNPJData.objects.update(checked_at=timezone.now() - timedelta(days=30))
+
+        self.assertFalse(self._analyze()['reused'])
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_status_and_criteria_overrides(self):
+        policy = FreshnessPolicy(7, status_days={'Baixada': 180},
+                                 criteria_days={'capital_social': 90, 'tempo_operacao': 1})
+        now = timezone.now()
+
+        self.assertTrue(policy.is_fresh(now - timedelta(days=60), 'BAIXADA', now))
+        self.assertFalse(policy.is_fresh(now - timedelta(days=100), 'Baixada', now))
+        self.assertFalse(policy.is_fresh(now - timedelta(days=8), 'Ativa', now))
+
+        create_analysis('11222333000181')
+        CNPJData.objects.update(status='Baixada', checked_at=now - timedelta(days=60))
+        self.assertTrue(AnalysisResult.objects.filter(policy.fresh_q(now)).exists())
+        self.assertFalse(AnalysisResult.objects.filter(FreshnessPolicy(7).fresh_q(now)).exists())
+
+    def test_local_criterion_limit_applies_to_its_own_evaluation(self):
+        now = timezone.now()
+        policy = FreshnessPolicy(7, criteria_days={'tempo_operacao': 1, 'rede_societaria': 3})
+
+        self.assertTrue(policy.is_fresh(now - timedelta(days=5), 'Ativa', now))
+        self.assertEqual(policy.stale_criteria({
+            'tempo_operacao': now - timedelta(days=2),
+            'rede_societaria': now - timedelta(days=2),
+            'capital_social': now - timedelta(days=30),
+        }, now), {'tempo_operacao'})
+
+    def test_only_stale_criteria_are_recomputed_without_fetching(self):
+        freshness = {**settings.ANALYSIS_FRESHNESS, 'criteria': {'tempo_operacao': 1}}
+        with override_settings(ANALYSIS_FRESHNESS=freshness):
+            engine = CNPJAnalysisEngine()
+            first = engine.analyze_cnpj('11222333000181')
+            old = timezone.now() - timedelta(days=2)
+            AnalysisCriteria.objects.update(evaluated_at=old)
+            CNPJData.objects.update(checked_at=old)
+
+            result = engine.analyze_cnpj('11222333000181')
+
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertTrue(result['reused'])
+        self.assertEqual(result['recomputed'], ['tempo_operacao'])
+        self.assertGreater(result['analysis_result'].analysis_date, first['analysis_result'].analysis_date)
+        evaluated = dict(AnalysisCriteria.objects.values_list('criteria_name', 'evaluated_at'))
+        self.assertGreater(evaluated.pop('tempo_operacao'), old)
+        self.assertEqual(set(evaluated.values()), {old})
+        self.assertEqual(CNPJData.objects.get().checked_at, old)
+
+
+class PortfolioRefreshTests(TestCase):
+
+    def setUp(self):
+        self.payloads = {cnpj: make_payload(cnpj) for cnpj in ('11222333000181', '11444777000161')}
+        self.fetch = mock.patch('analysis.services.CNPJAService.get_cnpj_data',
+                                side_effect=lambda cnpj: self.payloads[cnpj]).start()
+        self.addCleanup(mock.patch.stopall)
+
+        engine = CNPJAnalysisEngine()
+        for cnpj in self.payloads:
+            engine.analyze_cnpj(cnpj)
+        CNPJData.objects.update(checked_at=timezone.now() - timedelta(days=30))
+        self.fetch.reset_mock()
+
+    def test_only_changed_payloads_are_rewritten(self):
+        self.payloads['11444777000161'] = make_payload('11444777000161', status='Baixada')
+        before = dict(AnalysisResult.objects.values_list('cnpj_data__cnpj', 'analysis_date'))
+
+        stats = PortfolioRefresher(sleep=lambda seconds: None).run()
+
+        self.assertEqual(stats, {'checked': 2, 'changed': 1, 'unchanged': 1, 'failed': 0})
+        after = dict(AnalysisResult.objects.values_list('cnpj_data__cnpj', 'analysis_date'))
+        self.assertEqual(after['11222333000181'], before['11222333000181'])
+        self.assertGreater(after['11444777000161'], before['11444777000161'])
+        self.assertEqual(CNPJData.objects.get(cnpj='11444777000161').status, 'Baixada')
+
+        # Tudo foi reverificado: nada mais está vencido
+        self.assertEqual(PortfolioRefresher(sleep=lambda seconds: None).run()['checked'], 0)
+
+    def test_failed_and_refreshed_cnpjs_are_not_retried_in_the_same_run(self):
+        create_analysis('19131243000197')
+        CNPJData.objects.filter(cnpj='19131243000197').update(checked_at=None)
+        self.payloads['19131243000197'] = make_payload('19131243000197')
+        self.payloads['11222333000181'] = None
+
+        # Blocos de 1: o cursor avança mesmo quando a consulta falha
+        stats = PortfolioRefresher(batch_size=1, sleep=lambda seconds: None).run(include_fresh=True)
+
+        self.assertEqual(stats['checked'], 3)
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual([call.args[0] for call in self.fetch.call_args_list],
+                         ['19131243000197', '11222333000181', '11444777000161'])
+
+    def test_requests_are_spread_within_rate_budget(self):
+        waits = []
+        PortfolioRefresher(rate_per_minute=30, batch_size=1, sleep=waits.append).run(limit=2)
+
+        self.assertEqual(self.fetch.call_count, 2)
+        self.assertEqual(len(waits), 1)
+        self.assertAlmostEqual(waits[0], 2.0, delta=0.5)
+
+
+class CNPJDataVersioningTests(TestCase):
+
+    def setUp(self):
+        self.payload = make_payload('11222333000181')
+        mock.patch('analysis.services.CNPJAService.get_cnpj_data',
+                   side_effect=lambda cnpj: self.payload).start()
+        self.addCleanup(mock.patch.stopall)
+        self.engine = CNPJAnalysisEngine()
+
+    def _analyze(self, **changes):
+        self.payload = make_payload('11222333000181', **changes)
+        return self.engine.analyze_cnpj('11222333000181', force=True)
+
+    def test_versions_store_diffs_and_rebuild_any_version(self):
+        self._analyze()
+        self._analyze()  # payload idêntico não gera versão
+        for equity in range(1, SNAPSHOT_INTERVAL + 3):
+            self._analyze(equity=equity * 1000)
+
+        cnpj_data = CNPJData.objects.get(cnpj='11222333000181')
+        versions = CNPJDataVersion.objects.filter(cnpj_data=cnpj_data)
+        self.assertEqual(versions.count(), SNAPSHOT_INTERVAL + 3)
+        self.assertEqual(versions.filter(is_snapshot=True).count(), 2)
+
+        diff = versions.get(version=2).data
+        self.assertEqual(diff, {'set': {'equity': 1000.0}, 'unset': []})
+
+        self.assertEqual(rebuild_version(cnpj_data, 1)[1]['equity'], 150000.0)
+        self.assertEqual(rebuild_version(cnpj_data, 7)[1]['equity'], 6000.0)
+        number, latest = rebuild_version(cnpj_data)
+        self.assertEqual((number, latest['equity']), (SNAPSHOT_INTERVAL + 3, (SNAPSHOT_INTERVAL + 2) * 1000.0))
+        self.assertEqual(latest['members'][0]['name'], 'MARIA SILVA')
+
+        response = self.client.get(reverse('cnpj_versions', args=['11.222.333-0001-81']), {'version': 2})
+        self.assertEqual(response.json()['data']['state']['equity'], 1000.0)
+
+    def test_changes_endpoint_filters_by_field_and_window(self):
+        since = timezone.now().isoformat()
+        self._analyze()
+        self._analyze(status='Baixada', equity=1000)
+
+        response = self.client.get(reverse('cnpj_changes'), {'since': since, 'field': 'status'})
+        data = response.json()['data']
+        self.assertEqual(len(data), 1)
+        self.assertEqual((data[0]['old_value'], data[0]['new_value']), ('Ativa', 'Baixada'))
+
+        response = self.client.get(reverse('cnpj_changes'), {'since': '2000-01-01', 'until': '2000-12-31'})
+        self.assertEqual(response.json()['data'], [])
+        self.assertEqual(self.client.get(reverse('cnpj_changes')).status_code, 400)
+
+
+class NormalizedCompanyTablesTests(TestCase):
+
+    def setUp(self):
+        mock.patch('analysis.services.CNPJAService.get_cnpj_data',
+                   side_effect=lambda cnpj: make_payload(cnpj)).start()
+        self.addCleanup(mock.patch.stopall)
+        engine = CNPJAnalysisEngine()
+        engine.analyze_cnpj('11222333000181')
+        engine.analyze_cnpj('11444777000161')
+        engine.analyze_cnpj('11444777000161', force=True)
+
+    def test_companies_by_activity_code(self):
+        data = self.client.get(reverse('activity_companies', args=['8532-5'])).json()['data']
+        self.assertEqual([item['cnpj'] for item in data], ['11222333000181', '11444777000161'])
+        self.assertTrue(all(item['is_main'] for item in data))
+
+        data = self.client.get(reverse('activity_companies', args=['8599604'])).json()['data']
+        self.assertFalse(data[0]['is_main'])
+
+    def test_companies_by_member(self):
+        by_cpf = self.client.get(reverse('member_search'), {'tax_id': '000.123.456-00', 'administrator': 'true'})
+        by_name = self.client.get(reverse('member_search'), {'name': 'maria'})
+
+        self.assertEqual(len(by_cpf.json()['data']), 2)
+        self.assertEqual(by_cpf.json()['data'], by_name.json()['data'])
+        self.assertEqual(self.client.get(reverse('member_search')).status_code, 400)
+
+
+class PartnerGraphTests(TestCase):
+
+    # A -(ANA)- B -(BRUNO)- C ; D isolada
+    companies = {
+        '11222333000181': ['ANA'],
+        '11444777000161': ['ANA', 'BRUNO'],
+        '37335118000180': ['BRUNO'],
+        '06990590000123': ['DANIEL'],
+    }
+    tax_ids = {'ANA': '***000001**', 'BRUNO': '***000002**', 'DANIEL': '***000003**'}
+
+    def setUp(self):
+        reset_partner_graph()
+        self.addCleanup(reset_partner_graph)
+        self.payloads = {
+            cnpj: make_payload(cnpj, members=[make_member(name, tax_id=self.tax_ids[name]) for name in names])
+            for cnpj, names in self.companies.items()
+        }
+        self.payloads['37335118000180']['status']['text'] = 'Baixada'
+        mock.patch('analysis.services.CNPJAService.get_cnpj_data',
+                   side_effect=lambda cnpj: self.payloads[cnpj]).start()
+        self.addCleanup(mock.patch.stopall)
+        for cnpj in self.companies:
+            CNPJAnalysisEngine().analyze_cnpj(cnpj)
+        self.ids = dict(CNPJData.objects.values_list('cnpj', 'id'))
+
+    def test_related_by_depth(self):
+        graph = PartnerGraph.build()
+        a, b, c = self.ids['11222333000181'], self.ids['11444777000161'], self.ids['37335118000180']
+
+        self.assertEqual(graph.related(a, depth=1), {b: 1})
+        self.assertEqual(graph.related(a, depth=2), {b: 1, c: 2})
+        self.assertEqual(graph.related(self.ids['06990590000123'], depth=3), {})
+
+    def test_incremental_update_on_reanalysis(self):
+        graph = get_partner_graph()
+        a, b = self.ids['11222333000181'], self.ids['11444777000161']
+
+        self.payloads['11444777000161']['company']['members'] = [make_member('BRUNO', tax_id='***000002**')]
+        with mock.patch.object(PartnerGraph, 'build') as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                CNPJAnalysisEngine().analyze_cnpj('11444777000161', force=True)
+            rebuild.assert_not_called()
+
+        self.assertEqual(graph.related(a, depth=3), {})
+        self.assertNotIn(partner_key('***000001**', 'ANA'), graph.company_partners[b])
+
+    def test_update_waits_for_commit(self):
+        graph = get_partner_graph()
+        b = self.ids['11444777000161']
+        keys = {partner_key('***000009**', 'ZECA')}
+
+        try:
+            with transaction.atomic():
+                update_partner_graph(b, keys)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertNotIn(partner_key('***000009**', 'ZECA'), graph.company_partners[b])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            update_partner_graph(b, keys)
+        self.assertEqual(graph.company_partners[b], keys)
+
+    def test_stale_graph_is_rebuilt_off_the_request_path(self):
+        current = get_partner_graph()
+        with override_settings(PARTNER_GRAPH_MAX_AGE=-1), \
+                mock.patch('analysis.graph.threading.Thread') as thread, \
+                mock.patch.object(PartnerGraph, 'build') as rebuild:
+            self.assertIs(get_partner_graph(), current)
+        rebuild.assert_not_called()
+        self.assertEqual(thread.call_args.kwargs['target'], graph._refresh_in_background)
+
+        # Atualização confirmada durante a reconstrução é reaplicada no grafo novo
+        b = self.ids['11444777000161']
+        keys = {partner_key('***000009**', 'ZECA')}
+        build = PartnerGraph.build
+
+        def build_with_concurrent_update():
+            rebuilt = build()
+            graph._apply_update(b, keys)
+            return rebuilt
+
+        with mock.patch.object(PartnerGraph, 'build', side_effect=build_with_concurrent_update):
+            rebuilt = refresh_partner_graph()
+        self.assertIsNot(rebuilt, current)
+        self.assertIs(get_partner_graph(), rebuilt)
+        self.assertEqual(rebuilt.company_partners[b], keys)
+
+    def test_related_endpoint(self):
+        data = self.client.get(reverse('related_companies', args=['11222333000181']), {'depth': 2}).json()['data']
+        self.assertEqual([(item['cnpj'], item['distance']) for item in data],
+                         [('11444777000161', 1), ('37335118000180', 2)])
+
+        response = self.client.get(reverse('related_companies', args=['11222333000181']), {'depth': 9})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(ANALYSIS_ENABLE_PARTNER_NETWORK=True, PARTNER_NETWORK_DEPTH=1)
+    def test_optional_partner_network_criterion(self):
+        result = CNPJAnalysisEngine().analyze_cnpj('11444777000161', force=True)
+
+        criterion = next(c for c in result['criteria'] if c['name'] == 'rede_societaria')
+        self.assertEqual(criterion['details']['related_companies'], 2)
+        self.assertEqual(criterion['details']['risky_companies'], 1)
+        self.assertEqual(criterion['score'], 50)
+
+
+class DatabaseConfigTests(TestCase):
+
+    def test_parse_database_url(self):
+        base = Path('/srv/app')
+        self.assertEqual(parse_database_url('sqlite:///db.sqlite3', base)['NAME'], base / 'db.sqlite3')
+        self.assertEqual(parse_database_url('sqlite:////var/db.sqlite3', base)['NAME'], Path('/var/db.sqlite3'))
+
+        pg = parse_database_url('postgres://user:p%40ss@db:6432/cnpj?sslmode=require', base,
+                                conn_max_age=300, pgbouncer=True)
+        self.assertEqual(pg['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((pg['USER'], pg['PASSWORD'], pg['HOST'], pg['PORT'], pg['NAME']),
+                         ('user', 'p@ss', 'db', '6432', 'cnpj'))
+        self.assertEqual(pg['CONN_MAX_AGE'], 300)
+        self.assertTrue(pg['CONN_HEALTH_CHECKS'])
+        self.assertTrue(pg['DISABLE_SERVER_SIDE_CURSORS'])
+        self.assertEqual(pg['OPTIONS'], {'sslmode': 'require'})
+
+        with self.assertRaises(ValueError):
+            parse_database_url('mysql://db/cnpj', base)
+
+    def test_sqlite_connections_get_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertGreater(cursor.fetchone()[0], 0)
+
+    def test_concurrent_writers_with_wal(self):
+        result = benchmarks.sqlite_writer_throughput(sqlite_pragmas(), writers=6, rows_per_writer=50, timeout=20.0)
+        self.assertEqual(result['lock_errors'], 0)
+        self.assertEqual(result['rows'], 300)
+
+
+class ReplicaRoutingTests(TestCase):
+    """Primário = banco de teste; réplica = arquivo SQLite separado e atrasado"""
+
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+
+        replica = parse_database_url(f'sqlite:///{tmp.name}/replica.sqlite3', Path(tmp.name))
+        connections.settings[REPLICA_DB_ALIAS] = connections.configure_settings({
+            'default': connections.settings['default'],
+            REPLICA_DB_ALIAS: replica
+        })[REPLICA_DB_ALIAS]
+        self.addCleanup(self._drop_replica)
+        call_command('migrate', database=REPLICA_DB_ALIAS, verbosity=0)
+
+        self.replicated = create_analysis('11222333000181')
+        self.replicated.cnpj_data.save(using=REPLICA_DB_ALIAS, force_insert=True)
+        self.replicated.save(using=REPLICA_DB_ALIAS, force_insert=True)
+        self.lagging = create_analysis('11444777000161')
+
+    def _drop_replica(self):
+        connections[REPLICA_DB_ALIAS].close()
+        del connections[REPLICA_DB_ALIAS]
+        del connections.settings[REPLICA_DB_ALIAS]
+
+    def history_cnpjs(self):
+        response = self.client.get(reverse('analysis_history'))
+        return {item['cnpj'] for item in response.json()['data']}
+
+    def test_read_views_use_replica(self):
+        self.assertEqual(self.history_cnpjs(), {'11222333000181'})
+        detail = reverse('analysis_detail', args=[self.lagging.id])
+        self.assertEqual(self.client.get(detail).status_code, 404)
+
+        export = self.client.get(reverse('analysis_export'), {'format': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(export.streaming_content).splitlines()]
+        self.assertEqual([row['cnpj'] for row in rows], ['11222333000181'])
+
+        self.assertEqual(router.db_for_read(AnalysisResult), 'default')
+        self.assertEqual(router.db_for_write(AnalysisResult), 'default')
+
+    def test_client_reads_its_own_writes(self):
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data',
+                        return_value=make_payload('11222333000181')):
+            response = self.client.post(
+                reverse('analyze_api'),
+                data=json.dumps({'cnpj': '11222333000181', 'force': True}),
+                content_type='application/json'
+            )
+        self.assertTrue(response.json()['success'])
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'], settings.REPLICA_STICKY_SECONDS)
+
+        self.assertEqual(self.history_cnpjs(), {'11222333000181', '11444777000161'})
+
+    def test_reads_do_not_pin_client(self):
+        response = self.client.get(reverse('analysis_history'))
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_analysis_stream_pins_client_before_streaming(self):
+        # A análise grava durante a iteração, depois de a resposta ser devolvida
+        response = self.client.get(reverse('analyze_stream'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+
+class ResponseCachingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.engine = CNPJAnalysisEngine()
+
+    def analyze(self, payload):
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', return_value=payload), \
+                self.captureOnCommitCallbacks(execute=True):
+            return self.engine.analyze_cnpj(payload['taxId'], force=True)
+
+    def test_detail_conditional_get(self):
+        analysis = self.analyze(make_payload('11222333000181'))['analysis_result']
+        url = reverse('analysis_detail', args=[analysis.id])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['analysis_id'], analysis.id)
+        self.assertIn('max-age=60', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+        etag = response['ETag']
+
+        # Corpo em cache: só a consulta de analysis_date
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).content, response.content)
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], etag)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304
+        )
+
+    def test_new_analysis_invalidates_cached_responses(self):
+        analysis = self.analyze(make_payload('11222333000181'))['analysis_result']
+        detail_url = reverse('analysis_detail', args=[analysis.id])
+        history_url = reverse('analysis_history')
+
+        detail = self.client.get(detail_url)
+        history = self.client.get(history_url)
+        self.assertEqual(self.client.get(history_url, HTTP_IF_NONE_MATCH=history['ETag']).status_code, 304)
+
+        self.analyze(make_payload('11222333000181', status='Baixada'))
+
+        detail_after = self.client.get(detail_url, HTTP_IF_NONE_MATCH=detail['ETag'])
+        self.assertEqual(detail_after.status_code, 200)
+        self.assertNotEqual(detail_after['ETag'], detail['ETag'])
+        self.assertEqual(detail_after.json()['data']['cnpj_data']['status'], 'Baixada')
+
+        history_after = self.client.get(history_url, HTTP_IF_NONE_MATCH=history['ETag'])
+        self.assertEqual(history_after.status_code, 200)
+        self.assertLess(history_after.json()['data'][0]['overall_score'], history.json()['data'][0]['overall_score'])
+
+    def test_write_in_another_process_invalidates_history(self):
+        self.analyze(make_payload('11222333000181'))
+        history_url = reverse('analysis_history')
+        history = self.client.get(history_url)
+
+        # Outro worker: mesmo banco, cache em memória próprio
+        with mock.patch('analysis.caching.cache', LocMemCache('other-worker', {})):
+            self.analyze(make_payload('11222333000181', status='Baixada'))
+
+        history_after = self.client.get(history_url, HTTP_IF_NONE_MATCH=history['ETag'])
+        self.assertEqual(history_after.status_code, 200)
+        self.assertLess(history_after.json()['data'][0]['overall_score'], history.json()['data'][0]['overall_score'])
+
+
+class ParsedCompanyTests(TestCase):
+
+    def test_parse_normalizes_and_drops_payload(self):
+        payload = make_payload('11222333000181', members=[make_member('ANA'), make_member('BIA', role='Sócio')])
+        parsed = CNPJAService().parse_cnpj_data(payload)
+
+        self.assertFalse(hasattr(parsed, '__dict__'))
+        self.assertEqual(parsed.cnpj, '11222333000181')
+        self.assertEqual(parsed.status_lower, 'ativa')
+        self.assertEqual(parsed.city_lower, 'são paulo')
+        self.assertEqual([m.is_administrator for m in parsed.members], [True, False])
+        self.assertNotIn(payload, gc.get_referents(parsed))
+
+    def test_only_requested_fields_are_decoded(self):
+        parsed = ParsedCompany.from_payload(make_payload('11222333000181'), fields={'status'})
+        self.assertEqual(parsed.decoded, {'status'})
+        self.assertEqual(parsed.status, 'Ativa')
+        self.assertEqual((parsed.city, parsed.members), ('', ()))
+
+        engine = CNPJAnalysisEngine()
+        self.assertLessEqual(engine.criteria_fields, engine.parse_fields)
+        self.assertNotIn('contacts', engine.parse_fields)
+
+    def test_memory_per_company_drops(self):
+        result = benchmarks.run_parsed_memory(companies=200)
+        self.assertLess(result['parsed_company']['bytes_per_company'], result['dict']['bytes_per_company'] / 2)
+
+
+class PayloadProjectionTests(TestCase):
+
+    def payload(self):
+        payload = make_payload('11222333000181', members=[make_member(f'SOCIO {i}') for i in range(5)])
+        payload['registrations'] = [{'number': '123', 'state': 'SP'}]
+        payload['company']['simples'] = {'optant': True}
+        return payload
+
+    def test_projection_keeps_only_parsed_fields(self):
+        payload = self.payload()
+        projected = decode_payload(json.dumps(payload).encode('utf-8'), build_projection(), max_items=3)
+
+        self.assertNotIn('registrations', projected)
+        self.assertNotIn('simples', projected['company'])
+        self.assertEqual(len(projected['company']['members']), 3)
+        self.assertEqual(set(projected['company']['members'][0]['person']), {'name', 'taxId', 'type'})
+
+        full, slim = ParsedCompany.from_payload(payload), ParsedCompany.from_payload(projected)
+        for field in ('status', 'founded_date', 'equity', 'main_activity', 'city', 'state', 'side_activities'):
+            self.assertEqual(getattr(slim, field), getattr(full, field))
+        self.assertEqual(slim.members, full.members[:3])
+
+        status_only = build_projection({'status'})
+        self.assertEqual(project(payload, status_only), {'taxId': '11222333000181', 'status': {'text': 'Ativa'}})
+
+    @override_settings(CNPJA_MAX_LIST_ITEMS=2)
+    def test_service_decodes_response_selectively(self):
+        response = mock.Mock(status_code=200, content=json.dumps(self.payload()).encode('utf-8'))
+        with mock.patch('analysis.services.requests.get', return_value=response):
+            data = CNPJAnalysisEngine().cnpja_service.get_cnpj_data('11222333000181')
+
+        self.assertNotIn('registrations', data)
+        self.assertNotIn('phones', data)
+        self.assertEqual(len(data['company']['members']), 2)
+
+
+class AnalysisPipelineTests(TestCase):
+
+    def test_stages_process_all_items_in_write_batches(self):
+        cnpjs = [validators.complete_cnpj(f'{i:08d}0001') for i in range(1, 8)]
+        failing = cnpjs[3]
+        batches = []
+
+        def fetch(cnpj):
+            return None if cnpj == failing else make_payload(cnpj)
+
+        pipeline = AnalysisPipeline(fetch_workers=3, score_workers=2, score_in_processes=False, queue_size=2,
+                                    write_batch_size=3, rate_per_minute=0, flush_interval=0.05)
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=fetch):
+            stats = pipeline.run(cnpjs, on_batch=batches.append)
+
+        results = dict(result for batch in batches for result in batch)
+        self.assertEqual(set(results), set(cnpjs))
+        self.assertFalse(results[failing]['success'])
+        self.assertTrue(all(results[cnpj]['success'] for cnpj in cnpjs if cnpj != failing))
+        self.assertTrue(all(len(batch) <= 3 for batch in batches))
+        self.assertEqual(AnalysisResult.objects.count(), 6)
+        self.assertEqual(AnalysisCriteria.objects.filter(analysis_result__cnpj_data__cnpj=cnpjs[0]).count(), 6)
+
+        self.assertEqual((stats['fetch']['items'], stats['fetch']['failed']), (7, 1))
+        self.assertEqual(stats['score']['items'], 6)
+        self.assertEqual(stats['write']['items'], 7)
+        self.assertEqual(stats['write']['batches'], len(batches))
+        self.assertGreater(stats['write']['items_per_second'], 0)
+
+    def test_pipeline_scores_like_serial_engine(self):
+        payload = make_payload('11222333000181')
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', return_value=payload):
+            serial = CNPJAnalysisEngine().analyze_cnpj('11222333000181', force=True)
+            batches = []
+            AnalysisPipeline(score_in_processes=False, rate_per_minute=0).run(['11222333000181'], batches.append)
+
+        staged = batches[0][0][1]
+        self.assertEqual(staged['overall_score'], serial['overall_score'])
+        self.assertEqual([c['name'] for c in staged['criteria']], [c['name'] for c in serial['criteria']])
+
+    def test_rate_limiter_spaces_calls(self):
+        delays = []
+        limiter = RateLimiter(120, sleep=delays.append)
+        for _ in range(3):
+            limiter.wait()
+        # sleep simulado não avança o relógio: as chamadas ocupam os próximos intervalos de 0,5s
+        self.assertEqual(len(delays), 2)
+        self.assertAlmostEqual(delays[0], 0.5, places=2)
+        self.assertAlmostEqual(delays[1], 1.0, places=2)
+
+
+class BatchResumeTests(TestCase):
+
+    def setUp(self):
+        self.cnpjs = [validators.complete_cnpj(f'{i:08d}0001') for i in range(1, 7)]
+        self.job = BatchJob.objects.create(file_name='lote.csv', total_items=len(self.cnpjs))
+        BatchItem.objects.bulk_create([BatchItem(job=self.job, cnpj=cnpj) for cnpj in self.cnpjs])
+
+    def _processor(self, **kwargs):
+        pipeline = AnalysisPipeline(score_in_processes=False, rate_per_minute=0, flush_interval=0.05)
+        return BatchProcessor(self.job, pipeline=pipeline, **kwargs)
+
+    def test_claims_are_disjoint_and_expired_leases_are_reclaimed(self):
+        first_token, first = claim_items(self.job, 4, lease_seconds=60)
+        second_token, second = claim_items(self.job, 4, lease_seconds=60)
+
+        self.assertEqual(len(first), 4)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({i for i, _ in first} & {i for i, _ in second})
+        self.assertEqual(claim_items(self.job, 4, lease_seconds=60)[1], [])
+
+        BatchItem.objects.filter(lease_token=first_token).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        _, reclaimed = claim_items(self.job, 10, lease_seconds=60)
+        self.assertEqual(reclaimed, first)
+        self.assertEqual(BatchItem.objects.get(id=first[0][0]).attempts, 2)
+
+    def test_resume_after_crash_processes_only_unfinished_items(self):
+        # Estado deixado por um worker que caiu: 2 itens gravados, 2 reservados, 2 pendentes
+        done, crashed = self.cnpjs[:2], self.cnpjs[2:4]
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=make_payload):
+            for cnpj in done:
+                result = CNPJAnalysisEngine().analyze_cnpj(cnpj)
+                BatchItem.objects.filter(job=self.job, cnpj=cnpj).update(
+                    status='DONE', analysis_result=result['analysis_result']
+                )
+        BatchItem.objects.filter(job=self.job, cnpj__in=crashed).update(
+            status='RUNNING', lease_token='morto', lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        BatchJob.objects.filter(pk=self.job.pk).update(status='RUNNING', processed_items=2)
+
+        self.assertEqual(list(resumable_jobs()), [self.job])
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=make_payload) as fetch:
+            job = self._processor(claim_size=3).run()
+
+        self.assertEqual(sorted(call.args[0] for call in fetch.call_args_list), self.cnpjs[2:])
+        self.assertEqual(job.status, 'COMPLETED')
+        self.assertEqual(job.processed_items, 6)
+        self.assertEqual(job.progress, 100.0)
+        self.assertFalse(job.items.exclude(status='DONE').exists())
+        self.assertFalse(job.items.exclude(lease_token='').exists())
+        self.assertEqual(list(resumable_jobs()), [])
+
+    def test_results_lost_by_expired_lease_are_not_counted(self):
+        token, items = claim_items(self.job, 2, lease_seconds=60)
+        # Outro worker assumiu o primeiro item depois que a reserva expirou
+        BatchItem.objects.filter(id=items[0][0]).update(lease_token='outro')
+
+        processor = self._processor()
+        processor._record(token, {cnpj: item_id for item_id, cnpj in items}, [
+            (items[0][1], {'success': True}), (items[1][1], {'success': False, 'error': 'x'})
+        ])
+
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.processed_items, self.job.failed_items), (0, 1))
+        self.assertEqual(BatchItem.objects.get(id=items[0][0]).status, 'RUNNING')
+
+    def test_job_stays_running_while_another_worker_holds_a_lease(self):
+        claim_items(self.job, 1, lease_seconds=60)
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=make_payload):
+            job = self._processor().run()
+
+        self.assertEqual(job.status, 'RUNNING')
+        self.assertEqual(job.processed_items, 5)
+
+    def test_items_endpoint_pages_with_cursor(self):
+        BatchItem.objects.filter(job=self.job, cnpj=self.cnpjs[0]).update(status='FAILED', error='x')
+        url = reverse('batch_items', args=[self.job.id])
+
+        first = self.client.get(url, {'limit': 4}).json()
+        self.assertEqual([item['cnpj'] for item in first['data']], self.cnpjs[:4])
+        second = self.client.get(url, {'limit': 4, 'after': first['next_after']}).json()
+        self.assertEqual([item['cnpj'] for item in second['data']], self.cnpjs[4:])
+        self.assertIsNone(second['next_after'])
+
+        failed = self.client.get(url, {'status': 'failed'}).json()['data']
+        self.assertEqual([(item['cnpj'], item['analysis']) for item in failed], [(self.cnpjs[0], None)])
+        self.assertEqual(self.client.get(url, {'limit': 0}).status_code, 400)
+
+    def test_resume_command(self):
+        out = io.StringIO()
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=make_payload), \
+                override_settings(PIPELINE_SCORE_PROCESSES=False, CNPJA_RATE_LIMIT_PER_MINUTE=0):
+            call_command('resume_batches', stdout=out)
+
+        self.assertIn(f'Lote {self.job.id}: COMPLETED', out.getvalue())
+        self.assertEqual(BatchItem.objects.filter(job=self.job, status='DONE').count(), 6)
+
+
+class PolicySimulationTests(TestCase):
+
+    def setUp(self):
+        reset_portfolio_snapshot()
+        self.addCleanup(reset_portfolio_snapshot)
+        self.cnpjs = [validators.complete_cnpj(f'{i:08d}0001') for i in range(1, 4)]
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data',
+                        side_effect=lambda cnpj: make_payload(cnpj, equity={
+                            self.cnpjs[0]: 150000, self.cnpjs[1]: 60000, self.cnpjs[2]: 1000
+                        }[cnpj])):
+            for cnpj in self.cnpjs:
+                CNPJAnalysisEngine().analyze_cnpj(cnpj)
+
+    def _simulate_both(self, snapshot, config):
+        vectorized = simulation.simulate(snapshot, config)
+        with mock.patch.object(simulation, 'np', None):
+            pure = simulation.simulate(snapshot, config)
+        self.assertEqual(vectorized, pure)
+        return vectorized
+
+    def test_current_policy_reproduces_stored_status(self):
+        result = self._simulate_both(PortfolioSnapshot.build(), PolicyConfig())
+        self.assertEqual(result['total'], 3)
+        self.assertEqual(result['changed'], 0)
+        self.assertEqual(result['before'], {'APROVADO': 3, 'ATENCAO': 0, 'REPROVADO': 0})
+        self.assertEqual(result['average_score_delta'], 0)
+
+    def test_capital_thresholds_and_weights_change_status(self):
+        config = PolicyConfig(weights={'capital_social': 0.6}, capital_thresholds=(2000000, 1000000, 500000))
+        result = self._simulate_both(PortfolioSnapshot.build(), config)
+
+        self.assertEqual(result['changed'], 3)
+        self.assertEqual(result['transitions'], {'APROVADO->ATENCAO': 3})
+        self.assertEqual(result['after']['ATENCAO'], 3)
+        self.assertEqual(len(result['changed_analysis_ids']), 3)
+        self.assertEqual(AnalysisResult.objects.filter(status='APROVADO').count(), 3)
+
+    def test_weights_only_change_moves_average_score(self):
+        result = self._simulate_both(PortfolioSnapshot.build(), PolicyConfig(weights={'capital_social': 0.6}))
+
+        self.assertEqual(result['transitions'], {'APROVADO->ATENCAO': 1})
+        self.assertLess(result['average_score_delta'], 0)
+
+    def test_snapshot_refreshes_incrementally_and_detects_deletions(self):
+        snapshot = PortfolioSnapshot.build()
+        create_analysis('11222333000181', status='REPROVADO', score=40)
+        AnalysisResult.objects.filter(cnpj_data__cnpj=self.cnpjs[0]).update(status='ATENCAO')
+
+        self.assertEqual(snapshot.refresh(), 4)
+        self.assertEqual(len(snapshot), 4)
+        self.assertFalse(snapshot.stale)
+        result = simulation.simulate(snapshot, PolicyConfig())
+        self.assertEqual(result['before'], {'APROVADO': 2, 'ATENCAO': 1, 'REPROVADO': 1})
+
+        CNPJData.objects.filter(cnpj=self.cnpjs[1]).delete()
+        snapshot.refresh()
+        self.assertTrue(snapshot.stale)
+
+    @override_settings(SIMULATION_REFRESH_SECONDS=0)
+    def test_shared_snapshot_picks_up_new_analyses(self):
+        self.assertEqual(len(get_portfolio_snapshot()), 3)
+        create_analysis('11222333000181')
+        self.assertEqual(len(get_portfolio_snapshot()), 4)
+
+    def test_simulate_api(self):
+        response = self.client.post(reverse('simulate_policy'), json.dumps({
+            'weights': {'capital_social': 0.6},
+            'thresholds': {'capital_social': [2000000, 1000000, 500000], 'status': [80, 60]}
+        }), content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        self.assertEqual(data['changed'], 3)
+        self.assertEqual(data['config']['thresholds']['tempo_operacao'], [5, 2, 1])
+
+        for invalid in ({'weights': {'inexistente': 1}}, {'thresholds': {'status': [60, 80]}},
+                        {'weights': {'capital_social': -1}}):
+            response = self.client.post(reverse('simulate_policy'), json.dumps(invalid),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+
+class CriteriaMemoTests(TestCase):
+
+    def setUp(self):
+        reset_criteria_memo()
+        self.addCleanup(reset_criteria_memo)
+
+    def test_lru_evicts_and_keeps_entries_per_config(self):
+        memo = CriteriaMemo(maxsize=2)
+        calls = []
+
+        def compute(value):
+            return lambda: calls.append(value) or {'score': value}
+
+        for value in (1, 2, 1, 3, 2):
+            self.assertEqual(memo.get_or_compute('c', ('w',), value, compute(value))['score'], value)
+        # 1 acerta; 3 expulsa 2 (menos usado); 2 é recalculado
+        self.assertEqual(calls, [1, 2, 3, 2])
+
+        # Outra configuração é outra entrada: alternar não descarta a anterior
+        memo.get_or_compute('c', ('outro peso',), 2, compute(20))
+        memo.get_or_compute('c', ('w',), 2, compute(2))
+        memo.get_or_compute('c', ('outro peso',), 2, compute(20))
+        self.assertEqual(calls, [1, 2, 3, 2, 20])
+        stats = memo.stats()['c']
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (3, 5, 2))
+
+    def test_engine_reuses_results_for_identical_inputs(self):
+        engine = CNPJAnalysisEngine()
+        first = ParsedCompany.from_payload(make_payload('11222333000181', members=[make_member('ANA')]))
+        second = ParsedCompany.from_payload(make_payload('11444777000161', members=[make_member('JOSE')]))
+
+        results = [engine._execute_analysis(data, include_db_criteria=False) for data in (first, second)]
+        with override_settings(ANALYSIS_CRITERIA_MEMO_SIZE=0):
+            reset_criteria_memo()
+            uncached = CNPJAnalysisEngine()._execute_analysis(second, include_db_criteria=False)
+
+        self.assertEqual(results[1], uncached)
+        stats = engine.criteria_memo.stats()
+        self.assertEqual(stats['localizacao']['hits'], 1)
+        self.assertEqual(stats['capital_social']['hit_rate'], 0.5)
+        self.assertNotIn('estrutura_societaria', stats)
+
+        engine.criteria_weights['capital_social'] = 0.5
+        result = engine._run_criterion('capital_social', engine._analyze_capital_social, first)
+        self.assertEqual(result['weight'], 0.5)
+
+        # Score-only e com explicação alternando no mesmo processo: ambos acertam
+        engine.criteria_weights['capital_social'] = 0.25
+        for explain in (False, True, False, True):
+            engine.explain = explain
+            engine._run_criterion('capital_social', engine._analyze_capital_social, first)
+        self.assertEqual(engine.criteria_memo.stats()['capital_social']['hits'], 3)
+
+
+class EvaluationDateTests(TestCase):
+
+    def setUp(self):
+        reset_criteria_memo()
+        self.addCleanup(reset_criteria_memo)
+
+    def _tempo(self, founded, evaluation_date):
+        parsed = ParsedCompany.from_payload(make_payload('11222333000181', founded=founded))
+        engine = CNPJAnalysisEngine(evaluation_date=evaluation_date)
+        return engine._run_criterion('tempo_operacao', engine._analyze_tempo_operacao, parsed, evaluation_date)
+
+    def test_boundaries_match_year_arithmetic(self):
+        for evaluation_date in (date(2024, 2, 29), date(2025, 1, 1), date(2023, 7, 15)):
+            boundaries = operating_years_boundaries(evaluation_date)
+            for founded in range(evaluation_date.toordinal() - 2000, evaluation_date.toordinal() + 2):
+                years = (evaluation_date.toordinal() - founded) / 365.25
+                expected = next((i for i, limit in enumerate((5, 2, 1)) if years >= limit), 3)
+                self.assertEqual(sum(1 for b in boundaries if founded > b), expected)
+
+    def test_explicit_evaluation_date_is_reproducible(self):
+        # 1826 dias = 4,9993 anos; no dia seguinte completa 5 anos
+        before = self._tempo('2015-01-01', date(2020, 1, 1))
+        after = self._tempo('2015-01-01', date(2020, 1, 2))
+        self.assertEqual((before['score'], after['score']), (80, 100))
+        self.assertEqual(before['details']['evaluation_date'], '2020-01-01')
+        self.assertEqual(self._tempo('2015-01-01', date(2020, 1, 1)), before)
+
+        invalid = self._tempo('01/01/2015', date(2020, 1, 1))
+        self.assertEqual(invalid['score'], 0)
+        self.assertIn('formato inválido', invalid['description'])
+
+    def test_batch_keeps_its_evaluation_date_when_resumed(self):
+        job = BatchJob.objects.create(file_name='lote.csv', total_items=1, evaluation_date=date(2016, 6, 1))
+        BatchItem.objects.create(job=job, cnpj='11222333000181')
+        pipeline = AnalysisPipeline(score_in_processes=False, rate_per_minute=0, flush_interval=0.05)
+
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=make_payload):
+            job = BatchProcessor(job, pipeline=pipeline).run()
+
+        criteria = AnalysisCriteria.objects.get(criteria_name='tempo_operacao')
+        self.assertEqual(job.evaluation_date, date(2016, 6, 1))
+        self.assertEqual(criteria.details['evaluation_date'], '2016-06-01')
+        self.assertEqual(criteria.score, 60)
+
+
+class ScoreOnlyTests(TestCase):
+
+    def setUp(self):
+        reset_criteria_memo()
+        self.addCleanup(reset_criteria_memo)
+
+    def test_score_only_batch_stores_compact_criteria_and_detail_explains_them(self):
+        cnpj = '11222333000181'
+        job = BatchJob.objects.create(file_name='lote.csv', total_items=1, evaluation_date=date(2024, 1, 1),
+                                      score_only=True)
+        BatchItem.objects.create(job=job, cnpj=cnpj)
+        pipeline = AnalysisPipeline(score_in_processes=False, rate_per_minute=0, flush_interval=0.05)
+
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=make_payload):
+            job = BatchProcessor(job, pipeline=pipeline).run()
+
+        stored = {c.criteria_name: c for c in AnalysisCriteria.objects.all()}
+        self.assertEqual(job.status, 'COMPLETED')
+        self.assertEqual({c.criteria_description for c in stored.values()}, {''})
+        self.assertEqual(stored['tempo_operacao'].details, {'evaluation_date': '2024-01-01'})
+
+        expected = CNPJAnalysisEngine(evaluation_date=date(2024, 1, 1))._execute_analysis(
+            ParsedCompany.from_payload(make_payload(cnpj)), include_db_criteria=False
+        )
+        analysis = AnalysisResult.objects.get()
+        response = self.client.get(reverse('analysis_detail', args=[analysis.id]))
+        explained = {c['name']: c for c in response.json()['data']['criteria']}
+        self.assertEqual(explained, {c['name']: json.loads(json.dumps(c)) for c in expected})
+
+    def test_missing_data_is_scored_compact(self):
+        payload = make_payload('11222333000181', equity=0, founded=None, members=[])
+        compact = {c['name']: c for c in CNPJAnalysisEngine(explain=False).score_payload(payload)[2]}
+        full = {c['name']: c for c in CNPJAnalysisEngine().score_payload(payload)[2]}
+
+        for name in ('tempo_operacao', 'capital_social', 'estrutura_societaria'):
+            self.assertEqual((compact[name]['description'], compact[name]['details']), ('', {}))
+            self.assertEqual((compact[name]['score'], compact[name]['passed']),
+                             (full[name]['score'], full[name]['passed']))
+        self.assertEqual(full['tempo_operacao']['description'], 'Data de fundação não disponível')
+
+    def test_memo_keeps_compact_and_full_results_apart(self):
+        parsed = ParsedCompany.from_payload(make_payload('11222333000181'))
+        compact = CNPJAnalysisEngine(explain=False)
+        full = CNPJAnalysisEngine()
+
+        result = compact._run_criterion('capital_social', compact._analyze_capital_social, parsed)
+        self.assertEqual((result['description'], result['score']), ('', 80))
+        result = full._run_criterion('capital_social', full._analyze_capital_social, parsed)
+        self.assertEqual(result['description'], 'Capital social adequado: R$ 150,000.00')
+
+
+class StartupImportTests(TestCase):
+    # Partida a frio de um worker (django.setup + engines), com folga para CI lento;
+    # medido: ~270 ms no perfil worker, ~600 ms antes das importações tardias
+    WORKER_STARTUP_BUDGET_MS = 1500
+
+    def test_lazy_import(self):
+        self.assertIsNone(lazy_import('modulo_que_nao_existe', optional=True))
+        module = LazyModule('colorsys')
+        self.assertFalse(module.loaded)
+        self.assertEqual(module.rgb_to_hsv(0, 0, 0), (0.0, 0.0, 0))
+        self.assertTrue(module.loaded)
+
+    def test_worker_profile_startup_budget(self):
+        profile = benchmarks.import_profile('cnpj_analyzer.settings_worker', repeats=1)
+        self.assertEqual(profile['loaded'], [])
+        self.assertLess(profile['wall_ms'], self.WORKER_STARTUP_BUDGET_MS)
+
+    def test_engine_import_does_not_load_http_or_numpy(self):
+        loaded = benchmarks.import_profile('cnpj_analyzer.settings', repeats=1)['loaded']
+        self.assertNotIn('requests', loaded)
+        self.assertNotIn('numpy', loaded)
+
+
+class WarmUpTests(TransactionTestCase):
+
+    def setUp(self):
+        reset_partner_graph()
+        reset_portfolio_snapshot()
+        self.addCleanup(reset_partner_graph)
+        self.addCleanup(reset_portfolio_snapshot)
+
+    @override_settings(ANALYSIS_ENABLE_PARTNER_NETWORK=True)
+    def test_preload_builds_shared_structures_and_closes_connections(self):
+        create_analysis('11222333000181')
+
+        with mock.patch.object(warmup.connections, 'close_all') as close_all:
+            report = warmup.warm_up('preload', freeze=False)
+
+        close_all.assert_called_once_with()
+        self.assertEqual(
+            list(report['steps']),
+            ['modules', 'urlconf', 'templates', 'criteria', 'partner_graph', 'portfolio_snapshot']
+        )
+        self.assertNotIn('failed', report)
+        self.assertIsNotNone(graph._graph)
+        self.assertEqual(len(simulation._snapshot.ids), 1)
+
+        connection.close()
+        report = warmup.warm_up('worker')
+        self.assertEqual(list(report['steps']), ['databases', 'cache'])
+        self.assertIsNotNone(connection.connection)
+
+    def test_failed_step_does_not_abort_warm_up(self):
+        with mock.patch.object(warmup, '_load_templates', side_effect=OSError('sem templates')):
+            report = warmup.warm_up('all', freeze=False)
+        self.assertEqual(report['failed'], ['templates'])
+        self.assertIn('cache', report['steps'])
+        with self.assertRaises(ValueError):
+            warmup.warm_up('master')
+
+
+def parse_sse(body):
+    """Converte o corpo de uma resposta SSE em [(evento, dados, id)] (ignora keepalives)"""
+    events = []
+    for block in body.decode('utf-8').split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+        if 'event' in fields:
+            events.append((fields['event'], json.loads(fields['data']), fields.get('id')))
+    return events
+
+
+async def read_stream(response):
+    return b''.join([chunk async for chunk in response.streaming_content])
+
+
+@override_settings(SSE_POLL_SECONDS=0.01)
+class EventStreamTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_criteria_memo()
+        self.addCleanup(reset_criteria_memo)
+        self.async_client = AsyncClient()
+
+    def test_sse_event_format(self):
+        self.assertEqual(
+            sse_event('stage', {'stage': 'fetching'}, event_id='1'),
+            'id: 1\nevent: stage\ndata: {"stage": "fetching"}\n\n'.encode('utf-8')
+        )
+        self.assertIsNone(parse_event_id('2024-01-01T10:00:00'))
+        self.assertIsNotNone(parse_event_id('2024-01-01T10:00:00+00:00'))
+
+    async def test_analysis_stream_sends_company_and_criteria_before_result(self):
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=make_payload):
+            response = await self.async_client.get(reverse('analyze_stream'), {'cnpj': '11222333000181'})
+            events = parse_sse(await read_stream(response))
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream; charset=utf-8')
+        names = [event for event, _, _ in events]
+        self.assertEqual(names[:3], ['stage', 'stage', 'stage'])
+        self.assertLess(names.index('company'), names.index('criterion'))
+        self.assertEqual(names[-1], 'result')
+
+        criteria = [data for event, data, _ in events if event == 'criterion']
+        result = events[-1][1]
+        self.assertEqual(events[names.index('company')][1]['company_name'], 'EMPRESA 11222333000181')
+        self.assertEqual([c['name'] for c in criteria], [c['name'] for c in result['criteria']])
+        self.assertEqual(result['cnpj'], '11222333000181')
+
+    async def test_analysis_stream_reports_errors_as_events(self):
+        response = await self.async_client.get(reverse('analyze_stream'), {'cnpj': '11222333000180'})
+        events = parse_sse(await read_stream(response))
+        self.assertEqual(events[-1][0], 'error')
+        self.assertIn('error', events[-1][1])
+
+        response = await self.async_client.get(reverse('analyze_stream'))
+        self.assertEqual(response.status_code, 400)
+
+    async def test_batch_stream_sends_finished_items_and_done(self):
+        job = await BatchJob.objects.acreate(file_name='lote.csv', total_items=2, processed_items=1,
+                                             failed_items=1, status='COMPLETED')
+        since = job.created_at
+        await BatchItem.objects.acreate(job=job, cnpj='11222333000181', status='DONE')
+        await BatchItem.objects.acreate(job=job, cnpj='11444777000161', status='FAILED', error='Erro')
+
+        response = await self.async_client.get(
+            reverse('batch_stream', args=[job.id]), {'since': since.isoformat()}
+        )
+        events = parse_sse(await read_stream(response))
+
+        self.assertEqual([event for event, _, _ in events], ['item', 'item', 'done'])
+        self.assertEqual({data['cnpj'] for _, data, _ in events[:2]}, {'11222333000181', '11444777000161'})
+        self.assertEqual(events[0][2], events[0][1]['updated_at'])
+        self.assertEqual(events[-1][1]['progress'], 100.0)
+
+        # Reconexão depois do último item: nada é reenviado além da janela de sobreposição
+        response = await self.async_client.get(
+            reverse('batch_stream', args=[job.id]),
+            headers={'Last-Event-ID': (timezone.now() + timedelta(minutes=1)).isoformat()}
+        )
+        self.assertEqual([event for event, _, _ in parse_sse(await read_stream(response))], ['done'])
+
+    def test_batch_stream_under_wsgi_is_sync_and_counts_skipped_items(self):
+        job = BatchJob.objects.create(file_name='lote.csv', total_items=2, processed_items=2,
+                                      status='COMPLETED')
+        since = job.created_at
+        BatchItem.objects.create(job=job, cnpj='11222333000181', status='DONE')
+        BatchItem.objects.create(job=job, cnpj='11444777000161', status='SKIPPED')
+
+        response = self.client.get(reverse('batch_stream', args=[job.id]), {'since': since.isoformat()})
+
+        self.assertFalse(response.is_async)
+        events = parse_sse(b''.join(response.streaming_content))
+        self.assertEqual([event for event, _, _ in events], ['item', 'item', 'done'])
+        self.assertEqual({data['status'] for _, data, _ in events[:2]}, {'DONE', 'SKIPPED'})
+
+    def test_sync_analysis_events_are_sent_as_they_happen(self):
+        release = threading.Event()
+
+        def run(on_progress):
+            on_progress('stage', {'stage': 'fetching'})
+            release.wait(5)
+            return 'result', {'cnpj': '11222333000181'}
+
+        events = analysis_events(run)
+        # A primeira etapa chega antes de a análise terminar
+        self.assertEqual(parse_sse(next(events))[0][:2], ('stage', {'stage': 'fetching'}))
+        release.set()
+        self.assertEqual(parse_sse(b''.join(events))[0][0], 'result')
+
+    async def test_batch_stream_validates_job_and_cursor(self):
+        response = await self.async_client.get(reverse('batch_stream', args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+        job = await BatchJob.objects.acreate(file_name='lote.csv', total_items=0)
+        response = await self.async_client.get(reverse('batch_stream', args=[job.id]), {'since': 'ontem'})
+        self.assertEqual(response.status_code, 400)
+
+
+class WebhookReceiver:
+    """Servidor HTTP local que registra as entregas e responde com status configurável"""
+
+    def __init__(self):
+        self.requests = []
+        self.status = 200
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                receiver.requests.append((dict(self.headers), body))
+                self.send_response(receiver.status)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/hooks'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=True)
+class WebhookTests(TestCase):
+
+    def setUp(self):
+        self.receiver = WebhookReceiver()
+        self.addCleanup(self.receiver.close)
+        self.subscription = WebhookSubscription.objects.create(url=self.receiver.url, secret='segredo')
+
+    def test_analysis_writes_outbox_event_without_calling_endpoint(self):
+        engine = CNPJAnalysisEngine()
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=make_payload):
+            result = engine.analyze_cnpj('11222333000181')
+
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.event_type), ('PENDING', 'analysis.completed'))
+        self.assertEqual(event.payload['analysis_id'], result['analysis_result'].id)
+        self.assertEqual(self.receiver.requests, [])
+
+        # Análise reaproveitada não gera evento novo
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=make_payload):
+            engine.analyze_cnpj('11222333000181')
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    @override_settings(API_KEY_RATE_LIMIT_PER_MINUTE=0)
+    def test_events_go_only_to_the_originating_key(self):
+        cache.clear()
+        keys = {}
+        for name, cnpj in (('A', '11222333000181'), ('B', '11444777000161')):
+            api_key, raw_key = create_api_key(name)
+            WebhookSubscription.objects.create(url=f'{self.receiver.url}/{name}', secret=name, api_key=api_key)
+            keys[name] = raw_key
+            with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=make_payload):
+                response = self.client.post(reverse('analyze_api'), {'cnpj': cnpj}, content_type='application/json',
+                                            headers={'X-API-Key': raw_key})
+            self.assertEqual(response.status_code, 200)
+
+        received = {}
+        for secret, payload in WebhookEvent.objects.values_list('subscription__secret', 'payload'):
+            received.setdefault(secret, set()).add(payload['cnpj'])
+        self.assertEqual(received, {
+            'A': {'11222333000181'},
+            'B': {'11444777000161'},
+            'segredo': {'11222333000181', '11444777000161'},  # assinatura da equipe, sem dono
+        })
+
+    def test_dispatcher_batches_and_signs_events_per_endpoint(self):
+        other = WebhookSubscription.objects.create(url=self.receiver.url + '/outro', secret='outro')
+        for cnpj in ('11222333000181', '11444777000161', '19131243000197'):
+            enqueue_analysis_completed(create_analysis(cnpj))
+
+        stats = WebhookDispatcher(batch_size=2).dispatch_once()
+
+        self.assertEqual(stats, {'events': 6, 'requests': 4, 'delivered': 6, 'retried': 0, 'failed': 0})
+        self.assertEqual(WebhookEvent.objects.filter(status='DELIVERED').count(), 6)
+        delivered = {}
+        for headers, body in self.receiver.requests:
+            secret = next(
+                subscription.secret for subscription in (self.subscription, other)
+                if verify_signature(subscription.secret, headers['X-Webhook-Timestamp'], body,
+                                    headers['X-Webhook-Signature'])
+            )
+            delivered.setdefault(secret, []).extend(e['data']['cnpj'] for e in json.loads(body)['events'])
+        self.assertEqual({k: len(v) for k, v in delivered.items()}, {'segredo': 3, 'outro': 3})
+        self.assertFalse(verify_signature('segredo', self.receiver.requests[0][0]['X-Webhook-Timestamp'],
+                                          b'{}', self.receiver.requests[0][0]['X-Webhook-Signature']))
+
+    def test_failed_delivery_is_retried_with_backoff_until_max_attempts(self):
+        enqueue_analysis_completed(create_analysis('11222333000181'))
+        dispatcher = WebhookDispatcher(max_attempts=2)
+        self.receiver.status = 500
+
+        stats = dispatcher.dispatch_once()
+        event = WebhookEvent.objects.get()
+        self.assertEqual((stats['retried'], event.status, event.attempts), (1, 'PENDING', 1))
+        self.assertGreater(event.next_attempt_at, timezone.now())
+        self.assertIn('HTTP 500', event.last_error)
+
+        # Ainda não venceu: nada é enviado
+        self.assertEqual(dispatcher.dispatch_once()['events'], 0)
+
+        WebhookEvent.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(dispatcher.dispatch_once()['failed'], 1)
+        self.assertEqual(WebhookEvent.objects.get().status, 'FAILED')
+        self.assertEqual(len(self.receiver.requests), 2)
+
+    def test_subscription_api(self):
+        _, raw_key = create_api_key('ERP')
+        headers = {'X-API-Key': raw_key}
+        url = reverse('webhook_subscriptions')
+        response = self.client.post(url, {'url': 'https://exemplo.com/hook'}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.post(url, {'url': 'ftp://exemplo'}, content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(url, {'url': 'https://exemplo.com/hook'}, content_type='application/json',
+                                    headers=headers)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()['data']
+        self.assertEqual(len(data['secret']), 64)
+
+        # Cada chave só enxerga e remove as próprias assinaturas
+        self.assertEqual([s['id'] for s in self.client.get(url, headers=headers).json()['data']], [data['id']])
+        _, other_key = create_api_key('Outro')
+        detail = reverse('webhook_subscription', args=[data['id']])
+        self.assertEqual(self.client.delete(detail, headers={'X-API-Key': other_key}).status_code, 404)
+        self.assertEqual(self.client.delete(detail).status_code, 401)
+
+        response = self.client.get(detail, headers=headers)
+        self.assertNotIn('secret', response.json()['data'])
+        self.assertEqual(response.json()['data']['events']['PENDING'], 0)
+
+        self.assertEqual(self.client.delete(detail, headers=headers).status_code, 200)
+        self.assertFalse(WebhookSubscription.objects.filter(id=data['id']).exists())
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=False)
+    def test_private_and_insecure_endpoints_are_refused(self):
+        for url in ('http://exemplo.com/hook', 'https://127.0.0.1/hook', 'https://169.254.169.254/latest',
+                    'https://10.0.0.5/hook', 'https://[::1]/hook', 'https://[::ffff:192.168.0.1]/hook'):
+            with self.assertRaises(WebhookURLError, msg=url):
+                check_webhook_url(url)
+        check_webhook_url('https://8.8.8.8/hook')
+
+        with mock.patch('socket.getaddrinfo', return_value=[(2, 1, 6, '', ('192.168.0.10', 443))]):
+            with self.assertRaises(WebhookURLError):
+                check_webhook_url('https://interno.exemplo.com/hook')
+
+        user = User.objects.create_user('equipe', password='senha', is_staff=True)
+        self.client.force_login(user)
+        response = self.client.post(reverse('webhook_subscriptions'), {'url': 'https://localhost/hook'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        # Endpoint que passou a apontar para a rede interna é recusado no envio
+        enqueue_analysis_completed(create_analysis('11222333000181'))
+        stats = WebhookDispatcher().dispatch_once()
+        self.assertEqual((stats['delivered'], stats['retried']), (0, 1))
+        self.assertEqual(self.receiver.requests, [])
+        self.assertIn('Endpoint recusado', WebhookEvent.objects.get().last_error)
+
+
+@override_settings(API_USAGE_FLUSH_SECONDS=3600, API_KEY_RATE_LIMIT_PER_MINUTE=0)
+class ApiKeyTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_usage_meter()
+        self.addCleanup(reset_usage_meter)
+        self.api_key, self.raw_key = create_api_key('ERP')
+
+    def analyze(self, cnpj='11222333000181', **headers):
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=make_payload):
+            return self.client.post(reverse('analyze_api'), {'cnpj': cnpj}, content_type='application/json',
+                                    headers=headers)
+
+    @override_settings(API_KEY_REQUIRED=True)
+    def test_required_key_is_checked(self):
+        self.assertEqual(self.analyze().status_code, 401)
+        self.assertEqual(self.analyze(**{'X-API-Key': 'outra'}).status_code, 401)
+        self.assertEqual(self.analyze(**{'X-API-Key': self.raw_key}).status_code, 200)
+        self.assertEqual(self.analyze(Authorization=f'Api-Key {self.raw_key}').status_code, 200)
+
+        self.api_key.is_active = False
+        self.api_key.save()
+        cache.clear()
+        self.assertEqual(self.analyze(**{'X-API-Key': self.raw_key}).status_code, 401)
+
+    def test_usage_is_counted_in_cache_and_flushed_split_by_source(self):
+        self.analyze(**{'X-API-Key': self.raw_key})
+        self.analyze(**{'X-API-Key': self.raw_key})
+        self.analyze()
+
+        # Nenhuma gravação por requisição: só o cache foi atualizado
+        self.assertFalse(ApiKeyUsage.objects.exists())
+        response = self.client.get(reverse('api_usage'), headers={'X-API-Key': self.raw_key})
+        data = response.json()['data']
+        self.assertEqual((data['upstream_requests'], data['cached_requests'], data['remaining']), (1, 1, None))
+
+        self.assertEqual(get_usage_meter().flush(), 1)
+        usage = ApiKeyUsage.objects.get()
+        self.assertEqual((usage.month, usage.upstream_requests, usage.cached_requests), (month_start(), 1, 1))
+
+        # Gravar de novo é idempotente e um cache atrasado nunca diminui o total
+        cache.set(usage_cache_key(self.api_key.id, month_start(), 'cached'), 0)
+        flush_usage([(self.api_key.id, month_start())])
+        usage.refresh_from_db()
+        self.assertEqual((usage.upstream_requests, usage.cached_requests), (1, 1))
+
+        # Cache esvaziado: o contador recomeça do valor gravado
+        cache.clear()
+        self.analyze(**{'X-API-Key': self.raw_key})
+        get_usage_meter().flush()
+        usage.refresh_from_db()
+        self.assertEqual(usage.cached_requests, 2)
+
+    def test_rate_limit_and_monthly_quota(self):
+        limited, limited_key = create_api_key('Parceiro', rate_limit_per_minute=2)
+        self.assertEqual(self.analyze('11222333000180', **{'X-API-Key': limited_key}).status_code, 200)
+        self.assertEqual(self.analyze('11222333000180', **{'X-API-Key': limited_key}).status_code, 200)
+        response = self.analyze('11222333000180', **{'X-API-Key': limited_key})
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(response.has_header('Retry-After'))
+
+        quota, quota_key = create_api_key('Teste', monthly_quota=1)
+        self.assertEqual(self.analyze(**{'X-API-Key': quota_key}).status_code, 200)
+        response = self.analyze(**{'X-API-Key': quota_key})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Cota mensal', response.json()['error'])
+
+
+    @override_settings(API_KEY_REQUIRED=True)
+    def test_query_string_key_only_accepted_on_streams(self):
+        query = f"?api_key={self.raw_key}"
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=make_payload):
+            response = self.client.post(reverse('analyze_api') + query, {'cnpj': '11222333000181'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.client.get(reverse('api_usage') + query).status_code, 401)
+
+        # Sem cnpj: passou pela autenticação e parou na validação
+        self.assertEqual(self.client.get(reverse('analyze_stream') + query).status_code, 400)
+        self.assertEqual(self.client.get(reverse('analyze_stream')).status_code, 401)
+
+    @override_settings(API_KEY_REQUIRED=True)
+    def test_session_without_key_must_be_staff(self):
+        user = User.objects.create_user('analista', password='senha')
+        self.client.force_login(user)
+        self.assertEqual(self.analyze().status_code, 401)
+
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.analyze().status_code, 200)
+
+    def upload(self, raw_key=None, content=b'cnpj\n11222333000181\n11444777000161\n'):
+        headers = {'X-API-Key': raw_key} if raw_key else {}
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data', side_effect=make_payload):
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.post(reverse('batch_upload'),
+                                        {'file': SimpleUploadedFile('lote.csv', content)}, headers=headers)
+
+    @override_settings(API_KEY_REQUIRED=True, BATCH_RUN_IN_BACKGROUND=False)
+    def test_batch_routes_require_key_and_meter_each_item(self):
+        self.assertEqual(self.upload().status_code, 401)
+
+        create_analysis('11222333000181')
+        response = self.upload(self.raw_key)
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['data']['job_id']
+        self.assertEqual(BatchJob.objects.get(id=job_id).api_key, self.api_key)
+        # Reaproveitado conta como cached; consultado à API, como upstream
+        self.assertEqual(month_usage(self.api_key.id), {'cached': 1, 'upstream': 1})
+
+        _, other_key = create_api_key('Outro')
+        for name in ('batch_job', 'batch_items', 'batch_stream'):
+            url = reverse(name, args=[job_id])
+            self.assertEqual(self.client.get(url).status_code, 401)
+            self.assertEqual(self.client.get(url, headers={'X-API-Key': other_key}).status_code, 404)
+        response = self.client.get(reverse('batch_job', args=[job_id]), headers={'X-API-Key': self.raw_key})
+        self.assertEqual(response.json()['data']['status'], 'COMPLETED')
+
+    @override_settings(BATCH_RUN_IN_BACKGROUND=False)
+    def test_batch_larger_than_remaining_quota_is_refused(self):
+        _, quota_key = create_api_key('Teste', monthly_quota=1)
+        with mock.patch('analysis.services.CNPJAService.get_cnpj_data') as fetch:
+            response = self.upload(quota_key)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['data']['status'], 'FAILED')
+        fetch.assert_not_called()
+
+class LogRetentionTests(TestCase):
+
+    def create_logs(self, month, count):
+        start, _ = month_bounds(month)
+        AnalysisLog.objects.bulk_create([
+            AnalysisLog(cnpj='11222333000181', level='INFO', message=f'log {i}', details={'i': i},
+                        timestamp=start + timedelta(hours=i))
+            for i in range(count)
+        ])
+
+    def test_month_helpers(self):
+        self.assertEqual(next_month(date(2024, 12, 1)), date(2025, 1, 1))
+        start, end = month_bounds(date(2024, 2, 1))
+        self.assertEqual((month_of(start), month_of(end)), (date(2024, 2, 1), date(2024, 3, 1)))
+        self.assertEqual(month_of(end - timedelta(microseconds=1)), date(2024, 2, 1))
+
+    def test_prune_archives_and_drops_only_whole_expired_months(self):
+        current = month_of(timezone.now())
+        old = month_of(month_bounds(current)[0] - timedelta(days=100))
+        older = month_of(month_bounds(old)[0] - timedelta(days=1))
+        self.create_logs(older, 3)
+        self.create_logs(old, 2)
+        self.create_logs(current, 1)
+
+        self.assertEqual(
+            [entry['month'] for entry in prune_logs(days=40, dry_run=True)], [f'{older:%Y-%m}', f'{old:%Y-%m}']
+        )
+        self.assertEqual(AnalysisLog.objects.count(), 6)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch('analysis.retention.DELETE_CHUNK_SIZE', 2):
+                report = prune_logs(days=40, archive_dir=Path(directory))
+
+            first = report[0]
+            self.assertEqual((first['archived_rows'], first['deleted_rows'], first['partition_dropped']),
+                             (3, 3, False))
+            with gzip.open(first['archive'], 'rt', encoding='utf-8') as archive:
+                rows = [json.loads(line) for line in archive]
+            self.assertEqual([row['message'] for row in rows], ['log 0', 'log 1', 'log 2'])
+            self.assertEqual(set(rows[0]), {'id', 'cnpj', 'level', 'message', 'details', 'timestamp'})
+            self.assertEqual(sorted(p.name for p in Path(directory).iterdir()),
+                             sorted(Path(entry['archive']).name for entry in report))
+
+        self.assertEqual(list(AnalysisLog.objects.values_list('message', flat=True)), ['log 0'])
+        self.assertEqual(prune_logs(days=40), [])
+
+    def test_prune_logs_command(self):
+        self.create_logs(date(2000, 1, 1), 2)
+        out = io.StringIO()
+        call_command('prune_logs', '--no-archive', stdout=out)
+        self.assertIn('2000-01: 2 linhas apagadas', out.getvalue())
+        self.assertFalse(AnalysisLog.objects.exists())
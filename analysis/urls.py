@@ -4,8 +4,24 @@ from . import views
 urlpatterns = [
     path('', views.CNPJAnalysisView.as_view(), name='analysis_home'),
     path('api/analyze/', views.analyze_cnpj_api, name='analyze_api'),
+    path('api/analyze/stream/', views.analyze_stream_api, name='analyze_stream'),
     path('api/history/', views.AnalysisHistoryView.as_view(), name='analysis_history'),
     path('api/analysis/<int:analysis_id>/', views.AnalysisDetailView.as_view(), name='analysis_detail'),
+    path('api/export/', views.AnalysisExportView.as_view(), name='analysis_export'),
+    path('api/batch/upload/', views.BatchUploadView.as_view(), name='batch_upload'),
+    path('api/batch/<int:job_id>/', views.BatchJobView.as_view(), name='batch_job'),
+    path('api/batch/<int:job_id>/items/', views.BatchItemsView.as_view(), name='batch_items'),
+    path('api/batch/<int:job_id>/stream/', views.batch_stream_api, name='batch_stream'),
+    path('api/usage/', views.api_usage, name='api_usage'),
+    path('api/webhooks/', views.WebhookSubscriptionsView.as_view(), name='webhook_subscriptions'),
+    path('api/webhooks/<int:subscription_id>/', views.WebhookSubscriptionView.as_view(), name='webhook_subscription'),
+    path('api/simulate/', views.simulate_policy_api, name='simulate_policy'),
+    path('api/validate/', views.validate_cnpj_api, name='validate_api'),
+    path('api/cnpj/<str:cnpj>/versions/', views.CNPJVersionsView.as_view(), name='cnpj_versions'),
+    path('api/cnpj/<str:cnpj>/related/', views.RelatedCompaniesView.as_view(), name='related_companies'),
+    path('api/changes/', views.CNPJChangesView.as_view(), name='cnpj_changes'),
+    path('api/activities/<str:code>/companies/', views.ActivityCompaniesView.as_view(), name='activity_companies'),
+    path('api/members/', views.MemberSearchView.as_view(), name='member_search'),
     path('api/search/', views.CNPJSearchView.as_view(), name='cnpj_search'),
     path('api/health/', views.health_check, name='health_check'),
 ]
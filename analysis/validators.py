@@ -0,0 +1,108 @@
+"""
+Validação de CNPJ (dígitos verificadores módulo 11)
+
+Suporta o formato numérico tradicional e o CNPJ alfanumérico da Receita
+Federal: as 12 primeiras posições aceitam 0-9 e A-Z (valor = código ASCII - 48)
+e as 2 últimas são os dígitos verificadores numéricos.
+"""
+
+from typing import Iterable, List
+
+from .lazy import lazy_import
+
+# numpy é opcional e só é carregado na primeira validação vetorizada
+np = lazy_import('numpy', optional=True)
+
+CNPJ_LENGTH = 14
+
+FIRST_DIGIT_WEIGHTS = (5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+SECOND_DIGIT_WEIGHTS = (6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+
+_BASE_CHARS = frozenset('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+_DIGITS = frozenset('0123456789')
+_SEPARATORS = str.maketrans('', '', './- \t\r\n')
+
+
+def clean_cnpj(cnpj: str) -> str:
+    """Remove formatação e normaliza para maiúsculas"""
+    cleaned = str(cnpj).translate(_SEPARATORS).upper()
+    if cleaned.isalnum() and cleaned.isascii():
+        return cleaned
+    return ''.join(c for c in cleaned if c.isascii() and c.isalnum())
+
+
+def _check_digit(values, weights) -> int:
+    remainder = sum(v * w for v, w in zip(values, weights)) % 11
+    return 0 if remainder < 2 else 11 - remainder
+
+
+def complete_cnpj(base: str) -> str:
+    """Acrescenta os dígitos verificadores a uma base de 12 caracteres"""
+    base = clean_cnpj(base)
+    values = [ord(c) - 48 for c in base]
+    first = _check_digit(values, FIRST_DIGIT_WEIGHTS)
+    second = _check_digit(values + [first], SECOND_DIGIT_WEIGHTS)
+    return f'{base}{first}{second}'
+
+
+def validate_cnpj(cnpj: str) -> bool:
+    """Valida formato e dígitos verificadores de um CNPJ já limpo ou formatado"""
+    cnpj = clean_cnpj(cnpj)
+
+    if len(cnpj) != CNPJ_LENGTH:
+        return False
+
+    if not (_BASE_CHARS.issuperset(cnpj[:12]) and _DIGITS.issuperset(cnpj[12:])):
+        return False
+
+    # Sequências repetidas (ex.: 00000000000000) passam no módulo 11 mas são inválidas
+    if cnpj == cnpj[0] * CNPJ_LENGTH:
+        return False
+
+    values = [ord(c) - 48 for c in cnpj]
+    first = _check_digit(values[:12], FIRST_DIGIT_WEIGHTS)
+    second = _check_digit(values[:13], SECOND_DIGIT_WEIGHTS)
+    return values[12] == first and values[13] == second
+
+
+def validate_cnpj_batch(cnpjs: Iterable[str], clean: bool = True) -> List[bool]:
+    """
+    Valida uma sequência de CNPJs de uma vez
+
+    Com numpy disponível o cálculo é vetorizado sobre uma matriz (n, 14) de
+    códigos de caractere; sem numpy cai para a validação item a item.
+
+    Args:
+        cnpjs: CNPJs formatados ou limpos
+        clean: False quando os valores já estão limpos (evita a normalização)
+
+    Returns:
+        Lista de booleanos na mesma ordem da entrada
+    """
+    values = [clean_cnpj(c) for c in cnpjs] if clean else list(cnpjs)
+
+    if np is None or not values:
+        return [validate_cnpj(c) for c in values]
+
+    return _validate_vectorized(values).tolist()
+
+
+def _validate_vectorized(values: List[str]):
+    # Uma posição extra detecta entradas com mais de 14 caracteres
+    codes = np.array(values, dtype=f'U{CNPJ_LENGTH + 1}').view(np.uint32).reshape(len(values), CNPJ_LENGTH + 1)
+    chars = codes[:, :CNPJ_LENGTH].astype(np.int64)
+
+    base, digits = chars[:, :12], chars[:, 12:]
+    valid = codes[:, CNPJ_LENGTH] == 0
+    valid &= (((base >= 48) & (base <= 57)) | ((base >= 65) & (base <= 90))).all(axis=1)
+    valid &= ((digits >= 48) & (digits <= 57)).all(axis=1)
+    valid &= ~(chars == chars[:, :1]).all(axis=1)
+
+    numbers = chars - 48
+    first = (numbers[:, :12] @ np.array(FIRST_DIGIT_WEIGHTS)) % 11
+    first = np.where(first < 2, 0, 11 - first)
+    second = (numbers[:, :13] @ np.array(SECOND_DIGIT_WEIGHTS)) % 11
+    second = np.where(second < 2, 0, 11 - second)
+
+    valid &= (numbers[:, 12] == first) & (numbers[:, 13] == second)
+    return valid
@@ -0,0 +1,166 @@
+"""
+Histórico versionado (change-data capture) dos dados do CNPJ
+
+Cada atualização com conteúdo diferente gera uma versão contendo apenas os
+campos alterados; a cada SNAPSHOT_INTERVAL versões é gravado o estado
+completo, de modo que reconstruir qualquer versão aplica no máximo
+SNAPSHOT_INTERVAL - 1 diffs.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from django.utils import timezone
+
+from .models import CNPJData, CNPJDataVersion, CNPJDataChange
+from .parsed import ParsedCompany
+
+SNAPSHOT_INTERVAL = 10
+
+# Campos de lista indexados como adições/remoções em vez de valor completo
+LIST_FIELDS = ('members', 'side_activities')
+
+
+def build_snapshot(parsed_data: ParsedCompany) -> Dict:
+    """Extrai a forma compacta e canônica dos dados versionados"""
+    members = sorted(
+        (
+            {'name': m.name, 'tax_id': m.tax_id, 'role': m.role, 'since': m.since}
+            for m in parsed_data.members
+        ),
+        key=lambda m: (m['name'], m['role'])
+    )
+    side_activities = sorted(a.id or '' for a in parsed_data.side_activities)
+    equity = parsed_data.equity
+
+    return {
+        'company_name': parsed_data.company_name,
+        'status': parsed_data.status,
+        'founded_date': parsed_data.founded_date,
+        'equity': float(equity) if equity is not None else None,
+        'main_activity': parsed_data.main_activity,
+        'city': parsed_data.city,
+        'state': parsed_data.state,
+        'zip_code': parsed_data.zip_code,
+        'nature': parsed_data.nature,
+        'size': parsed_data.size,
+        'members': members,
+        'side_activities': side_activities
+    }
+
+
+def diff_snapshots(old: Dict, new: Dict) -> Dict:
+    """Diff compacto: {'set': campos novos/alterados, 'unset': campos removidos}"""
+    diff = {
+        'set': {key: value for key, value in new.items() if old.get(key) != value or key not in old},
+        'unset': [key for key in old if key not in new]
+    }
+    return diff
+
+
+def apply_diff(state: Dict, diff: Dict) -> Dict:
+    """Aplica um diff sobre um estado (sem alterar o original)"""
+    state = dict(state)
+    state.update(diff.get('set', {}))
+    for key in diff.get('unset', []):
+        state.pop(key, None)
+    return state
+
+
+def rebuild_version(cnpj_data: CNPJData, version: Optional[int] = None) -> Optional[Tuple[int, Dict]]:
+    """
+    Reconstrói o estado de uma versão (ou da mais recente)
+
+    Lê apenas o último snapshot até a versão pedida e os diffs seguintes.
+
+    Returns:
+        (número da versão, estado) ou None se não houver histórico
+    """
+    versions = CNPJDataVersion.objects.filter(cnpj_data=cnpj_data)
+    if version is not None:
+        versions = versions.filter(version__lte=version)
+
+    base = versions.filter(is_snapshot=True).order_by('-version').values_list('version', flat=True).first()
+    if base is None:
+        return None
+
+    state: Dict = {}
+    current = base
+    for number, is_snapshot, data in versions.filter(version__gte=base).order_by('version').values_list(
+        'version', 'is_snapshot', 'data'
+    ):
+        state = dict(data) if is_snapshot else apply_diff(state, data)
+        current = number
+
+    return current, state
+
+
+def _index_changes(old: Dict, diff: Dict) -> List[Tuple[str, object, object]]:
+    changes = []
+    for field, new_value in diff['set'].items():
+        old_value = old.get(field)
+        if field in LIST_FIELDS:
+            old_items = {_list_key(item) for item in old_value or []}
+            new_items = {_list_key(item) for item in new_value or []}
+            changes.append((field, sorted(old_items - new_items), sorted(new_items - old_items)))
+        else:
+            changes.append((field, old_value, new_value))
+    for field in diff['unset']:
+        changes.append((field, old.get(field), None))
+    return changes
+
+
+def _list_key(item) -> str:
+    if isinstance(item, dict):
+        return f"{item.get('name', '')} ({item.get('role', '')})"
+    return str(item)
+
+
+def record_version(cnpj_data: CNPJData, parsed_data: ParsedCompany, content_hash: str) -> Optional[CNPJDataVersion]:
+    """
+    Registra nova versão se os dados versionados mudaram
+
+    Para listas (membros, atividades) o índice de alterações guarda o que
+    saiu em old_value e o que entrou em new_value.
+
+    Returns:
+        A versão criada ou None se nada mudou
+    """
+    snapshot = build_snapshot(parsed_data)
+    latest = rebuild_version(cnpj_data)
+
+    if latest is None:
+        number, old = 0, {}
+    else:
+        number, old = latest
+        if old == snapshot:
+            return None
+
+    number += 1
+    is_snapshot = latest is None or number % SNAPSHOT_INTERVAL == 1
+    diff = diff_snapshots(old, snapshot)
+    now = timezone.now()
+
+    version = CNPJDataVersion.objects.create(
+        cnpj_data=cnpj_data,
+        version=number,
+        content_hash=content_hash,
+        is_snapshot=is_snapshot,
+        data=snapshot if is_snapshot else diff,
+        changed_fields=sorted(diff['set']) + sorted(diff['unset']),
+        created_at=now
+    )
+
+    if latest is not None:
+        CNPJDataChange.objects.bulk_create([
+            CNPJDataChange(
+                version=version,
+                cnpj_data=cnpj_data,
+                field=field,
+                old_value=old_value,
+                new_value=new_value,
+                changed_at=now
+            )
+            for field, old_value, new_value in _index_changes(old, diff)
+        ])
+
+    return version
@@ -1,19 +1,114 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.db import models
+from django.core.handlers.asgi import ASGIRequest
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time
 import json
 import logging
+from time import perf_counter
 
-from .models import CNPJData, AnalysisResult, AnalysisCriteria
+from .models import (
+    CNPJData, AnalysisResult, BatchJob, BatchItem, CNPJDataVersion, CNPJDataChange,
+    CompanyActivity, Member, WebhookEvent, WebhookSubscription
+)
 from .engines import CNPJAnalysisEngine
+from .caching import (
+    cached_body, conditional_json, detail_etag, detail_key, history_etag, history_generation, history_key
+)
+from .exports import stream_csv, stream_ndjson
+from .batch import BatchFileError, create_batch_job, start_batch_job
+from .validators import clean_cnpj, validate_cnpj_batch
+from .versioning import rebuild_version
+from .graph import get_partner_graph
+from .simulation import PolicyConfig, get_portfolio_snapshot, simulate
+from .streams import BatchProgress, aanalysis_events, abatch_events, analysis_events, batch_events, parse_event_id
+from .webhooks import WebhookURLError, check_webhook_url, generate_secret
+from .apikeys import (
+    api_key_required, month_start, month_usage, record_analysis, remaining_quota, request_key_id,
+    staff_or_api_key_required
+)
+from cnpj_analyzer.routers import read_from_replica, writes_to_primary
 
 logger = logging.getLogger('analysis')
 
 
+def filter_analyses(queryset, params):
+    """Aplica os filtros de histórico (status, risco, UF, CNPJ e período)"""
+    status = params.get('status', '').strip().upper()
+    if status:
+        queryset = queryset.filter(status=status)
+
+    risk_level = params.get('risk_level', '').strip()
+    if risk_level:
+        queryset = queryset.filter(risk_level__iexact=risk_level)
+
+    state = params.get('state', '').strip().upper()
+    if state:
+        queryset = queryset.filter(cnpj_data__state=state)
+
+    cnpj = params.get('cnpj', '').strip()
+    if cnpj:
+        queryset = queryset.filter(cnpj_data__cnpj__startswith=clean_cnpj(cnpj))
+
+    for param, lookup in (('date_from', 'analysis_date__date__gte'), ('date_to', 'analysis_date__date__lte')):
+        value = params.get(param, '').strip()
+        if value:
+            parsed = parse_date(value)
+            if parsed is None:
+                raise ValueError(f'Data inválida: {value}')
+            queryset = queryset.filter(**{lookup: parsed})
+
+    return queryset
+
+
+def parse_flag(value) -> bool:
+    """Interpreta uma flag vinda de JSON, formulário ou query string"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'sim', 'yes')
+    return bool(value)
+
+
+def parse_force(data: dict, request) -> bool:
+    """Lê a flag force do corpo JSON ou da query string"""
+    return parse_flag(data.get('force', request.GET.get('force', False)))
+
+
+def serialize_analysis(result: dict) -> dict:
+    """Serializa o resultado de CNPJAnalysisEngine.analyze_cnpj"""
+    return {
+        'success': True,
+        'data': {
+            'analysis_id': result['analysis_result'].id,
+            'cnpj': result['cnpj_data'].cnpj,
+            'company_name': result['cnpj_data'].company_name,
+            'overall_score': result['overall_score'],
+            'status': result['status'],
+            'risk_level': result['risk_level'],
+            'processing_time': result['processing_time'],
+            'analysis_date': result['analysis_result'].analysis_date.isoformat(),
+            'reused': result['reused'],
+            'criteria': [
+                {
+                    'name': c['name'],
+                    'description': c['description'],
+                    'score': c['score'],
+                    'weight': c['weight'],
+                    'passed': c['passed']
+                }
+                for c in result['criteria']
+            ]
+        }
+    }
+
+
 class CNPJAnalysisView(View):
     """View principal para análise de CNPJ"""
     
@@ -35,30 +130,10 @@ class CNPJAnalysisView(View):
             
             # Executa análise
             engine = CNPJAnalysisEngine()
-            result = engine.analyze_cnpj(cnpj)
+            result = engine.analyze_cnpj(cnpj, force=parse_force(data, request))
             
             if result['success']:
-                return JsonResponse({
-                    'success': True,
-                    'data': {
-                        'cnpj': result['cnpj_data'].cnpj,
-                        'company_name': result['cnpj_data'].company_name,
-                        'overall_score': result['overall_score'],
-                        'status': result['status'],
-                        'risk_level': result['risk_level'],
-                        'processing_time': result['processing_time'],
-                        'criteria': [
-                            {
-                                'name': c['name'],
-                                'description': c['description'],
-                                'score': c['score'],
-                                'weight': c['weight'],
-                                'passed': c['passed']
-                            }
-                            for c in result['criteria']
-                        ]
-                    }
-                })
+                return JsonResponse(serialize_analysis(result))
             else:
                 return JsonResponse({
                     'success': False,
@@ -78,13 +153,32 @@ class CNPJAnalysisView(View):
             }, status=500)
 
 
+@method_decorator(read_from_replica, name='dispatch')
 class AnalysisHistoryView(View):
     """View para histórico de análises"""
     
     def get(self, request):
-        """Lista análises realizadas"""
-        analyses = AnalysisResult.objects.select_related('cnpj_data').prefetch_related('criteria').order_by('-analysis_date')[:50]
+        """Lista análises realizadas (em cache até a próxima análise gravada)"""
+        try:
+            analyses = filter_analyses(
+                AnalysisResult.objects.select_related('cnpj_data').prefetch_related('criteria'),
+                request.GET
+            ).order_by('-analysis_date')[:50]
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Data inválida (use AAAA-MM-DD)'
+            }, status=400)
+        
+        # O banco de origem entra na chave: réplica atrasada não contamina o primário
+        key = history_key(history_generation(analyses.db), analyses.db, request.GET.urlencode())
+        
+        def load_body():
+            return cached_body(key, lambda: self.render(analyses), settings.ANALYSIS_HISTORY_CACHE_TIMEOUT)
         
+        return conditional_json(request, history_etag(key), load_body)
+    
+    def render(self, analyses) -> bytes:
         data = []
         for analysis in analyses:
             data.append({
@@ -98,34 +192,47 @@ class AnalysisHistoryView(View):
                 'processing_time': analysis.processing_time
             })
         
-        return JsonResponse({
+        return json.dumps({
             'success': True,
             'data': data
-        })
+        }, cls=DjangoJSONEncoder).encode('utf-8')
 
 
+@method_decorator(read_from_replica, name='dispatch')
 class AnalysisDetailView(View):
     """View para detalhes de uma análise específica"""
     
     def get(self, request, analysis_id):
-        """Retorna detalhes de uma análise"""
+        """Retorna detalhes de uma análise (cache por id e analysis_date, com GET condicional)"""
+        analysis_date = get_object_or_404(
+            AnalysisResult.objects.only('analysis_date'), id=analysis_id
+        ).analysis_date
+        
+        def load_body():
+            return cached_body(
+                detail_key(analysis_id, analysis_date),
+                lambda: self.render(analysis_id),
+                settings.ANALYSIS_CACHE_TIMEOUT
+            )
+        
+        return conditional_json(
+            request,
+            detail_etag(analysis_id, analysis_date),
+            load_body,
+            last_modified=analysis_date,
+            max_age=settings.ANALYSIS_HTTP_MAX_AGE
+        )
+    
+    def render(self, analysis_id) -> bytes:
         analysis = get_object_or_404(
             AnalysisResult.objects.select_related('cnpj_data').prefetch_related('criteria'),
             id=analysis_id
         )
         
-        criteria_data = []
-        for criteria in analysis.criteria.all():
-            criteria_data.append({
-                'name': criteria.criteria_name,
-                'description': criteria.criteria_description,
-                'score': criteria.score,
-                'weight': criteria.weight,
-                'passed': criteria.passed,
-                'details': criteria.details
-            })
+        # Critérios gravados no modo só score têm a explicação gerada aqui (o corpo fica em cache)
+        criteria_data = CNPJAnalysisEngine().explain_criteria(analysis, list(analysis.criteria.all()))
         
-        return JsonResponse({
+        return json.dumps({
             'success': True,
             'data': {
                 'analysis_id': analysis.id,
@@ -148,9 +255,549 @@ class AnalysisDetailView(View):
                 },
                 'criteria': criteria_data
             }
+        }, cls=DjangoJSONEncoder).encode('utf-8')
+
+
+@method_decorator(read_from_replica, name='dispatch')
+class AnalysisExportView(View):
+    """View para exportação em massa das análises"""
+
+    formats = {
+        'csv': (stream_csv, 'text/csv; charset=utf-8', 'csv'),
+        'ndjson': (stream_ndjson, 'application/x-ndjson', 'ndjson'),
+    }
+
+    def get(self, request):
+        """Exporta análises filtradas em CSV ou NDJSON via streaming"""
+        export_format = request.GET.get('format', 'csv').strip().lower()
+
+        if export_format not in self.formats:
+            return JsonResponse({
+                'success': False,
+                'error': 'Formato inválido (use csv ou ndjson)'
+            }, status=400)
+
+        try:
+            queryset = filter_analyses(AnalysisResult.objects.all(), request.GET).order_by('-analysis_date')
+        except ValueError:
+            return JsonResponse({
+                'success': False,
+                'error': 'Data inválida (use AAAA-MM-DD)'
+            }, status=400)
+
+        generator, content_type, extension = self.formats[export_format]
+        criteria_names = list(CNPJAnalysisEngine().criteria_weights)
+
+        response = StreamingHttpResponse(generator(queryset, criteria_names), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="analises.{extension}"'
+        return response
+
+
+def serialize_batch_job(job: BatchJob) -> dict:
+    """Serializa o progresso de um lote"""
+    return {
+        'job_id': job.id,
+        'file_name': job.file_name,
+        'status': job.status,
+        'progress': job.progress,
+        'total_items': job.total_items,
+        'invalid_items': job.invalid_items,
+        'duplicate_items': job.duplicate_items,
+        'skipped_items': job.skipped_items,
+        'processed_items': job.processed_items,
+        'failed_items': job.failed_items,
+        'error': job.error,
+        'evaluation_date': job.evaluation_date.isoformat() if job.evaluation_date else None,
+        'score_only': job.score_only,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def serialize_batch_item(item: BatchItem) -> dict:
+    """Serializa um item de lote (com o resumo da análise, se houver)"""
+    analysis = item.analysis_result
+    return {
+        'id': item.id,
+        'cnpj': item.cnpj,
+        'status': item.status,
+        'error': item.error,
+        'attempts': item.attempts,
+        'updated_at': item.updated_at.isoformat(),
+        'analysis': {
+            'analysis_id': analysis.id,
+            'overall_score': analysis.overall_score,
+            'risk_level': analysis.risk_level,
+            'status': analysis.status
+        } if analysis else None
+    }
+
+
+def batch_jobs_for(request):
+    """Lotes visíveis na requisição: com chave de API, só os enviados por ela"""
+    if request.api_key is None:
+        return BatchJob.objects.all()
+    return BatchJob.objects.filter(api_key_id=request.api_key['id'])
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+@method_decorator(api_key_required, name='dispatch')
+class BatchUploadView(View):
+    """View para envio de lotes de CNPJs por arquivo CSV/XLSX"""
+
+    def post(self, request):
+        """
+        Recebe o arquivo, cria o lote e inicia o processamento
+
+        Com chave de API, cada item processado conta no consumo dela; o lote
+        é recusado se os itens a consultar excedem o que resta da cota mensal.
+        """
+        uploaded_file = request.FILES.get('file')
+
+        if not uploaded_file:
+            return JsonResponse({
+                'success': False,
+                'error': 'Arquivo é obrigatório (campo "file")'
+            }, status=400)
+
+        try:
+            job = create_batch_job(
+                uploaded_file,
+                score_only=parse_flag(request.POST.get('score_only')),
+                api_key_id=request.api_key['id'] if request.api_key else None
+            )
+        except BatchFileError as e:
+            return JsonResponse({
+                'success': False,
+                'error': str(e)
+            }, status=400)
+        except Exception as e:
+            logger.error(f"Erro no upload de lote: {str(e)}")
+            return JsonResponse({
+                'success': False,
+                'error': 'Erro interno do servidor'
+            }, status=500)
+
+        remaining = remaining_quota(request.api_key)
+        pending = job.total_items - job.skipped_items
+        if remaining is not None and pending > remaining:
+            job.status = 'FAILED'
+            job.error = f'Cota mensal insuficiente: {pending} CNPJs a consultar, {remaining} restantes'
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'error', 'finished_at'])
+            return JsonResponse({
+                'success': False,
+                'error': job.error,
+                'data': serialize_batch_job(job)
+            }, status=429)
+
+        start_batch_job(job)
+        job.refresh_from_db()
+
+        return JsonResponse({
+            'success': True,
+            'data': serialize_batch_job(job)
+        }, status=202)
+
+
+@method_decorator(api_key_required, name='dispatch')
+class BatchJobView(View):
+    """View para acompanhamento do progresso de um lote"""
+
+    def get(self, request, job_id):
+        """Retorna contadores e percentual de progresso do lote"""
+        job = get_object_or_404(batch_jobs_for(request), id=job_id)
+
+        return JsonResponse({
+            'success': True,
+            'data': serialize_batch_job(job)
+        })
+
+
+@method_decorator(api_key_required, name='dispatch')
+class BatchItemsView(View):
+    """View para os resultados de um lote, página a página"""
+
+    max_limit = 1000
+
+    def get(self, request, job_id):
+        """
+        Lista os itens do lote em ordem de id, com paginação por cursor
+
+        ?after=<id do último item da página anterior>&limit=N&status=DONE
+        """
+        job = get_object_or_404(batch_jobs_for(request), id=job_id)
+
+        try:
+            after = int(request.GET.get('after', 0))
+            limit = int(request.GET.get('limit', 100))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= self.max_limit:
+            return JsonResponse({
+                'success': False,
+                'error': f'Parâmetros inválidos (limit entre 1 e {self.max_limit}, after inteiro)'
+            }, status=400)
+
+        items = BatchItem.objects.filter(job=job, id__gt=after)
+        status = request.GET.get('status', '').strip().upper()
+        if status:
+            items = items.filter(status=status)
+
+        items = list(
+            items.select_related('analysis_result').order_by('id').only(
+                'id', 'cnpj', 'status', 'error', 'attempts', 'updated_at',
+                'analysis_result__id', 'analysis_result__overall_score', 'analysis_result__risk_level',
+                'analysis_result__status'
+            )[:limit + 1]
+        )
+        has_more = len(items) > limit
+        items = items[:limit]
+
+        return JsonResponse({
+            'success': True,
+            'data': [serialize_batch_item(item) for item in items],
+            'job': serialize_batch_job(job),
+            'next_after': items[-1].id if has_more else None
+        })
+
+
+def serialize_webhook(subscription: WebhookSubscription) -> dict:
+    """Serializa uma assinatura de webhook (sem o segredo)"""
+    return {
+        'id': subscription.id,
+        'url': subscription.url,
+        'description': subscription.description,
+        'is_active': subscription.is_active,
+        'created_at': subscription.created_at.isoformat()
+    }
+
+
+def webhooks_for(request):
+    """Assinaturas visíveis na requisição: com chave de API, só as dela; a equipe vê todas"""
+    if request.api_key is None:
+        return WebhookSubscription.objects.all()
+    return WebhookSubscription.objects.filter(api_key_id=request.api_key['id'])
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+@method_decorator(staff_or_api_key_required, name='dispatch')
+class WebhookSubscriptionsView(View):
+    """View para cadastro de endpoints de webhook (chave de API ou usuário da equipe)"""
+
+    def get(self, request):
+        """Lista as assinaturas"""
+        return JsonResponse({
+            'success': True,
+            'data': [serialize_webhook(s) for s in webhooks_for(request)]
+        })
+
+    def post(self, request):
+        """Cadastra um endpoint; o segredo das assinaturas só é devolvido aqui"""
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({
+                'success': False,
+                'error': 'JSON inválido'
+            }, status=400)
+
+        url = str(data.get('url', '')).strip()
+        try:
+            check_webhook_url(url)
+        except WebhookURLError as e:
+            return JsonResponse({
+                'success': False,
+                'error': str(e)
+            }, status=400)
+
+        subscription = WebhookSubscription.objects.create(
+            url=url,
+            secret=generate_secret(),
+            description=str(data.get('description', ''))[:255],
+            api_key_id=request.api_key['id'] if request.api_key else None
+        )
+        response = serialize_webhook(subscription)
+        response['secret'] = subscription.secret
+
+        return JsonResponse({
+            'success': True,
+            'data': response
+        }, status=201)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+@method_decorator(staff_or_api_key_required, name='dispatch')
+class WebhookSubscriptionView(View):
+    """View para uma assinatura de webhook e a situação das entregas"""
+
+    def get(self, request, subscription_id):
+        """Retorna a assinatura com os eventos por status"""
+        subscription = get_object_or_404(webhooks_for(request), id=subscription_id)
+        counts = dict(subscription.events.values_list('status').annotate(total=models.Count('id')))
+
+        response = serialize_webhook(subscription)
+        response['events'] = {status: counts.get(status, 0) for status, _ in WebhookEvent.STATUS_CHOICES}
+        return JsonResponse({
+            'success': True,
+            'data': response
+        })
+
+    def delete(self, request, subscription_id):
+        """Remove a assinatura e os eventos ainda não entregues"""
+        subscription = get_object_or_404(webhooks_for(request), id=subscription_id)
+        subscription.delete()
+        return JsonResponse({'success': True})
+
+
+def parse_moment(value: str):
+    """Converte data (AAAA-MM-DD) ou data/hora ISO em datetime com fuso"""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Data inválida: {value}')
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class CNPJVersionsView(View):
+    """View para o histórico versionado dos dados de um CNPJ"""
+
+    def get(self, request, cnpj):
+        """Lista as versões ou reconstrói uma versão específica (?version=N)"""
+        cnpj_data = get_object_or_404(CNPJData, cnpj=clean_cnpj(cnpj))
+        version = request.GET.get('version', '').strip()
+
+        if version:
+            if not version.isdigit():
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Versão inválida'
+                }, status=400)
+
+            rebuilt = rebuild_version(cnpj_data, int(version))
+            if rebuilt is None or rebuilt[0] != int(version):
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Versão não encontrada'
+                }, status=404)
+
+            return JsonResponse({
+                'success': True,
+                'data': {
+                    'cnpj': cnpj_data.cnpj,
+                    'version': rebuilt[0],
+                    'state': rebuilt[1]
+                }
+            })
+
+        versions = CNPJDataVersion.objects.filter(cnpj_data=cnpj_data).order_by('-version').values(
+            'version', 'content_hash', 'changed_fields', 'created_at'
+        )
+
+        return JsonResponse({
+            'success': True,
+            'data': [
+                {**item, 'created_at': item['created_at'].isoformat()}
+                for item in versions
+            ]
         })
 
 
+class CNPJChangesView(View):
+    """View para alterações de dados em um período (status, capital, sócios...)"""
+
+    max_results = 500
+
+    def get(self, request):
+        """Lista alterações entre since e until, opcionalmente filtradas por campo"""
+        since = request.GET.get('since', '').strip()
+        until = request.GET.get('until', '').strip()
+
+        if not since:
+            return JsonResponse({
+                'success': False,
+                'error': 'Parâmetro since é obrigatório'
+            }, status=400)
+
+        try:
+            since = parse_moment(since)
+            until = parse_moment(until) if until else None
+        except ValueError as e:
+            return JsonResponse({
+                'success': False,
+                'error': str(e)
+            }, status=400)
+
+        changes = CNPJDataChange.objects.filter(changed_at__gte=since)
+        if until is not None:
+            changes = changes.filter(changed_at__lte=until)
+
+        fields = [f.strip() for f in request.GET.getlist('field') if f.strip()]
+        if fields:
+            changes = changes.filter(field__in=fields)
+
+        changes = changes.order_by('-changed_at').values(
+            'cnpj_data__cnpj', 'version__version', 'field', 'old_value', 'new_value', 'changed_at'
+        )[:self.max_results]
+
+        return JsonResponse({
+            'success': True,
+            'data': [
+                {
+                    'cnpj': item['cnpj_data__cnpj'],
+                    'version': item['version__version'],
+                    'field': item['field'],
+                    'old_value': item['old_value'],
+                    'new_value': item['new_value'],
+                    'changed_at': item['changed_at'].isoformat()
+                }
+                for item in changes
+            ]
+        })
+
+
+def serialize_company(cnpj_data: CNPJData) -> dict:
+    """Resumo de empresa usado nas consultas por atividade e por sócio"""
+    return {
+        'cnpj': cnpj_data.cnpj,
+        'company_name': cnpj_data.company_name,
+        'status': cnpj_data.status,
+        'city': cnpj_data.city,
+        'state': cnpj_data.state
+    }
+
+
+class ActivityCompaniesView(View):
+    """View para empresas por atividade econômica (CNAE)"""
+
+    max_results = 100
+
+    def get(self, request, code):
+        """Lista empresas com o CNAE informado (prefixo; ex.: 8532-5)"""
+        code = ''.join(filter(str.isdigit, code))
+        if not code:
+            return JsonResponse({
+                'success': False,
+                'error': 'Código CNAE inválido'
+            }, status=400)
+
+        links = CompanyActivity.objects.filter(activity__code__startswith=code)
+        if request.GET.get('main_only', '').lower() in ('1', 'true'):
+            links = links.filter(is_main=True)
+
+        links = links.select_related('cnpj_data', 'activity').order_by('cnpj_data__cnpj')[:self.max_results]
+
+        return JsonResponse({
+            'success': True,
+            'data': [
+                {
+                    **serialize_company(link.cnpj_data),
+                    'activity_code': link.activity.code,
+                    'activity_text': link.activity.text,
+                    'is_main': link.is_main
+                }
+                for link in links
+            ]
+        })
+
+
+def normalize_member_tax_id(tax_id: str) -> str:
+    """CPF completo vira o formato mascarado da API (***999999**); CNPJ é mantido"""
+    tax_id = tax_id.strip()
+    digits = ''.join(filter(str.isdigit, tax_id))
+    if len(digits) == 11 and '*' not in tax_id:
+        return f'***{digits[3:9]}**'
+    if '*' in tax_id:
+        return tax_id
+    return clean_cnpj(tax_id)
+
+
+class MemberSearchView(View):
+    """View para busca de empresas por sócio (CPF/CNPJ ou nome)"""
+
+    max_results = 100
+
+    def get(self, request):
+        """Lista participações societárias por tax_id ou prefixo do nome"""
+        tax_id = request.GET.get('tax_id', '').strip()
+        name = request.GET.get('name', '').strip()
+
+        if not tax_id and not name:
+            return JsonResponse({
+                'success': False,
+                'error': 'Informe tax_id ou name'
+            }, status=400)
+
+        members = Member.objects.select_related('cnpj_data')
+        if tax_id:
+            members = members.filter(tax_id=normalize_member_tax_id(tax_id))
+        if name:
+            members = members.filter(name__startswith=name.upper())
+        if request.GET.get('administrator', '').lower() in ('1', 'true'):
+            members = members.filter(is_administrator=True)
+
+        members = members.order_by('name', 'cnpj_data__cnpj')[:self.max_results]
+
+        return JsonResponse({
+            'success': True,
+            'data': [
+                {
+                    **serialize_company(member.cnpj_data),
+                    'member_name': member.name,
+                    'member_tax_id': member.tax_id,
+                    'role': member.role,
+                    'is_administrator': member.is_administrator,
+                    'since': member.since.isoformat() if member.since else None
+                }
+                for member in members
+            ]
+        })
+
+
+class RelatedCompaniesView(View):
+    """View para empresas ligadas por sócios em comum"""
+
+    max_depth = 4
+
+    def get(self, request, cnpj):
+        """Lista empresas que compartilham sócio com o CNPJ até a profundidade N"""
+        cnpj_data = get_object_or_404(CNPJData, cnpj=clean_cnpj(cnpj))
+
+        try:
+            depth = int(request.GET.get('depth', 1))
+        except ValueError:
+            depth = 0
+        if not 1 <= depth <= self.max_depth:
+            return JsonResponse({
+                'success': False,
+                'error': f'Profundidade deve estar entre 1 e {self.max_depth}'
+            }, status=400)
+
+        related = get_partner_graph().related(cnpj_data.id, depth=depth)
+        companies = CNPJData.objects.filter(id__in=related).select_related('analysis')
+
+        data = []
+        for company in companies:
+            analysis = getattr(company, 'analysis', None)
+            data.append({
+                **serialize_company(company),
+                'distance': related[company.id],
+                'analysis_status': analysis.status if analysis else None
+            })
+        data.sort(key=lambda item: (item['distance'], item['cnpj']))
+
+        return JsonResponse({
+            'success': True,
+            'data': data
+        })
+
+
+@method_decorator(read_from_replica, name='dispatch')
 class CNPJSearchView(View):
     """View para busca de CNPJs"""
     
@@ -190,6 +837,7 @@ class CNPJSearchView(View):
 
 @csrf_exempt
 @require_http_methods(["POST"])
+@api_key_required
 def analyze_cnpj_api(request):
     """API endpoint para análise de CNPJ"""
     try:
@@ -202,33 +850,12 @@ def analyze_cnpj_api(request):
                 'error': 'CNPJ é obrigatório'
             }, status=400)
         
-        engine = CNPJAnalysisEngine()
-        result = engine.analyze_cnpj(cnpj)
+        engine = CNPJAnalysisEngine(api_key_id=request_key_id(request))
+        result = engine.analyze_cnpj(cnpj, force=parse_force(data, request))
+        record_analysis(request, result)
         
         if result['success']:
-            # Serializa os dados corretamente
-            serialized_result = {
-                'success': True,
-                'data': {
-                    'cnpj': result['cnpj_data'].cnpj,
-                    'company_name': result['cnpj_data'].company_name,
-                    'overall_score': result['overall_score'],
-                    'status': result['status'],
-                    'risk_level': result['risk_level'],
-                    'processing_time': result['processing_time'],
-                    'criteria': [
-                        {
-                            'name': c['name'],
-                            'description': c['description'],
-                            'score': c['score'],
-                            'weight': c['weight'],
-                            'passed': c['passed']
-                        }
-                        for c in result['criteria']
-                    ]
-                }
-            }
-            return JsonResponse(serialized_result)
+            return JsonResponse(serialize_analysis(result))
         else:
             return JsonResponse(result)
         
@@ -245,6 +872,192 @@ def analyze_cnpj_api(request):
         }, status=500)
 
 
+def event_stream(events) -> StreamingHttpResponse:
+    """Resposta SSE (sem buffer em proxies como o nginx)"""
+    response = StreamingHttpResponse(events, content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def is_asgi(request) -> bool:
+    """Sob ASGI os fluxos usam geradores assíncronos; sob WSGI, síncronos"""
+    return isinstance(request, ASGIRequest)
+
+
+@writes_to_primary
+@api_key_required(allow_query=True)
+def analyze_stream_api(request):
+    """
+    SSE com as etapas de uma análise: ?cnpj=...&force=true
+    
+    Eventos: stage, company, criterion (um por critério) e, ao final, result
+    (mesmo formato de /api/analyze/) ou error.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'error': 'Método não permitido'}, status=405)
+    
+    cnpj = request.GET.get('cnpj', '').strip()
+    if not cnpj:
+        return JsonResponse({
+            'success': False,
+            'error': 'CNPJ é obrigatório'
+        }, status=400)
+    force = parse_force({}, request)
+    
+    def run(on_progress):
+        result = CNPJAnalysisEngine(api_key_id=request_key_id(request)).analyze_cnpj(
+            cnpj, force=force, on_progress=on_progress
+        )
+        record_analysis(request, result)
+        if result['success']:
+            return 'result', serialize_analysis(result)['data']
+        return 'error', {'error': result['error']}
+    
+    events = aanalysis_events(run) if is_asgi(request) else analysis_events(run)
+    return event_stream(events)
+
+
+@api_key_required(allow_query=True)
+def batch_stream_api(request, job_id):
+    """
+    SSE com o progresso de um lote: item (um por CNPJ finalizado), progress e done
+    
+    Por padrão transmite os itens finalizados a partir da conexão; ?since=<ISO>
+    ou o cabeçalho Last-Event-ID (reconexão) retomam de um instante anterior.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'success': False, 'error': 'Método não permitido'}, status=405)
+    
+    if not batch_jobs_for(request).filter(id=job_id).exists():
+        return JsonResponse({'success': False, 'error': 'Lote não encontrado'}, status=404)
+    
+    since = None
+    cursor = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    if cursor:
+        since = parse_event_id(cursor)
+        if since is None:
+            return JsonResponse({
+                'success': False,
+                'error': 'Cursor inválido (use data e hora ISO 8601 com fuso)'
+            }, status=400)
+    
+    progress = BatchProgress(job_id, serialize_batch_job, serialize_batch_item, since)
+    events = abatch_events(progress) if is_asgi(request) else batch_events(progress)
+    return event_stream(events)
+
+
+@require_http_methods(["GET"])
+@api_key_required
+def api_usage(request):
+    """Consumo do mês corrente da chave enviada (reaproveitadas x consultas à API)"""
+    if request.api_key is None:
+        return JsonResponse({
+            'success': False,
+            'error': 'Envie a chave de API para consultar o consumo'
+        }, status=400)
+    
+    api_key = request.api_key
+    usage = month_usage(api_key['id'])
+    total = sum(usage.values())
+    return JsonResponse({
+        'success': True,
+        'data': {
+            'name': api_key['name'],
+            'month': month_start().strftime('%Y-%m'),
+            'cached_requests': usage['cached'],
+            'upstream_requests': usage['upstream'],
+            'total_requests': total,
+            'monthly_quota': api_key['monthly_quota'],
+            'remaining': remaining_quota(api_key)
+        }
+    })
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def simulate_policy_api(request):
+    """API endpoint para simular pesos/limiares sobre a carteira (não grava nada)"""
+    try:
+        data = json.loads(request.body or b'{}')
+        config = PolicyConfig.from_dict(data)
+        sample = int(data.get('sample', 20))
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'JSON inválido'
+        }, status=400)
+    except (TypeError, ValueError) as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+
+    try:
+        started = perf_counter()
+        snapshot = get_portfolio_snapshot()
+        result = simulate(snapshot, config, sample=max(0, min(sample, 1000)))
+    except Exception as e:
+        logger.error(f"Erro na simulação de política: {str(e)}")
+        return JsonResponse({
+            'success': False,
+            'error': 'Erro interno do servidor'
+        }, status=500)
+
+    result['config'] = config.as_dict()
+    result['elapsed_ms'] = round((perf_counter() - started) * 1000, 1)
+    return JsonResponse({
+        'success': True,
+        'data': result
+    })
+
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def validate_cnpj_api(request):
+    """API endpoint para validação local de CNPJs (sem consulta externa)"""
+    try:
+        if request.method == 'GET':
+            cnpjs = request.GET.getlist('cnpj')
+        else:
+            cnpjs = json.loads(request.body).get('cnpjs', [])
+        
+        if not isinstance(cnpjs, list) or not cnpjs:
+            return JsonResponse({
+                'success': False,
+                'error': 'Informe ao menos um CNPJ ("cnpj" na query ou lista "cnpjs" no corpo)'
+            }, status=400)
+        
+        if len(cnpjs) > settings.VALIDATE_MAX_ITEMS:
+            return JsonResponse({
+                'success': False,
+                'error': f'Máximo de {settings.VALIDATE_MAX_ITEMS} CNPJs por requisição'
+            }, status=400)
+        
+        cleaned = [clean_cnpj(cnpj) for cnpj in cnpjs]
+        results = validate_cnpj_batch(cleaned, clean=False)
+        valid_count = sum(results)
+        
+        return JsonResponse({
+            'success': True,
+            'data': {
+                'total': len(results),
+                'valid': valid_count,
+                'invalid': len(results) - valid_count,
+                'results': [
+                    {'input': str(raw), 'cnpj': cnpj, 'valid': ok}
+                    for raw, cnpj, ok in zip(cnpjs, cleaned, results)
+                ]
+            }
+        })
+        
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({
+            'success': False,
+            'error': 'JSON inválido'
+        }, status=400)
+
+
 def health_check(request):
     """Endpoint de health check"""
     return JsonResponse({
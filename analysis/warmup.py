@@ -0,0 +1,142 @@
+"""
+Aquecimento de processos do servidor web antes de receberem tráfego
+
+Sem aquecimento, as primeiras requisições de cada worker pagam a importação
+das views, a montagem da URLconf, a compilação dos templates, a abertura de
+conexões e a construção dos índices em memória (grafo societário, snapshot
+da carteira).
+
+Duas fases:
+
+    preload  estruturas somente leitura, montadas uma vez no master do
+             gunicorn (preload_app) e compartilhadas copy-on-write pelos
+             workers; fecha as conexões abertas (não podem atravessar o fork)
+             e congela o GC para que a coleta não toque nessas páginas
+    worker   recursos de cada processo: conexões com bancos e cache
+
+Ver gunicorn.conf.py. Só deve ser chamado com o Django carregado
+(django.setup() concluído), nunca de dentro de AppConfig.ready().
+"""
+
+import gc
+import logging
+import time
+from typing import Callable, Dict, List, Tuple
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.template.loader import get_template
+from django.urls import get_resolver
+from django.utils import timezone
+
+logger = logging.getLogger('analysis')
+
+PHASES = ('preload', 'worker')
+
+# Templates renderizados pelas views
+TEMPLATES = ('analysis/index.html',)
+
+
+def _load_modules():
+    from . import views  # noqa: F401 - importa engines, simulação, exportação etc.
+    from .services import requests
+    from .validators import np
+
+    requests.load()
+    if np is not None:
+        np.load()
+
+
+def _load_urlconf():
+    resolver = get_resolver()
+    resolver.url_patterns
+    resolver.reverse_dict
+
+
+def _load_templates():
+    for name in TEMPLATES:
+        get_template(name)
+
+
+def _load_criteria():
+    from .engines import CNPJAnalysisEngine, operating_years_boundaries
+
+    CNPJAnalysisEngine()
+    operating_years_boundaries(timezone.localdate())
+
+
+def _load_partner_graph():
+    from .graph import get_partner_graph
+
+    if settings.ANALYSIS_ENABLE_PARTNER_NETWORK:
+        get_partner_graph()
+
+
+def _load_portfolio_snapshot():
+    from .simulation import get_portfolio_snapshot
+
+    get_portfolio_snapshot()
+
+
+def _open_databases():
+    for alias in connections:
+        connections[alias].ensure_connection()
+
+
+def _open_cache():
+    cache.get('analysis:warmup')
+
+
+def _steps(phase: str) -> List[Tuple[str, Callable[[], None]]]:
+    if phase == 'preload':
+        steps = [
+            ('modules', _load_modules),
+            ('urlconf', _load_urlconf),
+            ('templates', _load_templates),
+            ('criteria', _load_criteria),
+        ]
+        if settings.WARMUP_PRELOAD_INDEXES:
+            steps += [('partner_graph', _load_partner_graph), ('portfolio_snapshot', _load_portfolio_snapshot)]
+        return steps
+    return [('databases', _open_databases), ('cache', _open_cache)]
+
+
+def warm_up(phase: str = 'all', freeze: bool = True) -> Dict:
+    """
+    Executa as etapas de aquecimento e retorna o tempo de cada uma (ms)
+
+    Args:
+        phase: 'preload', 'worker' ou 'all' (as duas, para servidores sem fork)
+        freeze: Ao fim do preload, move os objetos já criados para a geração
+            permanente do GC (gc.freeze), preservando o copy-on-write
+    """
+    if not apps.ready:
+        raise RuntimeError('warm_up requer o Django carregado (django.setup())')
+    if phase != 'all' and phase not in PHASES:
+        raise ValueError(f'Fase inválida: {phase} (use {", ".join(PHASES)} ou all)')
+
+    report = {'phase': phase, 'steps': {}}
+    start = time.perf_counter()
+    for current in (PHASES if phase == 'all' else (phase,)):
+        for name, step in _steps(current):
+            started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                # Aquecimento é otimização: falhar aqui não pode impedir a subida do worker
+                logger.warning(f"Warm-up: etapa {name} falhou: {str(e)}")
+                report.setdefault('failed', []).append(name)
+            report['steps'][name] = round((time.perf_counter() - started) * 1000, 2)
+
+        if current == 'preload':
+            if phase == 'preload':
+                connections.close_all()
+            if freeze:
+                gc.collect()
+                gc.freeze()
+
+    report['total_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    logger.info(f"Warm-up ({phase}) concluído em {report['total_ms']} ms: {report['steps']}")
+    return report
@@ -0,0 +1,340 @@
+"""
+Webhooks de análises concluídas (outbox + dispatcher)
+
+analyze_cnpj e o pipeline de lotes só gravam, na mesma transação da
+análise, uma linha de WebhookEvent por assinatura ativa da chave de API que
+pediu a análise (e por assinatura sem dono, da equipe): nenhuma requisição
+HTTP acontece no caminho da análise, e um evento só existe se a análise foi
+confirmada. O dispatcher (comando dispatch_webhooks) reserva os eventos
+vencidos, agrupa por endpoint e envia cada grupo em um único POST assinado:
+
+    POST <url>
+    X-Webhook-Timestamp: 1700000000
+    X-Webhook-Signature: sha256=<HMAC-SHA256(secret, "<timestamp>.<corpo>")>
+
+    {"events": [{"id": 1, "type": "analysis.completed", "created_at": ...,
+                 "data": {...}}, ...]}
+
+Resposta 2xx confirma todos os eventos do POST; qualquer outra resposta (ou
+erro de rede) reagenda o grupo com backoff exponencial até
+WEBHOOK_MAX_ATTEMPTS. A entrega é "pelo menos uma vez": o receptor deve
+descartar ids de eventos já processados.
+
+Endpoints precisam ser https e resolver só para endereços públicos: a URL é
+conferida no cadastro e de novo antes de cada POST (o DNS pode ter mudado),
+e redirecionamentos não são seguidos. Assim o dispatcher não pode ser usado
+para alcançar serviços internos (loopback, rede privada, link-local como o
+metadata da nuvem). WEBHOOK_ALLOW_PRIVATE_HOSTS desliga a conferência, só
+para desenvolvimento.
+"""
+
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import random
+import secrets
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import URLValidator
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .lazy import lazy_import
+from .models import AnalysisResult, WebhookEvent, WebhookSubscription
+
+requests = lazy_import('requests')
+
+logger = logging.getLogger('analysis')
+
+ANALYSIS_COMPLETED = 'analysis.completed'
+
+SIGNATURE_HEADER = 'X-Webhook-Signature'
+TIMESTAMP_HEADER = 'X-Webhook-Timestamp'
+
+
+def generate_secret() -> str:
+    return secrets.token_hex(32)
+
+
+def sign_payload(secret: str, timestamp: int, body: bytes) -> str:
+    """Assinatura enviada em X-Webhook-Signature"""
+    digest = hmac.new(secret.encode('utf-8'), f'{timestamp}.'.encode('ascii') + body, hashlib.sha256)
+    return f'sha256={digest.hexdigest()}'
+
+
+def verify_signature(secret: str, timestamp: str, body: bytes, signature: str, tolerance: int = 300) -> bool:
+    """
+    Confere a assinatura de uma entrega (lado do receptor)
+
+    Rejeita timestamps fora da tolerância (segundos) para impedir a
+    reutilização de requisições capturadas.
+    """
+    try:
+        timestamp = int(timestamp)
+    except (TypeError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    return hmac.compare_digest(sign_payload(secret, timestamp, body), signature or '')
+
+
+class WebhookURLError(ValueError):
+    """URL de endpoint recusada (esquema, formato ou host não público)"""
+
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_webhook_url(url: str):
+    """
+    Confere se o endpoint pode receber webhooks; levanta WebhookURLError se não
+
+    Exige https e que todos os endereços do host sejam públicos. Com
+    WEBHOOK_ALLOW_PRIVATE_HOSTS (desenvolvimento), aceita também http e
+    hosts locais.
+    """
+    allow_private = settings.WEBHOOK_ALLOW_PRIVATE_HOSTS
+    try:
+        URLValidator(schemes=['http', 'https'] if allow_private else ['https'])(url)
+    except ValidationError:
+        raise WebhookURLError('URL inválida (use https://)')
+    if allow_private:
+        return
+
+    parts = urlsplit(url)
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, parts.port or 443,
+                                                                 type=socket.SOCK_STREAM)}
+    except (socket.gaierror, UnicodeError):
+        raise WebhookURLError(f'Host {parts.hostname} não encontrado')
+    if not all(_is_public(address) for address in addresses):
+        raise WebhookURLError(f'Host {parts.hostname} não é público (rede privada, loopback ou link-local)')
+
+
+def enqueue_analysis_completed(analysis_result: AnalysisResult, api_key_id: Optional[int] = None) -> int:
+    """
+    Grava no outbox o evento da análise para cada assinatura ativa interessada
+
+    Assinaturas de uma chave de API recebem só as análises feitas com essa
+    chave (api_key_id); assinaturas sem dono (cadastradas pela equipe)
+    recebem todas. Deve ser chamado dentro da transação que grava a análise.
+    Sem assinaturas o custo é uma consulta.
+    """
+    owners = Q(api_key__isnull=True)
+    if api_key_id is not None:
+        owners |= Q(api_key_id=api_key_id)
+    subscription_ids = list(
+        WebhookSubscription.objects.filter(owners, is_active=True).values_list('id', flat=True)
+    )
+    if not subscription_ids:
+        return 0
+
+    cnpj_data = analysis_result.cnpj_data
+    payload = {
+        'analysis_id': analysis_result.id,
+        'cnpj': cnpj_data.cnpj,
+        'company_name': cnpj_data.company_name,
+        'overall_score': analysis_result.overall_score,
+        'status': analysis_result.status,
+        'risk_level': analysis_result.risk_level,
+        'analysis_date': analysis_result.analysis_date.isoformat()
+    }
+    now = timezone.now()
+    WebhookEvent.objects.bulk_create([
+        WebhookEvent(subscription_id=subscription_id, event_type=ANALYSIS_COMPLETED, payload=payload,
+                     next_attempt_at=now, created_at=now)
+        for subscription_id in subscription_ids
+    ])
+    return len(subscription_ids)
+
+
+def claim_events(limit: int, lease_seconds: int) -> Tuple[str, List[WebhookEvent]]:
+    """
+    Reserva atomicamente os eventos vencidos (mesma estratégia de claim_items)
+
+    Eventos de uma reserva expirada (dispatcher que caiu no meio do envio)
+    voltam a ser elegíveis.
+    """
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    candidates = WebhookEvent.objects.filter(
+        Q(status='PENDING', next_attempt_at__lte=now) | Q(status='SENDING', lease_expires_at__lt=now)
+    ).order_by('next_attempt_at', 'id')
+
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(candidates.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            target = WebhookEvent.objects.filter(id__in=ids)
+        else:
+            target = WebhookEvent.objects.filter(id__in=candidates.values('id')[:limit])
+
+        claimed = target.update(
+            status='SENDING',
+            lease_token=token,
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            attempts=F('attempts') + 1
+        )
+
+    if not claimed:
+        return token, []
+    events = list(WebhookEvent.objects.filter(lease_token=token).select_related('subscription').order_by('id'))
+    return token, events
+
+
+class WebhookDispatcher:
+    """
+    Entrega os eventos do outbox, em lotes por endpoint
+
+    Os POSTs de endpoints diferentes são feitos em paralelo (threads, só
+    HTTP); o resultado de cada um é gravado na thread chamadora. Uma sessão
+    HTTP por dispatcher reaproveita conexões com o mesmo endpoint.
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, claim_size: Optional[int] = None,
+                 max_attempts: Optional[int] = None, timeout: Optional[float] = None,
+                 workers: Optional[int] = None, lease_seconds: Optional[int] = None):
+        self.batch_size = batch_size or settings.WEBHOOK_BATCH_SIZE
+        self.claim_size = claim_size or settings.WEBHOOK_CLAIM_SIZE
+        self.max_attempts = max_attempts or settings.WEBHOOK_MAX_ATTEMPTS
+        self.timeout = timeout or settings.WEBHOOK_TIMEOUT_SECONDS
+        self.workers = workers or settings.WEBHOOK_DISPATCH_WORKERS
+        self.lease_seconds = lease_seconds or settings.WEBHOOK_LEASE_SECONDS
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def backoff(self, attempts: int) -> timedelta:
+        """Espera antes da próxima tentativa: exponencial, com teto e jitter"""
+        delay = min(settings.WEBHOOK_BACKOFF_SECONDS * 2 ** (attempts - 1), settings.WEBHOOK_BACKOFF_MAX_SECONDS)
+        return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+    def dispatch_once(self) -> Dict:
+        """Reserva e envia os eventos vencidos; retorna os contadores"""
+        stats = {'events': 0, 'requests': 0, 'delivered': 0, 'retried': 0, 'failed': 0}
+        token, events = claim_events(self.claim_size, self.lease_seconds)
+        if not events:
+            return stats
+
+        groups: Dict[int, List[WebhookEvent]] = {}
+        for event in events:
+            groups.setdefault(event.subscription_id, []).append(event)
+        batches = [
+            group[i:i + self.batch_size]
+            for group in groups.values()
+            for i in range(0, len(group), self.batch_size)
+        ]
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(batches))) as executor:
+            outcomes = list(executor.map(self._send, batches))
+
+        for batch, error in zip(batches, outcomes):
+            self._record(token, batch, error, stats)
+        stats['events'] = len(events)
+        stats['requests'] = len(batches)
+        logger.info(f"Webhooks: {stats}")
+        return stats
+
+    def _send(self, batch: List[WebhookEvent]) -> Optional[str]:
+        """POST de um lote de eventos para o endpoint; retorna o erro ou None"""
+        subscription = batch[0].subscription
+        body = json.dumps({
+            'events': [
+                {
+                    'id': event.id,
+                    'type': event.event_type,
+                    'created_at': event.created_at,
+                    'data': event.payload
+                }
+                for event in batch
+            ]
+        }, cls=DjangoJSONEncoder, ensure_ascii=False).encode('utf-8')
+        timestamp = int(time.time())
+
+        try:
+            check_webhook_url(subscription.url)
+        except WebhookURLError as e:
+            return f'Endpoint recusado: {str(e)}'
+
+        try:
+            response = self.session.post(
+                subscription.url,
+                data=body,
+                headers={
+                    'Content-Type': 'application/json',
+                    TIMESTAMP_HEADER: str(timestamp),
+                    SIGNATURE_HEADER: sign_payload(subscription.secret, timestamp, body)
+                },
+                timeout=self.timeout,
+                allow_redirects=False
+            )
+        except requests.RequestException as e:
+            return f'Erro de conexão: {str(e)}'
+
+        if 200 <= response.status_code < 300:
+            return None
+        return f'HTTP {response.status_code}: {response.text[:200]}'
+
+    def _record(self, token: str, batch: List[WebhookEvent], error: Optional[str], stats: Dict):
+        """Confirma ou reagenda os eventos de um POST (só os que ainda são desta reserva)"""
+        now = timezone.now()
+        events = WebhookEvent.objects.filter(id__in=[event.id for event in batch], lease_token=token)
+        reset = {'lease_token': '', 'lease_expires_at': None}
+
+        if error is None:
+            events.update(status='DELIVERED', delivered_at=now, last_error='', **reset)
+            stats['delivered'] += len(batch)
+            return
+
+        url = batch[0].subscription.url
+        logger.warning(f"Webhook {url}: entrega de {len(batch)} evento(s) falhou: {error}")
+        exhausted = [event.id for event in batch if event.attempts >= self.max_attempts]
+        if exhausted:
+            events.filter(id__in=exhausted).update(status='FAILED', last_error=error, **reset)
+            stats['failed'] += len(exhausted)
+
+        retry = [event for event in batch if event.attempts < self.max_attempts]
+        if retry:
+            # Eventos do mesmo POST têm o mesmo número de tentativas, salvo reservas expiradas
+            next_attempt_at = now + self.backoff(max(event.attempts for event in retry))
+            events.filter(id__in=[event.id for event in retry]).update(
+                status='PENDING', next_attempt_at=next_attempt_at, last_error=error, **reset
+            )
+            stats['retried'] += len(retry)
+
+    def run(self, poll_seconds: Optional[float] = None, max_iterations: Optional[int] = None):
+        """Laço do dispatcher: esvazia o que estiver vencido e espera poll_seconds"""
+        poll_seconds = settings.WEBHOOK_POLL_SECONDS if poll_seconds is None else poll_seconds
+        iterations = 0
+        try:
+            while max_iterations is None or iterations < max_iterations:
+                iterations += 1
+                stats = self.dispatch_once()
+                if stats['events'] < self.claim_size:
+                    time.sleep(poll_seconds)
+        finally:
+            self.close()
@@ -0,0 +1,144 @@
+"""
+Roteamento de leituras para a réplica do banco
+
+Views marcadas com @read_from_replica leem do alias REPLICA_DB_ALIAS quando
+ele está configurado (DATABASE_REPLICA_URL); todo o resto, inclusive qualquer
+escrita, usa o primário. Para que o cliente leia o que acabou de gravar mesmo
+com atraso de replicação, ReplicaStickinessMiddleware marca com um cookie
+quem escreveu no primário e, enquanto o cookie vale (REPLICA_STICKY_SECONDS),
+as views marcadas também leem do primário.
+
+O cookie é decidido quando a view devolve a resposta. Views em streaming
+que gravam durante a iteração (SSE de análise) são marcadas com
+@writes_to_primary para receberem o cookie logo de início.
+"""
+
+import contextvars
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = 'replica'
+STICKY_COOKIE = 'db_primary'
+
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+_request_state = contextvars.ContextVar('replica_request_state', default=None)
+
+
+def replica_configured() -> bool:
+    return REPLICA_DB_ALIAS in connections.settings
+
+
+class ReplicaRouter:
+    """Leituras das views marcadas vão para a réplica; escritas sempre para o primário"""
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_configured():
+            return REPLICA_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primário e réplica têm os mesmos dados
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+def _stream_from_replica(content):
+    previous = _use_replica.get()
+    _use_replica.set(True)
+    try:
+        yield from content
+    finally:
+        _use_replica.set(previous)
+
+
+def read_from_replica(view):
+    """
+    Executa a view lendo da réplica, exceto para clientes fixados no primário
+
+    Respostas em streaming consultam o banco durante a iteração, então o
+    conteúdo também é consumido com a réplica ativa.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.COOKIES.get(STICKY_COOKIE) or not replica_configured():
+            return view(request, *args, **kwargs)
+
+        token = _use_replica.set(True)
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+
+        if getattr(response, 'streaming', False):
+            response.streaming_content = _stream_from_replica(response.streaming_content)
+        return response
+
+    return wrapper
+
+
+def writes_to_primary(view):
+    """Marca a view como escritora: a resposta sempre fixa o cliente no primário"""
+    view.writes_to_primary = True
+    return view
+
+
+class ReplicaStickinessMiddleware:
+    """Fixa no primário, por alguns segundos, o cliente que acabou de escrever"""
+
+    # Sob ASGI não força as views assíncronas (SSE) a rodarem em uma thread
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        state = {'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self._mark_sticky(state, response)
+
+    async def __acall__(self, request):
+        state = {'wrote': False}
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self._mark_sticky(state, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _request_state.get()
+        if state is not None and getattr(view_func, 'writes_to_primary', False):
+            state['wrote'] = True
+        return None
+
+    def _mark_sticky(self, state, response):
+        if state['wrote'] and replica_configured():
+            response.set_cookie(
+                STICKY_COOKIE, '1',
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite='Lax'
+            )
+        return response
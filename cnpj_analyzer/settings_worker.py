@@ -0,0 +1,23 @@
+"""
+Perfil enxuto para processos sem HTTP: pool de pontuação do pipeline e
+comandos de lote (resume_batches, refresh_portfolio)
+
+Mesma configuração de cnpj_analyzer.settings (banco, cache, critérios,
+pipeline), sem admin, sessões, mensagens, CORS e middlewares, que só servem
+ao servidor web e pesam na partida de cada processo.
+
+Uso:
+    DJANGO_SETTINGS_MODULE=cnpj_analyzer.settings_worker python manage.py resume_batches
+"""
+
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'analysis',
+]
+
+MIDDLEWARE = []
+
+ROOT_URLCONF = 'cnpj_analyzer.urls_worker'
+
+TEMPLATES = []
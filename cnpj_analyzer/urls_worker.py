@@ -0,0 +1,6 @@
+"""
+URLs do perfil worker: nenhum endpoint (as verificações de sistema dos
+comandos carregam a URLconf, e a principal depende do admin)
+"""
+
+urlpatterns = []
@@ -0,0 +1,44 @@
+"""
+Configuração do gunicorn (lida automaticamente do diretório de trabalho)
+
+    gunicorn cnpj_analyzer.wsgi:application
+
+Com preload_app, o master carrega o Django e executa o preload do warm-up
+(views, URLconf, templates, índices em memória) antes do fork: os workers
+nascem prontos e compartilham essas estruturas copy-on-write. Cada worker
+abre as próprias conexões em post_fork. Sem preload_app, cada worker executa
+o aquecimento completo depois de carregar a aplicação.
+
+Os fluxos SSE ocupam um worker síncrono por até SSE_MAX_SECONDS: o timeout
+padrão deixa uma folga acima desse limite para que nenhum fluxo seja morto
+no meio.
+"""
+
+import multiprocessing
+
+from decouple import config
+
+bind = config('GUNICORN_BIND', default='127.0.0.1:8000')
+workers = config('GUNICORN_WORKERS', default=multiprocessing.cpu_count() * 2 + 1, cast=int)
+sse_max_seconds = config('SSE_MAX_SECONDS', default=45, cast=int)
+timeout = config('GUNICORN_TIMEOUT', default=max(60, sse_max_seconds + 15), cast=int)
+preload_app = config('GUNICORN_PRELOAD', default=True, cast=bool)
+
+
+def when_ready(server):
+    # Master, depois de carregar a aplicação e antes do primeiro fork
+    if server.cfg.preload_app:
+        from analysis.warmup import warm_up
+        warm_up('preload')
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from analysis.warmup import warm_up
+        warm_up('worker')
+
+
+def post_worker_init(worker):
+    if not worker.cfg.preload_app:
+        from analysis.warmup import warm_up
+        warm_up('all')
@@ -3,10 +3,17 @@
 import os
 import sys
 
+# Comandos sem HTTP sobem com o perfil enxuto (DJANGO_SETTINGS_MODULE ainda prevalece)
+WORKER_COMMANDS = {'resume_batches', 'refresh_portfolio', 'dispatch_webhooks', 'flush_api_usage', 'prune_logs'}
+
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cnpj_analyzer.settings')
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    os.environ.setdefault(
+        'DJANGO_SETTINGS_MODULE',
+        'cnpj_analyzer.settings_worker' if command in WORKER_COMMANDS else 'cnpj_analyzer.settings'
+    )
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -9,8 +9,8 @@ import sys
 import django
 from datetime import datetime
 
-# Configuração do Django
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cnpj_analyzer.settings')
+# Configuração do Django (perfil enxuto: o teste só usa engine e modelos)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cnpj_analyzer.settings_worker')
 django.setup()
 
 from analysis.engines import CNPJAnalysisEngine
@@ -112,11 +112,11 @@ def test_api_integration():
         print("Dados obtidos da API com sucesso!")
         
         parsed_data = service.parse_cnpj_data(raw_data)
-        print(f"Empresa: {parsed_data.get('company_name', 'N/A')}")
-        print(f"Status: {parsed_data.get('status', 'N/A')}")
-        print(f"Cidade: {parsed_data.get('city', 'N/A')}")
-        print(f"Estado: {parsed_data.get('state', 'N/A')}")
-        print(f"Capital: R$ {parsed_data.get('equity', 0):,.2f}")
+        print(f"Empresa: {parsed_data.company_name or 'N/A'}")
+        print(f"Status: {parsed_data.status or 'N/A'}")
+        print(f"Cidade: {parsed_data.city or 'N/A'}")
+        print(f"Estado: {parsed_data.state or 'N/A'}")
+        print(f"Capital: R$ {parsed_data.equity or 0:,.2f}")
         print()
     else:
         print("Falha ao obter dados da API")